@@ -0,0 +1,9 @@
+from django.contrib import admin
+from .models import Job
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('task', 'queue', 'status', 'priority', 'attempts', 'run_at', 'updated_at')
+    list_filter = ('status', 'queue', 'task')
+    search_fields = ('task', 'unique_key', 'last_error')
+    readonly_fields = ('locked_by', 'locked_at', 'last_error', 'created_at', 'updated_at')
@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from jobs.worker import Worker
+
+
+class Command(BaseCommand):
+    help = 'Run the background job worker'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queue', action='append', dest='queues', metavar='NAME[=CONCURRENCY]',
+                            help='Queue to process, optionally with its concurrency (default: JOB_QUEUES)')
+        parser.add_argument('--pool', choices=['thread', 'process'], default=settings.JOB_POOL,
+                            help='Run jobs in threads or in separate processes')
+        parser.add_argument('--poll-interval', type=float, default=settings.JOB_POLL_INTERVAL,
+                            help='Seconds to wait when no job is due')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once no job is due instead of waiting for more')
+
+    def handle(self, *args, **options):
+        queues = dict(settings.JOB_QUEUES)
+        if options['queues']:
+            selected = {}
+            for value in options['queues']:
+                name, _, concurrency = value.partition('=')
+                if name not in queues and not concurrency:
+                    raise CommandError(f'Unknown queue {name}; give its concurrency as {name}=N')
+                try:
+                    selected[name] = int(concurrency or queues[name])
+                except ValueError:
+                    raise CommandError(f'Invalid concurrency for queue {name}: {concurrency}')
+            queues = selected
+
+        worker = Worker(queues, pool=options['pool'], poll_interval=options['poll_interval'])
+        self.stdout.write(f'Worker {worker.worker_id} processing {", ".join(f"{q}={n}" for q, n in queues.items())}')
+        processed = worker.run(once=options['once'])
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} jobs.'))
@@ -0,0 +1,51 @@
+from django.db import models
+from django.db.models import Q
+from django.utils import timezone
+
+
+class Job(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    queue = models.CharField(max_length=50, default='default')
+    task = models.CharField(max_length=100)
+    kwargs = models.JSONField(default=dict, blank=True)
+    priority = models.SmallIntegerField(default=0, help_text='Higher runs first.')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    unique_key = models.CharField(max_length=200, null=True, blank=True,
+                                  help_text='At most one queued job per key.')
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Matches the claim query: queued jobs of a queue that are due
+            models.Index(fields=['queue', 'status', '-priority', 'run_at'], name='jobs_claim_idx'),
+        ]
+        constraints = [
+            # A running job does not block a new one: its input may have
+            # changed since it started
+            models.UniqueConstraint(
+                fields=['unique_key'],
+                condition=Q(status='queued'),
+                name='jobs_unique_pending_key',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.task} #{self.pk} ({self.status})'
@@ -0,0 +1,195 @@
+"""
+Database-backed job queue.
+
+Jobs are rows in ``jobs_job``.  A worker (``manage.py run_jobs``) claims due
+jobs with ``SELECT ... FOR UPDATE SKIP LOCKED`` so several workers never
+take the same row, runs them in a thread or process pool and records the
+outcome.  A failed job is retried with exponential backoff until it has
+used ``max_attempts``; a job whose worker died is picked up again once its
+lock is older than ``JOB_LOCK_TIMEOUT_SECS``.
+
+Tasks are plain functions registered with ``@task`` in an app's
+``tasks.py``; their arguments must be JSON serializable:
+
+    @task(queue='media', max_attempts=3)
+    def generate_thumbnails(video_id):
+        ...
+
+    generate_thumbnails.delay(video_id=7)
+"""
+import logging
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+registry = {}
+
+
+class Task:
+    def __init__(self, func, name, queue='default', priority=0, max_attempts=None, every=None):
+        self.func = func
+        self.name = name
+        self.queue = queue
+        self.priority = priority
+        self.max_attempts = max_attempts
+        self.every = every
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def __repr__(self):
+        return f'<Task {self.name}>'
+
+    def delay(self, **kwargs):
+        """Queue the task with its default options."""
+        return self.enqueue(kwargs)
+
+    def enqueue(self, kwargs=None, **options):
+        return enqueue(self.name, kwargs, **options)
+
+
+def task(func=None, *, name=None, queue='default', priority=0, max_attempts=None, every=None):
+    """
+    Register a function as a task.
+
+    ``every`` (seconds) makes it periodic: the worker keeps one run queued
+    that many seconds after the previous one was queued.
+    """
+    def register(func):
+        registered = Task(func, name or f'{func.__module__}.{func.__name__}',
+                          queue=queue, priority=priority, max_attempts=max_attempts, every=every)
+        registry[registered.name] = registered
+        return registered
+    return register(func) if func is not None else register
+
+
+def get_task(name):
+    try:
+        return registry[name]
+    except KeyError:
+        raise LookupError(f'Unknown task: {name}') from None
+
+
+def enqueue(task_name, kwargs=None, *, queue=None, priority=None, run_at=None, delay=None, unique_key=None):
+    """
+    Queue a job and return it.
+
+    With ``unique_key`` at most one job per key is queued at a time; queueing
+    a duplicate returns the job that is already waiting.
+    """
+    registered = get_task(task_name)
+    if run_at is None:
+        run_at = timezone.now() + timedelta(seconds=delay or 0)
+    values = {
+        'task': task_name,
+        'kwargs': kwargs or {},
+        'queue': queue or registered.queue,
+        'priority': registered.priority if priority is None else priority,
+        'max_attempts': registered.max_attempts or settings.JOB_MAX_ATTEMPTS,
+        'run_at': run_at,
+        'unique_key': unique_key,
+    }
+    try:
+        with transaction.atomic():
+            return Job.objects.create(**values)
+    except IntegrityError:
+        if unique_key is None:
+            raise
+        existing = Job.objects.filter(unique_key=unique_key, status=Job.QUEUED).first()
+        if existing is None:
+            # The queued duplicate was claimed in between
+            return enqueue(task_name, kwargs, queue=queue, priority=priority, run_at=run_at, unique_key=unique_key)
+        return existing
+
+
+def claim(queue, limit, worker_id):
+    """Lock up to ``limit`` due jobs of ``queue`` for ``worker_id``, highest priority first."""
+    if limit <= 0:
+        return []
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(queue=queue, status=Job.QUEUED, run_at__lte=now)
+            .order_by('-priority', 'run_at', 'pk')
+            .values_list('pk', flat=True)[:limit]
+        )
+        if not ids:
+            return []
+        Job.objects.filter(pk__in=ids).update(
+            status=Job.RUNNING, locked_by=worker_id, locked_at=now, attempts=F('attempts') + 1,
+        )
+    return list(Job.objects.filter(pk__in=ids).order_by('-priority', 'run_at', 'pk'))
+
+
+def execute(task_name, kwargs):
+    """Run a claimed job's task; called in a pool thread or process."""
+    try:
+        return get_task(task_name)(**kwargs)
+    finally:
+        # Pool threads and processes each hold their own connections
+        connections.close_all()
+
+
+def backoff(attempts):
+    """Seconds to wait before retrying a job that has failed ``attempts`` times."""
+    delay = min(settings.JOB_RETRY_BACKOFF_SECS * 2 ** (attempts - 1), settings.JOB_RETRY_BACKOFF_MAX_SECS)
+    # Jitter keeps jobs that failed together from retrying together
+    return delay * random.uniform(0.5, 1.0)
+
+
+def complete(job, worker_id):
+    Job.objects.filter(pk=job.pk, status=Job.RUNNING, locked_by=worker_id).update(
+        status=Job.DONE, locked_at=None, last_error='',
+    )
+
+
+def fail(job, worker_id, error):
+    """Schedule a retry of ``job``, or mark it failed once it is out of attempts."""
+    running = Job.objects.filter(pk=job.pk, status=Job.RUNNING, locked_by=worker_id)
+    if job.attempts >= job.max_attempts:
+        logger.error('Job %s (%s) failed permanently: %s', job.pk, job.task, error)
+        running.update(status=Job.FAILED, locked_at=None, last_error=error)
+        return
+    logger.warning('Job %s (%s) failed on attempt %d; retrying', job.pk, job.task, job.attempts)
+    try:
+        with transaction.atomic():
+            running.update(
+                status=Job.QUEUED, locked_by='', locked_at=None, last_error=error,
+                run_at=timezone.now() + timedelta(seconds=backoff(job.attempts)),
+            )
+    except IntegrityError:
+        # An identical job was queued meanwhile and will do the work
+        running.update(status=Job.FAILED, locked_at=None, last_error=f'{error}\n(superseded by a queued duplicate)')
+
+
+def recover_stale(timeout=None):
+    """Retry (or fail) running jobs whose worker stopped renewing its lock."""
+    timeout = settings.JOB_LOCK_TIMEOUT_SECS if timeout is None else timeout
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    stale = list(Job.objects.filter(status=Job.RUNNING, locked_at__lt=cutoff))
+    for job in stale:
+        fail(job, job.locked_by, f'Worker {job.locked_by} stopped responding')
+    return len(stale)
+
+
+def schedule_periodic():
+    """Make sure every periodic task has its next run queued."""
+    for registered in registry.values():
+        if registered.every:
+            enqueue(registered.name, delay=registered.every, unique_key=f'periodic:{registered.name}')
+
+
+def purge(older_than):
+    """Delete finished jobs last updated more than ``older_than`` seconds ago."""
+    cutoff = timezone.now() - timedelta(seconds=older_than)
+    deleted, _ = Job.objects.filter(status__in=[Job.DONE, Job.FAILED], updated_at__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,10 @@
+from django.conf import settings
+
+from . import queue
+from .queue import task
+
+
+@task(queue='maintenance', every=86400)
+def purge_jobs():
+    """Delete finished jobs after JOB_RETENTION_SECS."""
+    return queue.purge(settings.JOB_RETENTION_SECS)
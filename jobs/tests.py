@@ -0,0 +1,188 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from jobs import queue
+from jobs.models import Job
+
+calls = []
+
+
+def succeed(value):
+    calls.append(value)
+    return value
+
+
+def explode():
+    raise RuntimeError('boom')
+
+
+@override_settings(JOB_MAX_ATTEMPTS=3, JOB_RETRY_BACKOFF_SECS=10, JOB_RETRY_BACKOFF_MAX_SECS=25,
+                   JOB_LOCK_TIMEOUT_SECS=600)
+class JobQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+        # Only the tasks of these tests, so schedule_periodic() queues nothing else
+        registry = mock.patch.dict(queue.registry, clear=True)
+        registry.start()
+        self.addCleanup(registry.stop)
+        self.succeed = queue.task(succeed, name='tests.succeed', queue='tests')
+        self.explode = queue.task(explode, name='tests.explode', queue='tests', max_attempts=2)
+        self.periodic = queue.task(succeed, name='tests.periodic', queue='tests', every=300)
+
+    def refresh(self, job):
+        job.refresh_from_db()
+        return job
+
+    def make_due(self, job):
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+
+    def test_enqueue_defaults(self):
+        job = self.succeed.delay(value=1)
+        self.assertEqual((job.task, job.queue, job.kwargs, job.status),
+                         ('tests.succeed', 'tests', {'value': 1}, Job.QUEUED))
+        self.assertEqual(job.max_attempts, 3)
+        self.assertEqual(self.explode.delay().max_attempts, 2)
+        later = self.succeed.enqueue({'value': 2}, queue='other', priority=5, delay=60)
+        self.assertEqual((later.queue, later.priority), ('other', 5))
+        self.assertGreater(later.run_at, timezone.now() + timedelta(seconds=50))
+        with self.assertRaises(LookupError):
+            queue.enqueue('tests.unknown')
+
+    def test_unique_key(self):
+        first = self.succeed.enqueue({'value': 1}, unique_key='key')
+        self.assertEqual(self.succeed.enqueue({'value': 2}, unique_key='key'), first)
+        self.assertEqual(Job.objects.count(), 1)
+        # A running job does not block the next one
+        queue.claim('tests', 1, 'worker')
+        second = self.succeed.enqueue({'value': 2}, unique_key='key')
+        self.assertNotEqual(second, first)
+        self.assertEqual(self.succeed.enqueue({'value': 3}, unique_key='key'), second)
+
+    def test_claim(self):
+        low = self.succeed.delay(value='low')
+        high = self.succeed.enqueue({'value': 'high'}, priority=5)
+        self.succeed.enqueue({'value': 'later'}, delay=60)
+        self.succeed.enqueue({'value': 'elsewhere'}, queue='other')
+
+        self.assertEqual(queue.claim('tests', 0, 'worker'), [])
+        claimed = queue.claim('tests', 1, 'worker')
+        self.assertEqual(claimed, [high])
+        self.assertEqual((claimed[0].status, claimed[0].locked_by, claimed[0].attempts), (Job.RUNNING, 'worker', 1))
+        self.assertIsNotNone(claimed[0].locked_at)
+        # Running and future jobs are not claimed again
+        self.assertEqual(queue.claim('tests', 10, 'other worker'), [low])
+        self.assertEqual(queue.claim('tests', 10, 'other worker'), [])
+
+    def test_complete_needs_the_lock(self):
+        job = self.succeed.delay(value=1)
+        [job] = queue.claim('tests', 1, 'worker')
+        queue.complete(job, 'another worker')
+        self.assertEqual(self.refresh(job).status, Job.RUNNING)
+        queue.complete(job, 'worker')
+        self.assertEqual((self.refresh(job).status, job.locked_at), (Job.DONE, None))
+
+    def test_backoff(self):
+        with mock.patch.object(queue.random, 'uniform', return_value=1.0):
+            self.assertEqual([queue.backoff(attempts) for attempts in (1, 2, 3, 4)], [10, 20, 25, 25])
+        for _ in range(20):
+            self.assertTrue(5 <= queue.backoff(1) <= 10)
+
+    def test_retry_until_out_of_attempts(self):
+        job = self.explode.delay()
+        [job] = queue.claim('tests', 1, 'worker')
+        before = timezone.now()
+        with self.assertLogs('jobs.queue', 'WARNING'):
+            queue.fail(job, 'worker', 'RuntimeError: boom')
+        self.refresh(job)
+        self.assertEqual((job.status, job.attempts, job.locked_by, job.last_error),
+                         (Job.QUEUED, 1, '', 'RuntimeError: boom'))
+        self.assertTrue(before + timedelta(seconds=5) <= job.run_at <= timezone.now() + timedelta(seconds=10))
+        # Not due until the backoff is over
+        self.assertEqual(queue.claim('tests', 1, 'worker'), [])
+
+        self.make_due(job)
+        [job] = queue.claim('tests', 1, 'worker')
+        self.assertEqual(job.attempts, 2)
+        with self.assertLogs('jobs.queue', 'ERROR'):
+            queue.fail(job, 'worker', 'RuntimeError: boom')
+        self.assertEqual(self.refresh(job).status, Job.FAILED)
+
+    def test_retry_superseded_by_a_queued_duplicate(self):
+        self.succeed.enqueue({'value': 1}, unique_key='key')
+        [job] = queue.claim('tests', 1, 'worker')
+        self.succeed.enqueue({'value': 2}, unique_key='key')
+        with self.assertLogs('jobs.queue', 'WARNING'):
+            queue.fail(job, 'worker', 'boom')
+        self.refresh(job)
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn('superseded', job.last_error)
+        self.assertEqual(Job.objects.filter(status=Job.QUEUED).count(), 1)
+
+    def test_recover_stale(self):
+        stale, fresh, spent = (self.succeed.delay(value=i) for i in range(3))
+        queue.claim('tests', 3, 'dead worker')
+        Job.objects.filter(pk__in=[stale.pk, spent.pk]).update(locked_at=timezone.now() - timedelta(seconds=601))
+        Job.objects.filter(pk=spent.pk).update(attempts=3)
+
+        with self.assertLogs('jobs.queue', 'WARNING'):
+            self.assertEqual(queue.recover_stale(), 2)
+        self.assertEqual(self.refresh(stale).status, Job.QUEUED)
+        self.assertIn('dead worker stopped responding', stale.last_error)
+        self.assertEqual(self.refresh(fresh).status, Job.RUNNING)
+        self.assertEqual(self.refresh(spent).status, Job.FAILED)
+
+    def test_schedule_periodic(self):
+        for _ in range(2):
+            queue.schedule_periodic()
+        job = Job.objects.get()
+        self.assertEqual((job.task, job.unique_key), ('tests.periodic', 'periodic:tests.periodic'))
+        self.assertAlmostEqual((job.run_at - timezone.now()).total_seconds(), 300, delta=5)
+
+    def test_purge(self):
+        done, failed, queued = (self.succeed.delay(value=i) for i in range(3))
+        Job.objects.filter(pk=done.pk).update(status=Job.DONE, updated_at=timezone.now() - timedelta(days=2))
+        Job.objects.filter(pk=failed.pk).update(status=Job.FAILED, updated_at=timezone.now() - timedelta(days=2))
+        Job.objects.filter(pk=queued.pk).update(updated_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(queue.purge(86400), 2)
+        self.assertEqual(list(Job.objects.all()), [queued])
+
+    def run_jobs(self, *args):
+        out = StringIO()
+        # The worker installs signal handlers, which would outlive the test
+        with mock.patch('jobs.worker.signal.signal'):
+            call_command('run_jobs', '--once', '--queue', 'tests=2', '--pool', 'thread',
+                         '--poll-interval', '0.01', *args, stdout=out)
+        return out.getvalue()
+
+    def test_run_jobs(self):
+        ok = self.succeed.delay(value='ran')
+        failing = self.explode.delay()
+        later = self.succeed.enqueue({'value': 'later'}, delay=60)
+
+        with self.assertLogs('jobs.queue', 'WARNING'):
+            output = self.run_jobs()
+        self.assertIn('Processed 2 jobs.', output)
+        self.assertEqual(calls, ['ran'])
+        self.assertEqual(self.refresh(ok).status, Job.DONE)
+        self.refresh(failing)
+        self.assertEqual((failing.status, failing.attempts), (Job.QUEUED, 1))
+        self.assertEqual(failing.last_error, 'RuntimeError: boom')
+        self.assertEqual(self.refresh(later).status, Job.QUEUED)
+        # Its housekeeping queued the next run of the periodic task
+        self.assertTrue(Job.objects.filter(unique_key='periodic:tests.periodic', status=Job.QUEUED).exists())
+
+        # Retried once due, then given up on
+        self.make_due(failing)
+        with self.assertLogs('jobs.queue', 'ERROR'):
+            self.assertIn('Processed 1 jobs.', self.run_jobs())
+        self.assertEqual(self.refresh(failing).status, Job.FAILED)
+
+    def test_run_jobs_unknown_queue(self):
+        with self.assertRaises(CommandError):
+            call_command('run_jobs', '--once', '--queue', 'nonexistent', stdout=StringIO())
@@ -0,0 +1,106 @@
+import logging
+import os
+import signal
+import socket
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import django
+from django.db import close_old_connections, connections
+from django.utils import timezone
+
+from . import queue as job_queue
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+
+def _init_process():
+    # Children started with spawn/forkserver need the app registry loaded
+    django.setup()
+
+
+class Worker:
+    """
+    Claims jobs from the database and runs them in a pool.
+
+    ``queues`` maps each queue name to the number of its jobs this worker
+    runs at once; the pool has one slot per concurrent job.
+    """
+
+    def __init__(self, queues, pool='thread', poll_interval=1.0, housekeeping_interval=30):
+        self.queues = dict(queues)
+        self.pool = pool
+        self.poll_interval = poll_interval
+        self.housekeeping_interval = housekeeping_interval
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self.active = {}
+        self.stopping = False
+        self.processed = 0
+
+    def _executor(self):
+        workers = sum(self.queues.values())
+        if self.pool == 'process':
+            # Forked children must not share the parent's sockets
+            connections.close_all()
+            return ProcessPoolExecutor(max_workers=workers, initializer=_init_process)
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='jobs')
+
+    def stop(self, *args):
+        self.stopping = True
+
+    def _running(self, queue):
+        return sum(1 for job in self.active.values() if job.queue == queue)
+
+    def _fill(self, executor):
+        claimed = 0
+        for queue, limit in self.queues.items():
+            for job in job_queue.claim(queue, limit - self._running(queue), self.worker_id):
+                self.active[executor.submit(job_queue.execute, job.task, job.kwargs)] = job
+                claimed += 1
+        return claimed
+
+    def _reap(self, futures):
+        for future in futures:
+            job = self.active.pop(future)
+            error = future.exception()
+            if error is None:
+                job_queue.complete(job, self.worker_id)
+            else:
+                job_queue.fail(job, self.worker_id, f'{type(error).__name__}: {error}')
+            self.processed += 1
+
+    def _housekeeping(self):
+        # Renew the locks of running jobs so they are not taken for stale
+        if self.active:
+            Job.objects.filter(
+                pk__in=[job.pk for job in self.active.values()], locked_by=self.worker_id,
+            ).update(locked_at=timezone.now())
+        job_queue.recover_stale()
+        job_queue.schedule_periodic()
+
+    def run(self, once=False):
+        """Process jobs until stopped, or with ``once`` until no job is due."""
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, self.stop)
+        executor = self._executor()
+        next_housekeeping = 0
+        try:
+            while not self.stopping:
+                close_old_connections()
+                if time.monotonic() >= next_housekeeping:
+                    self._housekeeping()
+                    next_housekeeping = time.monotonic() + self.housekeeping_interval
+                claimed = self._fill(executor)
+                if once and not claimed and not self.active:
+                    break
+                if self.active:
+                    done, _ = wait(self.active, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                    self._reap(done)
+                elif not claimed:
+                    time.sleep(self.poll_interval)
+        finally:
+            # Let running jobs finish so they are recorded, not left locked
+            self._reap(wait(self.active).done)
+            executor.shutdown()
+        return self.processed
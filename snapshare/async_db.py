@@ -0,0 +1,60 @@
+"""
+Database access from async views.
+
+Django's async ORM methods (``aget``, ``acount``, ...) all run on the one
+thread-sensitive executor, so awaiting several of them with ``gather()``
+still runs the queries one after another.  ``run()`` instead hands its
+callable to a dedicated pool of ``ASYNC_DB_WORKERS`` threads.  Each of
+those threads holds its own connection, which is checked and closed under
+``CONN_MAX_AGE`` before and after every call the way a WSGI worker's is
+around a request, so at most ``ASYNC_DB_WORKERS`` connections are open per
+process.  ``gather()`` runs several callables at once.
+
+The pool threads run in autocommit and do not see the request thread's
+transaction, so this is for read paths only.  With ``ASYNC_DB_WORKERS = 0``
+everything falls back to the thread-sensitive executor (tests rely on
+this, since their data lives in an open transaction).
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.ASYNC_DB_WORKERS,
+                                               thread_name_prefix='async-db')
+    return _executor
+
+
+def _call(func, args, kwargs):
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run(func, *args, **kwargs):
+    """Await ``func(*args, **kwargs)`` run on a database pool thread."""
+    if not settings.ASYNC_DB_WORKERS:
+        return await sync_to_async(func)(*args, **kwargs)
+    return await sync_to_async(_call, thread_sensitive=False, executor=_get_executor())(func, args, kwargs)
+
+
+async def gather(*funcs):
+    """Run the zero-argument callables concurrently; None entries give None."""
+    async def none():
+        return None
+
+    return await asyncio.gather(*(run(func) if func is not None else none() for func in funcs))
@@ -1,5 +1,13 @@
-﻿from storages.backends.s3boto3 import S3Boto3Storage
+﻿import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from storages.backends.azure_storage import AzureStorage
+from storages.backends.s3boto3 import S3Boto3Storage
+from storages.utils import clean_name
 from django.conf import settings
+from django.core.cache import caches
 
 class MediaStorage(S3Boto3Storage):
     location = 'media'
@@ -9,3 +17,198 @@ def get_storage():
     if settings.DEBUG:
         return None  # Use default file system storage in development
     return MediaStorage()
+
+# Signed media URLs are memoized per blob so every page render (and every
+# worker) hands out the same URL until shortly before it expires. That keeps
+# browser and CDN caches effective and skips the HMAC signing on each call.
+_local_urls = OrderedDict()
+_local_lock = threading.Lock()
+LOCAL_URL_CACHE_SIZE = 4096
+
+
+def _signed_url_lifetime(storage):
+    """Seconds a URL from ``storage`` stays valid, or None if it never expires."""
+    expiration = getattr(storage, 'expiration_secs', None)
+    if expiration:
+        return expiration
+    if getattr(storage, 'querystring_auth', False):
+        return getattr(storage, 'querystring_expire', None)
+    return None
+
+
+def _url_cache_key(storage, name):
+    storage_id = f'{type(storage).__module__}.{type(storage).__name__}'
+    digest = hashlib.md5(f'{storage_id}:{name}'.encode()).hexdigest()
+    return f'mediaurl:{digest}'
+
+
+def _remember_locally(key, url, expires_at):
+    with _local_lock:
+        _local_urls[key] = (url, expires_at)
+        _local_urls.move_to_end(key)
+        while len(_local_urls) > LOCAL_URL_CACHE_SIZE:
+            _local_urls.popitem(last=False)
+
+
+def _recall_locally(key, now):
+    with _local_lock:
+        entry = _local_urls.get(key)
+    if entry and entry[1] > now:
+        return entry[0]
+    return None
+
+
+def resolve_media_urls(file_fields):
+    """
+    Return the URLs for ``file_fields`` (empty fields give None), signing
+    only the ones not already cached. Does one cache round trip for the
+    whole batch, so list pages should resolve their media through this.
+    """
+    now = time.time()
+    urls = [None] * len(file_fields)
+    pending = {}
+    for i, file_field in enumerate(file_fields):
+        if not file_field:
+            continue
+        key = _url_cache_key(file_field.storage, file_field.name)
+        url = _recall_locally(key, now)
+        if url is not None:
+            urls[i] = url
+        else:
+            pending.setdefault(key, []).append(i)
+    if not pending:
+        return urls
+
+    cache = caches[settings.MEDIA_URL_CACHE_ALIAS]
+    margin = settings.MEDIA_URL_EXPIRY_MARGIN_SECS
+    to_store = {}
+    for key, cached in cache.get_many(list(pending)).items():
+        url, expires_at = cached
+        if expires_at - margin > now:
+            _remember_locally(key, url, expires_at - margin)
+            for i in pending.pop(key):
+                urls[i] = url
+
+    for key, indexes in pending.items():
+        file_field = file_fields[indexes[0]]
+        lifetime = _signed_url_lifetime(file_field.storage)
+        url = file_field.url
+        expires_at = now + (lifetime or settings.MEDIA_URL_CACHE_TIMEOUT)
+        to_store[key] = (url, expires_at)
+        _remember_locally(key, url, expires_at - margin)
+        for i in indexes:
+            urls[i] = url
+
+    if to_store:
+        # Unsigned URLs never go stale, so their timeout only bounds memory;
+        # signed ones are dropped once they are inside the safety margin.
+        cache.set_many(to_store, timeout=max(1, int(min(
+            expires_at - margin - now for _, expires_at in to_store.values()
+        ))))
+    return urls
+
+
+def get_azure_media_url(file_field):
+    """Helper function to get Azure Blob Storage URL for media files"""
+    if not file_field:
+        return None
+    return resolve_media_urls([file_field])[0]
+
+
+class RangeReader:
+    """
+    Random access to a stored file that fetches only the byte ranges asked
+    for, instead of downloading the whole blob the way ``storage.open()``
+    does for remote backends. Small reads are widened to ``READ_AHEAD``
+    bytes so neighbouring headers come back in one request.
+    """
+    READ_AHEAD = 64 * 1024
+
+    def __init__(self, storage, name):
+        self.storage = storage
+        self.name = name
+        self._size = None
+        self._block = (0, b'')
+
+    @property
+    def size(self):
+        if self._size is None:
+            self._size = self.storage.size(self.name)
+        return self._size
+
+    def _fetch(self, offset, length):
+        raise NotImplementedError
+
+    def read_at(self, offset, length):
+        """Up to ``length`` bytes starting at ``offset`` (fewer at end of file)."""
+        length = max(0, min(length, self.size - offset))
+        start, data = self._block
+        if start <= offset and offset + length <= start + len(data):
+            return data[offset - start:offset - start + length]
+        if length >= self.READ_AHEAD:
+            return self._fetch(offset, length)
+        data = self._fetch(offset, min(self.READ_AHEAD, self.size - offset))
+        self._block = (offset, data)
+        return data[:length]
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class LocalRangeReader(RangeReader):
+    def __init__(self, storage, name, path):
+        super().__init__(storage, name)
+        self._file = open(path, 'rb')
+
+    def _fetch(self, offset, length):
+        self._file.seek(offset)
+        return self._file.read(length)
+
+    def close(self):
+        self._file.close()
+
+
+class AzureRangeReader(RangeReader):
+    def _fetch(self, offset, length):
+        blob = self.storage.client.get_blob_client(self.storage._get_valid_path(self.name))
+        return blob.download_blob(offset=offset, length=length, timeout=self.storage.timeout).readall()
+
+
+class S3RangeReader(RangeReader):
+    def _fetch(self, offset, length):
+        key = self.storage._normalize_name(clean_name(self.name))
+        response = self.storage.bucket.Object(key).get(Range=f'bytes={offset}-{offset + length - 1}')
+        return response['Body'].read()
+
+
+class FileRangeReader(RangeReader):
+    """Fallback for other storages: seeks in the file ``storage.open()`` returns."""
+
+    def __init__(self, storage, name):
+        super().__init__(storage, name)
+        self._file = storage.open(name, 'rb')
+
+    def _fetch(self, offset, length):
+        self._file.seek(offset)
+        return self._file.read(length)
+
+    def close(self):
+        self._file.close()
+
+
+def open_range_reader(storage, name):
+    try:
+        return LocalRangeReader(storage, name, storage.path(name))
+    except NotImplementedError:
+        pass
+    if isinstance(storage, AzureStorage):
+        return AzureRangeReader(storage, name)
+    if isinstance(storage, S3Boto3Storage):
+        return S3RangeReader(storage, name)
+    return FileRangeReader(storage, name)
@@ -0,0 +1,145 @@
+"""
+Read replicas.
+
+Each host in ``DB_REPLICA_HOSTS`` becomes a database alias (``replica1``,
+``replica2``, ...) with the primary's credentials.  ``ReplicaMiddleware``
+sends the reads of the views named in ``DB_REPLICA_VIEWS`` to one healthy
+replica for the whole request; everything else, every write and any read
+inside a transaction on the primary stays on ``default``.
+
+A request that writes sets a cookie that keeps its client on the primary
+for ``DB_REPLICA_STICKY_SECS``, long enough for the replicas to catch up,
+so users always see their own comments, ratings, likes and uploads.
+
+Replicas are health-checked at most every ``DB_REPLICA_CHECK_INTERVAL``
+seconds per process: one that cannot be reached, or on PostgreSQL lags
+more than ``DB_REPLICA_MAX_LAG_SECS`` behind, is skipped until the next
+check, and with no healthy replica reads fall back to the primary.
+"""
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+STICKY_COOKIE = 'db_primary_until'
+
+# Alias reads go to in the current request (None: the primary)
+_read_alias = ContextVar('db_read_alias', default=None)
+# Whether the current request has written anything
+_wrote = ContextVar('db_wrote', default=None)
+
+_health = {}  # alias: (healthy, checked at)
+_health_lock = threading.Lock()
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias.startswith('replica')]
+
+
+def _check(alias):
+    connection = connections[alias]
+    try:
+        connection.ensure_connection()
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                # NULL on a server that is not replaying WAL, i.e. not a standby
+                cursor.execute('SELECT EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())')
+                lag = cursor.fetchone()[0]
+            if lag is not None and lag > settings.DB_REPLICA_MAX_LAG_SECS:
+                logger.warning('Replica %s is %.0f s behind; reading from the primary', alias, lag)
+                return False
+        return True
+    except DatabaseError as e:
+        logger.warning('Replica %s is unavailable: %s', alias, e)
+        connection.close_if_unusable_or_obsolete()
+        return False
+
+
+def is_healthy(alias):
+    now = time.monotonic()
+    healthy, checked_at = _health.get(alias, (None, 0.0))
+    if healthy is None or now - checked_at >= settings.DB_REPLICA_CHECK_INTERVAL:
+        with _health_lock:
+            healthy, checked_at = _health.get(alias, (None, 0.0))
+            if healthy is None or now - checked_at >= settings.DB_REPLICA_CHECK_INTERVAL:
+                healthy = _check(alias)
+                _health[alias] = (healthy, now)
+    return healthy
+
+
+def healthy_replica():
+    """A random healthy replica alias, or None."""
+    candidates = replica_aliases()
+    random.shuffle(candidates)
+    for alias in candidates:
+        if is_healthy(alias):
+            return alias
+    return None
+
+
+def reading_from_replica():
+    """Whether the current request reads from a replica."""
+    return _read_alias.get() is not None
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = _read_alias.get()
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return alias
+
+    def db_for_write(self, model, **hints):
+        wrote = _wrote.get()
+        if wrote is not None:
+            wrote.append(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        if db in replica_aliases():
+            return False
+        return None
+
+
+class ReplicaMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        wrote = []
+        read_token = _read_alias.set(None)
+        wrote_token = _wrote.set(wrote)
+        try:
+            response = self.get_response(request)
+        finally:
+            _read_alias.reset(read_token)
+            _wrote.reset(wrote_token)
+        if wrote:
+            sticky = settings.DB_REPLICA_STICKY_SECS
+            response.set_cookie(STICKY_COOKIE, str(int(time.time()) + sticky), max_age=sticky,
+                                secure=settings.SESSION_COOKIE_SECURE, httponly=True, samesite='Lax')
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method not in ('GET', 'HEAD') or request.resolver_match.view_name not in settings.DB_REPLICA_VIEWS:
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            # A transaction is already open on the primary (ATOMIC_REQUESTS, tests)
+            return None
+        try:
+            pinned = int(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+        except ValueError:
+            pinned = False
+        if not pinned:
+            _read_alias.set(healthy_replica())
+        return None
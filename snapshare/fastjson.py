@@ -0,0 +1,82 @@
+"""
+JSON output through orjson.
+
+``JsonResponse`` is a drop-in for Django's and ``ORJSONRenderer`` for DRF's
+``JSONRenderer``; both encode several times faster than the standard
+library.  Dates, times, decimals and lazy strings are handed back to
+``DjangoJSONEncoder``, so the output matches what Django produced before.
+
+``StreamingJsonResponse`` writes an object whose iterator values (e.g. a
+``.iterator()`` over thousands of comments) are emitted as arrays item by
+item, in chunks of ``CHUNK_SIZE`` bytes, so the whole list is never held in
+memory.
+"""
+from collections.abc import Iterator
+
+import orjson
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+
+OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+CHUNK_SIZE = 64 * 1024
+
+_default = DjangoJSONEncoder().default
+
+
+def dumps(data):
+    """``data`` as JSON bytes, formatted the way Django's JsonResponse would."""
+    return orjson.dumps(data, default=_default, option=OPTIONS)
+
+
+class JsonResponse(HttpResponse):
+    """django.http.JsonResponse, encoded with orjson."""
+
+    def __init__(self, data, safe=True, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError('In order to allow non-dict objects to be serialized set the safe parameter to False.')
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content=dumps(data), **kwargs)
+
+
+def iter_json(data):
+    """Yield the JSON of the dict ``data`` in chunks; iterator values become arrays."""
+    buffer = bytearray(b'{')
+    for index, (key, value) in enumerate(data.items()):
+        if index:
+            buffer += b','
+        buffer += dumps(key) + b':'
+        if not isinstance(value, Iterator):
+            buffer += dumps(value)
+            continue
+        buffer += b'['
+        for item_index, item in enumerate(value):
+            if item_index:
+                buffer += b','
+            buffer += dumps(item)
+            if len(buffer) >= CHUNK_SIZE:
+                yield bytes(buffer)
+                buffer.clear()
+        buffer += b']'
+    buffer += b'}'
+    yield bytes(buffer)
+
+
+class StreamingJsonResponse(StreamingHttpResponse):
+    """A JSON object streamed as it is encoded, see ``iter_json()``."""
+
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(iter_json(data), **kwargs)
+
+
+class ORJSONRenderer(BaseRenderer):
+    """rest_framework.renderers.JSONRenderer, encoded with orjson."""
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return dumps(data)
@@ -0,0 +1,258 @@
+"""
+Media serving for filesystem storage.
+
+Used when media lives on local disk (``MEDIA_BACKEND=filesystem``) instead
+of Azure.  Unlike ``django.views.static.serve`` it answers conditional
+requests (``If-None-Match``, ``If-Modified-Since``, ``If-Range``) and byte
+ranges, single and multiple, which ``<video>`` needs in order to seek.
+
+Whole files and ranges running to the end of the file are handed to the
+WSGI server's ``wsgi.file_wrapper``, which gunicorn turns into
+``os.sendfile``; anything else, and servers without a file wrapper, get a
+chunked iterator.
+"""
+import mimetypes
+import os
+import re
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+from .cloud_storage import open_range_reader
+
+BLOCK_SIZE = 64 * 1024
+MAX_RANGES = 16
+
+_RANGE_RE = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+
+
+class RangeFile:
+    """
+    ``length`` bytes of an open file starting at ``start``.
+
+    ``fileno()`` is exposed and the descriptor left at ``start`` so a file
+    wrapper can sendfile() from it; ``read()`` stops at the end of the range
+    for the iterator fallback.
+    """
+
+    def __init__(self, path, start, length):
+        self.file = open(path, 'rb')
+        self.file.seek(start)
+        self.remaining = length
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    """
+    [(start, end)] inclusive byte ranges of a ``Range`` header, merged and
+    sorted. Returns None to ignore the header and [] if nothing is satisfiable.
+    """
+    unit, _, spec = (header or '').partition('=')
+    if unit.strip().lower() != 'bytes' or not spec:
+        return None
+    ranges = []
+    for part in spec.split(','):
+        match = _RANGE_RE.match(part)
+        if not match or match.groups() == ('', ''):
+            return None
+        first, last = match.groups()
+        if first == '':
+            # Suffix range: the final `last` bytes
+            if int(last) == 0:
+                continue
+            start, end = max(0, size - int(last)), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            if last and int(last) < start:
+                return None
+            if start >= size:
+                continue
+        ranges.append((start, end))
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _if_range_matches(request, etag, last_modified):
+    condition = request.headers.get('If-Range')
+    if not condition:
+        return True
+    if condition.startswith('W/'):
+        # Only a strong validator allows a partial response
+        return False
+    if condition.startswith('"'):
+        return condition == etag
+    return parse_http_date_safe(condition) == last_modified
+
+
+def _read_range(read_at, start, end):
+    position = start
+    while position <= end:
+        data = read_at(position, min(BLOCK_SIZE, end + 1 - position))
+        if not data:
+            return
+        position += len(data)
+        yield data
+
+
+def _multipart(read_at, ranges, size, content_type, boundary):
+    for start, end in ranges:
+        yield (
+            f'\r\n--{boundary}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+        ).encode()
+        yield from _read_range(read_at, start, end)
+    yield f'\r\n--{boundary}--\r\n'.encode()
+
+
+def _stream(source, read_at, ranges, size=None, content_type=None, boundary=None):
+    """Chunked body for ``ranges``; closes ``source`` when the response is closed."""
+    try:
+        if boundary is None:
+            for start, end in ranges:
+                yield from _read_range(read_at, start, end)
+        else:
+            yield from _multipart(read_at, ranges, size, content_type, boundary)
+    finally:
+        source.close()
+
+
+def _multipart_length(ranges, size, content_type, boundary):
+    overhead = sum(
+        len(f'\r\n--{boundary}\r\nContent-Type: {content_type}\r\n'
+            f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n')
+        for start, end in ranges
+    )
+    return overhead + sum(end + 1 - start for start, end in ranges) + len(f'\r\n--{boundary}--\r\n')
+
+
+@require_safe
+def serve(request, path):
+    storage = default_storage
+    try:
+        full_path = storage.path(path)
+    except SuspiciousFileOperation:
+        raise Http404('Not found')
+    except NotImplementedError:
+        full_path = None
+
+    if full_path is not None:
+        try:
+            stat = os.stat(full_path)
+        except (FileNotFoundError, NotADirectoryError):
+            raise Http404('Not found')
+        if not os.path.isfile(full_path):
+            raise Http404('Not found')
+        size = stat.st_size
+        last_modified = int(stat.st_mtime)
+        etag = f'"{stat.st_mtime_ns:x}-{size:x}"'
+        reader = None
+    else:
+        if not storage.exists(path):
+            raise Http404('Not found')
+        reader = open_range_reader(storage, path)
+        size = reader.size
+        last_modified = int(storage.get_modified_time(path).timestamp())
+        etag = f'"{last_modified:x}-{size:x}"'
+
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = _ranged_response(request, full_path, reader, size, content_type, etag, last_modified)
+    elif reader is not None:
+        reader.close()
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Accept-Ranges'] = 'bytes'
+    patch_cache_control(response, public=True, max_age=settings.MEDIA_CACHE_MAX_AGE)
+    return response
+
+
+def _ranged_response(request, full_path, reader, size, content_type, etag, last_modified):
+    ranges = None
+    if 'Range' in request.headers and _if_range_matches(request, etag, last_modified):
+        ranges = parse_range(request.headers['Range'], size)
+    if ranges == []:
+        if reader is not None:
+            reader.close()
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    if ranges == [(0, size - 1)]:
+        ranges = None
+
+    if request.method == 'HEAD':
+        if reader is not None:
+            reader.close()
+        if ranges and len(ranges) == 1:
+            start, end = ranges[0]
+            response = HttpResponse(content_type=content_type, status=206)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = end + 1 - start
+        else:
+            response = HttpResponse(content_type=content_type)
+            response['Content-Length'] = size
+        return response
+
+    if reader is None and (ranges is None or (len(ranges) == 1 and ranges[0][1] == size - 1)):
+        # Runs to the end of the file, so a file wrapper's sendfile() from
+        # the start of the range is exact
+        start = ranges[0][0] if ranges else 0
+        response = FileResponse(RangeFile(full_path, start, size - start),
+                                content_type=content_type, status=206 if ranges else 200)
+        response['Content-Length'] = size - start
+        if ranges:
+            response['Content-Range'] = f'bytes {start}-{size - 1}/{size}'
+        return response
+
+    if reader is None:
+        reader = open(full_path, 'rb')
+        read_at = lambda offset, length: os.pread(reader.fileno(), length, offset)  # noqa: E731
+    else:
+        read_at = reader.read_at
+
+    if ranges is None:
+        response = StreamingHttpResponse(_stream(reader, read_at, [(0, size - 1)]), content_type=content_type)
+        response['Content-Length'] = size
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        response = StreamingHttpResponse(_stream(reader, read_at, ranges), content_type=content_type, status=206)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end + 1 - start
+    else:
+        boundary = uuid.uuid4().hex
+        response = StreamingHttpResponse(
+            _stream(reader, read_at, ranges, size, content_type, boundary),
+            content_type=f'multipart/byteranges; boundary={boundary}',
+            status=206,
+        )
+        response['Content-Length'] = _multipart_length(ranges, size, content_type, boundary)
+    return response
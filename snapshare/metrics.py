@@ -0,0 +1,331 @@
+"""
+Per-request performance metrics.
+
+``MetricsMiddleware`` records, per URL name and method, the wall time, the
+number and total duration of database queries, the response size and
+whether the response cache was hit.  Values go into fixed-bucket
+histograms held in process memory, so recording costs a lock and a few
+additions.
+
+Every ``METRICS_PUSH_INTERVAL`` seconds a worker copies its (cumulative)
+histograms into ``METRICS_CACHE_ALIAS``; ``/metrics`` sums the copies of
+all live workers and renders them in the Prometheus text format.  That
+needs a cache shared by the workers (Redis or the file cache); with the
+local-memory cache each worker only reports itself.
+
+Requests slower than ``SLOW_REQUEST_MS`` are logged to
+``snapshare.slow_requests`` together with their queries.
+
+Queries are counted by an execute wrapper installed on every connection,
+which adds them to the recorder of the request in the current context.
+Context variables follow a request into ``sync_to_async`` threads, so the
+queries of async views, wherever they run, count too.
+
+``/metrics`` requires ``Authorization: Bearer METRICS_TOKEN``; without a
+token it only answers requests made straight from ``METRICS_ALLOWED_NETWORKS``.
+"""
+import ipaddress
+import logging
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+slow_logger = logging.getLogger('snapshare.slow_requests')
+
+PREFIX = 'snapshare'
+HISTOGRAMS = {
+    # name: (help, buckets)
+    'request_duration_seconds': (
+        'Wall time spent handling a request',
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    ),
+    'db_queries': (
+        'Database queries per request',
+        (0, 1, 2, 5, 10, 20, 50, 100),
+    ),
+    'db_duration_seconds': (
+        'Time spent in database queries per request',
+        (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+    ),
+    'response_size_bytes': (
+        'Size of the response body',
+        (1024, 10240, 102400, 1048576, 10485760),
+    ),
+}
+COUNTERS = {
+    # name: (help, label names)
+    'requests_total': ('Requests handled, by status code', ('view', 'method', 'status')),
+    'response_cache_total': ('Response cache lookups, by result (hit, miss, not_modified)', ('view', 'result')),
+}
+VIEW_LABELS = ('view', 'method')
+MAX_RECORDED_QUERIES = 200
+
+WORKERS_KEY = 'metrics:workers'
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_last_push = 0.0
+# The _QueryRecorder of the request being handled
+_recorder = ContextVar('metrics_recorder', default=None)
+
+
+def _worker_id():
+    # Evaluated on each push: workers forked from a preloaded master share
+    # module state but not their pid
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def observe(name, labels, value):
+    buckets = HISTOGRAMS[name][1]
+    key = (name, labels)
+    with _lock:
+        data = _histograms.get(key)
+        if data is None:
+            # Per-bucket counts (the last one is +Inf), then the sum
+            data = _histograms[key] = [0] * (len(buckets) + 2)
+        data[bisect_left(buckets, value)] += 1
+        data[-1] += value
+
+
+def increment(name, labels, amount=1):
+    key = (name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def snapshot():
+    with _lock:
+        return {'histograms': {key: list(data) for key, data in _histograms.items()},
+                'counters': dict(_counters)}
+
+
+def reset():
+    global _last_push
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+        _last_push = 0.0
+
+
+def _cache():
+    return caches[settings.METRICS_CACHE_ALIAS]
+
+
+def _push_due():
+    return time.monotonic() - _last_push >= settings.METRICS_PUSH_INTERVAL
+
+
+def push(force=False):
+    """Publish this worker's snapshot to the shared cache, at most every METRICS_PUSH_INTERVAL."""
+    global _last_push
+    if not force and not _push_due():
+        return
+    _last_push = time.monotonic()
+    cache = _cache()
+    worker = _worker_id()
+    timeout = settings.METRICS_WORKER_TTL
+    cache.set(f'metrics:worker:{worker}', snapshot(), timeout=timeout)
+    workers = cache.get(WORKERS_KEY) or {}
+    if worker not in workers or workers[worker] < time.time() - timeout / 2:
+        # Racy read-modify-write; a worker that loses re-adds itself next push
+        workers = {name: seen for name, seen in workers.items() if seen > time.time() - timeout}
+        workers[worker] = time.time()
+        cache.set(WORKERS_KEY, workers, timeout=None)
+
+
+def collect():
+    """Sum of the snapshots of every worker that pushed within METRICS_WORKER_TTL."""
+    push(force=True)
+    cache = _cache()
+    workers = cache.get(WORKERS_KEY) or {}
+    snapshots = cache.get_many([f'metrics:worker:{worker}' for worker in workers])
+    histograms, counters = {}, {}
+    for data in snapshots.values():
+        for key, values in data['histograms'].items():
+            total = histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                total[i] += value
+        for key, value in data['counters'].items():
+            counters[key] = counters.get(key, 0) + value
+    return {'histograms': histograms, 'counters': counters, 'workers': len(snapshots)}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, **extra):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra.items())]
+    return '{' + ','.join(pairs) + '}'
+
+
+def render(data):
+    """Prometheus text exposition (format 0.0.4) of collected metrics."""
+    lines = [f'# HELP {PREFIX}_metrics_workers Workers whose metrics are included',
+             f'# TYPE {PREFIX}_metrics_workers gauge',
+             f'{PREFIX}_metrics_workers {data["workers"]}']
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        metric = f'{PREFIX}_{name}'
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} histogram']
+        for (key_name, labels), values in sorted(data['histograms'].items()):
+            if key_name != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ['+Inf'], values[:-1]):
+                cumulative += count
+                lines.append(f'{metric}_bucket{_labels(VIEW_LABELS, labels, le=bound)} {cumulative}')
+            lines.append(f'{metric}_sum{_labels(VIEW_LABELS, labels)} {values[-1]}')
+            lines.append(f'{metric}_count{_labels(VIEW_LABELS, labels)} {cumulative}')
+    for name, (help_text, label_names) in COUNTERS.items():
+        metric = f'{PREFIX}_{name}'
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} counter']
+        for (key_name, labels), value in sorted(data['counters'].items()):
+            if key_name == name:
+                lines.append(f'{metric}{_labels(label_names, labels)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+class _QueryRecorder:
+    """Counts and times the queries of one request, which may run on several threads."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.count += 1
+                self.duration += elapsed
+                if len(self.queries) < MAX_RECORDED_QUERIES:
+                    self.queries.append((elapsed, sql))
+
+
+def _record_query(execute, sql, params, many, context):
+    recorder = _recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def _install(connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        # First: execute_wrapper() blocks pop the last one when they exit
+        connection.execute_wrappers.insert(0, _record_query)
+
+
+# Connections opened from now on, in any thread; the middleware covers
+# those of its own thread that are already open
+connection_created.connect(_install)
+
+
+def _response_size(response):
+    if not response.streaming:
+        return len(response.content)
+    length = response.get('Content-Length')
+    return int(length) if length and length.isdigit() else None
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        for connection in connections.all(initialized_only=True):
+            _install(connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        for connection in connections.all(initialized_only=True):
+            _install(connection)
+        recorder = _QueryRecorder()
+        token = _recorder.set(recorder)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _recorder.reset(token)
+        self._record(request, response, time.perf_counter() - start, recorder)
+        push()
+        return response
+
+    async def __acall__(self, request):
+        recorder = _QueryRecorder()
+        token = _recorder.set(recorder)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _recorder.reset(token)
+        self._record(request, response, time.perf_counter() - start, recorder)
+        if _push_due():
+            # Talks to the cache, so off the event loop
+            await sync_to_async(push)()
+        return response
+
+    def _record(self, request, response, elapsed, recorder):
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else '<unresolved>'
+        labels = (view, request.method)
+        observe('request_duration_seconds', labels, elapsed)
+        observe('db_queries', labels, recorder.count)
+        observe('db_duration_seconds', labels, recorder.duration)
+        size = _response_size(response)
+        if size is not None:
+            observe('response_size_bytes', labels, size)
+        increment('requests_total', labels + (response.status_code,))
+        cache_result = getattr(request, 'response_cache', None)
+        if cache_result:
+            increment('response_cache_total', (view, cache_result))
+
+        if elapsed * 1000 >= settings.SLOW_REQUEST_MS:
+            slow_logger.warning(
+                'Slow request: %s %s (%s) %d in %.0f ms, %d queries in %.0f ms\n%s',
+                request.method, request.get_full_path(), view, response.status_code,
+                elapsed * 1000, recorder.count, recorder.duration * 1000,
+                '\n'.join(f'  {duration * 1000:8.1f} ms  {sql}' for duration, sql in recorder.queries),
+            )
+
+
+def _allowed(request):
+    token = settings.METRICS_TOKEN
+    if token:
+        return constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    # Without a token, only straight from an internal network: a request the
+    # reverse proxy forwarded comes from an internal address too
+    if 'X-Forwarded-For' in request.headers or 'Forwarded' in request.headers:
+        return False
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network) for network in settings.METRICS_ALLOWED_NETWORKS)
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint, for the bearer of METRICS_TOKEN or else METRICS_ALLOWED_NETWORKS."""
+    if not _allowed(request):
+        return HttpResponseForbidden('Forbidden')
+    return HttpResponse(render(collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
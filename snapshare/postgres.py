@@ -0,0 +1,55 @@
+"""
+Vendor-aware migration operations.
+
+The project runs on PostgreSQL, but tests and local setups may use SQLite.
+The ``...IfPostgres`` operations keep their place in the migration state
+everywhere and are skipped at the database level on other backends;
+``AddIndexConcurrently`` degrades to a plain ``CREATE INDEX``.
+"""
+from django.contrib.postgres import operations as postgres_operations
+from django.db import migrations
+
+
+def is_postgres(connection):
+    return connection.vendor == 'postgresql'
+
+
+class PostgresOnlyMixin:
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if is_postgres(schema_editor.connection):
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if is_postgres(schema_editor.connection):
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+    def describe(self):
+        return f'{super().describe()} (PostgreSQL only)'
+
+
+class AddIndexIfPostgres(PostgresOnlyMixin, migrations.AddIndex):
+    pass
+
+
+class RunSQLIfPostgres(PostgresOnlyMixin, migrations.RunSQL):
+    pass
+
+
+class AddIndexConcurrently(postgres_operations.AddIndexConcurrently):
+    """
+    ``CREATE INDEX CONCURRENTLY`` on PostgreSQL, so the table stays writable
+    while the index builds; a regular index elsewhere. Needs ``atomic = False``
+    on the migration.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if is_postgres(schema_editor.connection):
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+        else:
+            migrations.AddIndex.database_forwards(self, app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if is_postgres(schema_editor.connection):
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+        else:
+            migrations.AddIndex.database_backwards(self, app_label, schema_editor, from_state, to_state)
@@ -1,7 +1,8 @@
 import os
+import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
-from decouple import config
+from decouple import Csv, config
 
 load_dotenv()
 
@@ -39,6 +40,7 @@ INSTALLED_APPS = [
     'rest_framework',
     'users',
     'videos',
+    'jobs',
     'widget_tweaks',
     'crispy_forms',
     'storages',
@@ -46,10 +48,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'snapshare.metrics.MetricsMiddleware',  # First, so it times everything below
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # For static files
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'snapshare.db_router.ReplicaMiddleware',  # Routes reads of DB_REPLICA_VIEWS to a replica
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
@@ -91,6 +95,39 @@ DATABASES = {
     }
 }
 
+# DB_ENGINE=sqlite runs on a local SQLite file instead, for tests and
+# offline work (`DB_ENGINE=sqlite python manage.py test`)
+if config('DB_ENGINE', default='postgresql') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': config('SQLITE_PATH', default=os.path.join(BASE_DIR, 'db.sqlite3')),
+        }
+    }
+
+# Read replicas (snapshare.db_router): one alias per host in
+# DB_REPLICA_HOSTS, with the primary's name and credentials. On SQLite the
+# aliases share the database file, which is enough to exercise the router.
+DB_REPLICA_HOSTS = config('DB_REPLICA_HOSTS', default='', cast=Csv())
+for i, host in enumerate(DB_REPLICA_HOSTS, 1):
+    DATABASES[f'replica{i}'] = {**DATABASES['default'], 'HOST': host, 'TEST': {'MIRROR': 'default'}}
+DATABASE_ROUTERS = ['snapshare.db_router.ReplicaRouter']
+DB_REPLICA_VIEWS = [
+    'home', 'video_list_api', 'video_detail_api', 'video_search_api',
+    'video_list_api_async', 'video_detail_api_async',
+]
+# Clients stay on the primary this long after a write; replicas further
+# behind than DB_REPLICA_MAX_LAG_SECS are skipped
+DB_REPLICA_STICKY_SECS = config('DB_REPLICA_STICKY_SECS', default=15, cast=int)
+DB_REPLICA_MAX_LAG_SECS = config('DB_REPLICA_MAX_LAG_SECS', default=15, cast=int)
+DB_REPLICA_CHECK_INTERVAL = config('DB_REPLICA_CHECK_INTERVAL', default=10, cast=int)
+
+# Persistent connections, reused for DB_CONN_MAX_AGE seconds (0 closes
+# them after every request) and checked before reuse
+for database in DATABASES.values():
+    database['CONN_MAX_AGE'] = config('DB_CONN_MAX_AGE', default=60, cast=int)
+    database['CONN_HEALTH_CHECKS'] = True
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -134,6 +171,19 @@ AZURE_URL_EXPIRATION_SECS = 3600  # URL expiration time in seconds
 # Media files will be served from Azure Blob Storage
 MEDIA_URL = f'https://{AZURE_CUSTOM_DOMAIN}/{AZURE_CONTAINER}/'
 
+# MEDIA_BACKEND=filesystem keeps media under MEDIA_ROOT instead (on-prem
+# installs, load tests) and serves it through snapshare.media, which
+# supports range and conditional requests for video playback.
+MEDIA_BACKEND = config('MEDIA_BACKEND', default='azure')
+if MEDIA_BACKEND == 'filesystem':
+    MEDIA_ROOT = config('MEDIA_ROOT', default=os.path.join(BASE_DIR, 'media'))
+    MEDIA_URL = '/media/'
+    STORAGES = {
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': STATICFILES_STORAGE},
+    }
+MEDIA_CACHE_MAX_AGE = config('MEDIA_CACHE_MAX_AGE', default=86400, cast=int)
+
 # Security settings for production
 if not DEBUG:
     SECURE_SSL_REDIRECT = True
@@ -159,9 +209,9 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ],
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'snapshare.fastjson.ORJSONRenderer',
     ] if not DEBUG else [
-        'rest_framework.renderers.JSONRenderer',
+        'snapshare.fastjson.ORJSONRenderer',
         'rest_framework.renderers.BrowsableAPIRenderer',
     ]
 }
@@ -170,9 +220,147 @@ REST_FRAMEWORK = {
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
 
-# File upload settings
-DATA_UPLOAD_MAX_MEMORY_SIZE = 104857600  # 100MB
-FILE_UPLOAD_MAX_MEMORY_SIZE = 104857600  # 100MB
+# File upload settings. Form uploads above 2.5MB spool to a temporary file
+# instead of worker memory; large videos go through the chunked upload API.
+DATA_UPLOAD_MAX_MEMORY_SIZE = 2621440  # 2.5MB
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440  # 2.5MB
+
+# Resumable chunked uploads (videos.chunked_upload). Chunks are staged as
+# Azure blocks when an account key is configured, else as local part files.
+CHUNKED_UPLOAD_BACKEND = config('CHUNKED_UPLOAD_BACKEND', default='azure' if AZURE_ACCOUNT_KEY else 'filesystem')
+CHUNKED_UPLOAD_DIR = config('CHUNKED_UPLOAD_DIR', default=os.path.join(tempfile.gettempdir(), 'snapshare-uploads'))
+CHUNKED_UPLOAD_CHUNK_SIZE = config('CHUNKED_UPLOAD_CHUNK_SIZE', default=8388608, cast=int)  # 8MB
+CHUNKED_UPLOAD_MAX_CHUNK_SIZE = config('CHUNKED_UPLOAD_MAX_CHUNK_SIZE', default=33554432, cast=int)  # 32MB
+CHUNKED_UPLOAD_MAX_SIZE = config('CHUNKED_UPLOAD_MAX_SIZE', default=2147483648, cast=int)  # 2GB
+CHUNKED_UPLOAD_EXPIRY_SECS = config('CHUNKED_UPLOAD_EXPIRY_SECS', default=86400, cast=int)
+
+# Cache configuration: Redis when REDIS_URL is set (shared by all workers),
+# otherwise a file-based cache in CACHE_DIR, otherwise local memory.
+REDIS_URL = config('REDIS_URL', default='')
+CACHE_DIR = config('CACHE_DIR', default='')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+elif CACHE_DIR:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': CACHE_DIR,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'snapshare',
+        }
+    }
+
+# Response cache for home and the public API. Entries are invalidated by
+# version bumps from model signals; the timeout only bounds memory use.
+# Off when the alias is a per-process (local memory) cache, which would miss
+# the bumps of every other process: set REDIS_URL or CACHE_DIR to enable it.
+# The ETags and Last-Modified times that answer conditional GETs with 304 come
+# from the same versions, so without a shared cache there are none either.
+RESPONSE_CACHE_ALIAS = config('RESPONSE_CACHE_ALIAS', default='default')
+RESPONSE_CACHE_TIMEOUT = config('RESPONSE_CACHE_TIMEOUT', default=86400, cast=int)
+
+# Media URLs (signed ones included) are reused until
+# MEDIA_URL_EXPIRY_MARGIN_SECS before they expire.
+MEDIA_URL_CACHE_ALIAS = config('MEDIA_URL_CACHE_ALIAS', default='default')
+MEDIA_URL_EXPIRY_MARGIN_SECS = config('MEDIA_URL_EXPIRY_MARGIN_SECS', default=300, cast=int)
+MEDIA_URL_CACHE_TIMEOUT = config('MEDIA_URL_CACHE_TIMEOUT', default=86400, cast=int)
+
+# Direct-to-Azure upload tokens: write-only, scoped to one server-chosen
+# blob, and reused until UPLOAD_TOKEN_REUSE_MARGIN_SECS before expiry.
+UPLOAD_TOKEN_CACHE_ALIAS = config('UPLOAD_TOKEN_CACHE_ALIAS', default='default')
+UPLOAD_TOKEN_LIFETIME_SECS = config('UPLOAD_TOKEN_LIFETIME_SECS', default=3600, cast=int)
+UPLOAD_TOKEN_REUSE_MARGIN_SECS = config('UPLOAD_TOKEN_REUSE_MARGIN_SECS', default=600, cast=int)
+UPLOAD_CLAIM_TIMEOUT = config('UPLOAD_CLAIM_TIMEOUT', default=86400, cast=int)
+
+# Thumbnail derivatives: widths rendered as WebP and JPEG after upload
+THUMBNAIL_WIDTHS = [160, 320, 640, 1280]
+
+# Text search configuration for the video search vectors (videos.search)
+SEARCH_CONFIG = config('SEARCH_CONFIG', default='english')
+
+# Copy uploads whose moov box trails the media data into faststart layout
+# (videos.media_info) so playback can start before the whole file arrives.
+VIDEO_FASTSTART_REWRITE = config('VIDEO_FASTSTART_REWRITE', default=False, cast=bool)
+
+# Background jobs (jobs app, run by `manage.py run_jobs`). JOB_QUEUES maps
+# each queue to the number of its jobs one worker runs at once.
+JOB_QUEUES = {
+    'default': config('JOB_CONCURRENCY_DEFAULT', default=2, cast=int),
+    'media': config('JOB_CONCURRENCY_MEDIA', default=2, cast=int),
+    'maintenance': config('JOB_CONCURRENCY_MAINTENANCE', default=1, cast=int),
+}
+JOB_POOL = config('JOB_POOL', default='thread')  # 'thread' or 'process'
+JOB_POLL_INTERVAL = config('JOB_POLL_INTERVAL', default=1.0, cast=float)
+JOB_MAX_ATTEMPTS = config('JOB_MAX_ATTEMPTS', default=5, cast=int)
+JOB_RETRY_BACKOFF_SECS = config('JOB_RETRY_BACKOFF_SECS', default=10, cast=int)
+JOB_RETRY_BACKOFF_MAX_SECS = config('JOB_RETRY_BACKOFF_MAX_SECS', default=3600, cast=int)
+JOB_LOCK_TIMEOUT_SECS = config('JOB_LOCK_TIMEOUT_SECS', default=600, cast=int)
+JOB_RETENTION_SECS = config('JOB_RETENTION_SECS', default=7 * 86400, cast=int)
+
+# Threads (each with its own database connection) that run the queries of
+# the async API views, see snapshare.async_db; 0 runs them on Django's
+# single thread-sensitive executor instead.
+ASYNC_DB_WORKERS = config('ASYNC_DB_WORKERS', default=8, cast=int)
+
+# Trending and top-this-week feeds (videos.ranking): activity weights, the
+# half-life of the trending decay, the window both feeds look back over and
+# how often the scores of recently active videos are recomputed.
+RANKING_WEIGHTS = {
+    'views': config('RANKING_WEIGHT_VIEWS', default=1.0, cast=float),
+    'likes': config('RANKING_WEIGHT_LIKES', default=20.0, cast=float),
+    'comments': config('RANKING_WEIGHT_COMMENTS', default=10.0, cast=float),
+    'rating_sum': config('RANKING_WEIGHT_STARS', default=2.0, cast=float),
+}
+RANKING_HALF_LIFE_HOURS = config('RANKING_HALF_LIFE_HOURS', default=12.0, cast=float)
+RANKING_WINDOW_DAYS = config('RANKING_WINDOW_DAYS', default=7, cast=int)
+RANKING_UPDATE_INTERVAL = config('RANKING_UPDATE_INTERVAL', default=300, cast=int)
+
+# "More like this" recommendations (videos.recommendations): neighbors kept
+# per video, how strongly similarity is discounted for pairs few users
+# share, and how often videos with new likes or ratings are refreshed.
+RECOMMENDATION_NEIGHBORS = config('RECOMMENDATION_NEIGHBORS', default=20, cast=int)
+RECOMMENDATION_SHRINKAGE = config('RECOMMENDATION_SHRINKAGE', default=10.0, cast=float)
+RECOMMENDATION_REFRESH_INTERVAL = config('RECOMMENDATION_REFRESH_INTERVAL', default=900, cast=int)
+
+# video_detail_api streams the comments of videos with more than this many
+# instead of building the whole response in memory
+API_STREAM_COMMENTS_OVER = config('API_STREAM_COMMENTS_OVER', default=1000, cast=int)
+
+# Request metrics (snapshare.metrics). Each worker pushes its histograms to
+# METRICS_CACHE_ALIAS every METRICS_PUSH_INTERVAL seconds; /metrics sums the
+# workers seen within METRICS_WORKER_TTL. Set METRICS_TOKEN to require
+# `Authorization: Bearer <token>` on /metrics; without one, /metrics only
+# answers requests from METRICS_ALLOWED_NETWORKS that did not come through a
+# proxy (no X-Forwarded-For), e.g. a Prometheus scraping the workers directly.
+METRICS_CACHE_ALIAS = config('METRICS_CACHE_ALIAS', default='default')
+METRICS_PUSH_INTERVAL = config('METRICS_PUSH_INTERVAL', default=10, cast=int)
+METRICS_WORKER_TTL = config('METRICS_WORKER_TTL', default=3600, cast=int)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+METRICS_ALLOWED_NETWORKS = config(
+    'METRICS_ALLOWED_NETWORKS', cast=Csv(),
+    default='127.0.0.0/8,::1/128,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16,fc00::/7',
+)
+# Requests slower than this are logged with their queries
+SLOW_REQUEST_MS = config('SLOW_REQUEST_MS', default=1000, cast=int)
+
+# Buffered view counting: views are held in this cache and written to the
+# database by the flush_views job every VIEW_COUNT_FLUSH_INTERVAL seconds, or
+# sooner once VIEW_COUNT_MAX_PENDING views (the most that can be lost) have
+# piled up. That needs Redis (or memcached) here: with a local-memory or file
+# cache every view is written to the database as it happens.
+VIEW_COUNT_CACHE_ALIAS = config('VIEW_COUNT_CACHE_ALIAS', default='default')
+VIEW_COUNT_FLUSH_INTERVAL = config('VIEW_COUNT_FLUSH_INTERVAL', default=30, cast=int)
+VIEW_COUNT_MAX_PENDING = config('VIEW_COUNT_MAX_PENDING', default=500, cast=int)
 
 # Logging configuration
 LOGGING = {
@@ -205,5 +393,10 @@ LOGGING = {
             'level': os.getenv('DJANGO_LOG_LEVEL', 'INFO'),
             'propagate': False,
         },
+        'snapshare.slow_requests': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
     },
 }
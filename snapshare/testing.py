@@ -0,0 +1,195 @@
+"""
+Query-budget test harness.
+
+A test case lists a ``Budget`` for every URL name of an app: the most
+queries the view may issue for an anonymous and for a signed-in user.
+Each view is requested against a small dataset, the dataset is then grown
+(more users, videos, comments, ratings and likes, also on the very video
+and user being requested) and the view requested again.  The test fails
+if a view exceeds its budget or issues more queries on the larger dataset,
+which is how an N+1 shows up.
+
+Runs on SQLite (``DB_ENGINE=sqlite``) and PostgreSQL.
+"""
+import json
+import shutil
+import tempfile
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, get_resolver, reverse
+
+from videos import recommendations
+from videos.models import Comment, Rating, UploadChunk, UploadSession, Video
+
+ROLES = ('anonymous', 'authenticated')
+
+
+class Budget:
+    """
+    Query budget of one URL name. ``args`` is called with the test case and
+    returns the URL arguments; ``user`` names the fixture user ('consumer'
+    or 'creator') signed in for the authenticated run.
+    """
+
+    def __init__(self, url_name, anonymous, authenticated, *, method='get', args=None, data=None,
+                 json_body=False, user='consumer'):
+        self.url_name = url_name
+        self.limits = {'anonymous': anonymous, 'authenticated': authenticated}
+        self.method = method
+        self.args = args
+        self.data = data
+        self.json_body = json_body
+        self.user = user
+
+
+def url_names(urlconf_module):
+    """Names of the URL patterns declared by ``urlconf_module`` (includes followed)."""
+    names = set()
+
+    def walk(patterns):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                walk(pattern.url_patterns)
+            elif isinstance(pattern, URLPattern) and pattern.name:
+                names.add(pattern.name)
+
+    walk(get_resolver(urlconf_module).url_patterns)
+    return names
+
+
+# Local media and a private cache, so no test touches Azure or Redis
+TEST_SETTINGS = {
+    'CACHES': {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'query-budget'}},
+    'STORAGES': {
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    },
+    'MEDIA_URL': '/media/',
+    'CHUNKED_UPLOAD_BACKEND': 'filesystem',
+    'PASSWORD_HASHERS': ['django.contrib.auth.hashers.MD5PasswordHasher'],
+    # Async views must see the test transaction
+    'ASYNC_DB_WORKERS': 0,
+}
+
+
+class QueryBudgetMixin:
+    """
+    Mixed into a ``TestCase``; subclasses set ``urlconf`` (a module path)
+    and ``budgets``.
+    """
+
+    urlconf = None
+    budgets = ()
+    # Extra rows added by grow(); enough that a per-row query stands out
+    growth = 25
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls._settings_override = override_settings(MEDIA_ROOT=cls.media_root, **TEST_SETTINGS)
+        cls._settings_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._settings_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.creator = User.objects.create_user('budget_creator', 'creator@example.com', 'pw', role=User.CREATOR)
+        cls.consumer = User.objects.create_user('budget_consumer', 'consumer@example.com', 'pw')
+        cls.video = Video.objects.create(
+            title='Budget video', description='Measured', video_file='videos/budget.mp4',
+            thumbnail='thumbnails/budget.jpg', creator=cls.creator, publisher='p', producer='p',
+            genre='drama', age_rating='G',
+        )
+        cls.video.add_comment(cls.consumer, 'First')
+        cls.upload_session = UploadSession.objects.create(
+            user=cls.creator, kind='video', filename='budget.mp4', blob_name='videos/budget-upload.mp4',
+            total_size=1024, chunk_size=512,
+        )
+        call_command('seed_snapshare', users=3, videos=3, comments=5, ratings=5, likes=5, prefix='small',
+                     stdout=StringIO())
+        recommendations.rebuild()
+
+    def grow(self):
+        """Add rows everywhere, including on the measured video and users."""
+        User = get_user_model()
+        n = self.growth
+        call_command('seed_snapshare', users=n, videos=n * 2, comments=n * 10, ratings=n * 5, likes=n * 5,
+                     prefix='large', stdout=StringIO())
+        others = list(User.objects.filter(username__startswith='large_')[:n])
+        extra = Video.objects.bulk_create([
+            Video(title=f'More {i}', description='More', video_file='videos/more.mp4',
+                  thumbnail='thumbnails/more.jpg', creator=self.creator, publisher='p', producer='p',
+                  genre='drama', age_rating='G')
+            for i in range(n)
+        ])
+        Comment.objects.bulk_create(
+            [Comment(video=self.video, user=user, text='More') for user in others]
+            + [Comment(video=video, user=self.consumer, text='Mine') for video in extra]
+        )
+        Rating.objects.bulk_create(
+            [Rating(video=self.video, user=user, rating=4) for user in others]
+            + [Rating(video=video, user=self.consumer, rating=3) for video in extra]
+        )
+        self.video.likes.add(*others)
+        self.consumer.liked_videos.add(*extra)
+        UploadChunk.objects.bulk_create([
+            UploadChunk(session=self.upload_session, index=0, offset=0, size=512, checksum='0' * 64),
+        ])
+        Video.objects.reconcile_counters()
+        recommendations.rebuild()
+
+    def measure(self, budget, role):
+        """Queries issued by one request; its writes are rolled back."""
+        client = self.client_class()
+        if role == 'authenticated':
+            client.force_login(getattr(self, budget.user))
+        url = reverse(budget.url_name, args=budget.args(self) if budget.args else [])
+        kwargs = {'secure': True}
+        if budget.data is not None:
+            if budget.json_body:
+                kwargs.update(data=json.dumps(budget.data), content_type='application/json')
+            else:
+                kwargs['data'] = budget.data
+        caches['default'].clear()
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as captured:
+                response = getattr(client, budget.method)(url, **kwargs)
+            transaction.set_rollback(True)
+        self.assertLess(response.status_code, 500, f'{budget.url_name} ({role}) failed')
+        return len(captured), [query['sql'] for query in captured.captured_queries]
+
+    def test_every_url_has_a_budget(self):
+        missing = url_names(self.urlconf) - {budget.url_name for budget in self.budgets}
+        self.assertFalse(missing, f'URL names without a query budget: {sorted(missing)}')
+
+    def test_query_budgets(self):
+        cases = [(budget, role) for budget in self.budgets for role in ROLES]
+        small = {case: self.measure(*case) for case in cases}
+        self.grow()
+        for budget, role in cases:
+            with self.subTest(url_name=budget.url_name, role=role):
+                count, queries = self.measure(budget, role)
+                small_count = small[budget, role][0]
+                limit = budget.limits[role]
+                self.assertLessEqual(
+                    count, small_count,
+                    f'{budget.url_name} ({role}) issued {small_count} queries on the small dataset and {count} '
+                    f'on the large one:\n' + '\n'.join(queries),
+                )
+                self.assertLessEqual(
+                    count, limit,
+                    f'{budget.url_name} ({role}) issued {count} queries, over its budget of {limit}:\n'
+                    + '\n'.join(queries),
+                )
@@ -0,0 +1,416 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import date, datetime, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django import http
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import resolve
+from django.utils.http import http_date
+
+from snapshare import cloud_storage, db_router, fastjson, media, metrics
+from snapshare.testing import TEST_SETTINGS
+from videos.models import Video
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = db_router.ReplicaRouter()
+        db_router._health.clear()
+
+    def request(self, method='get', path='/api/videos/', cookies=None, write=False):
+        """(read alias seen by the view, response) of a request through ReplicaMiddleware."""
+        request = getattr(RequestFactory(), method)(path)
+        request.resolver_match = resolve(path)
+        request.COOKIES.update(cookies or {})
+        seen = []
+
+        def get_response(request):
+            middleware.process_view(request, request.resolver_match.func, (), {})
+            seen.append(self.router.db_for_read(Video))
+            if write:
+                self.router.db_for_write(Video)
+            return HttpResponse()
+
+        middleware = db_router.ReplicaMiddleware(get_response)
+        with mock.patch.object(db_router, 'healthy_replica', return_value='replica1'):
+            response = middleware(request)
+        return seen[0], response
+
+    def test_replica_view_reads_from_replica(self):
+        alias, response = self.request()
+        self.assertEqual(alias, 'replica1')
+        self.assertNotIn(db_router.STICKY_COOKIE, response.cookies)
+        # Nothing leaks out of the request
+        self.assertIsNone(self.router.db_for_read(Video))
+        self.assertFalse(db_router.reading_from_replica())
+
+    def test_other_views_and_methods_use_primary(self):
+        self.assertIsNone(self.request(path='/upload/')[0])
+        self.assertIsNone(self.request(method='post')[0])
+
+    def test_write_sets_sticky_cookie(self):
+        with override_settings(DB_REPLICA_STICKY_SECS=15):
+            _, response = self.request(write=True)
+        cookie = response.cookies[db_router.STICKY_COOKIE]
+        self.assertEqual(cookie['max-age'], 15)
+        self.assertTrue(cookie['httponly'])
+        self.assertAlmostEqual(int(cookie.value), time.time() + 15, delta=2)
+
+    def test_sticky_cookie_pins_to_primary(self):
+        until = str(int(time.time()) + 10)
+        self.assertIsNone(self.request(cookies={db_router.STICKY_COOKIE: until})[0])
+        expired = str(int(time.time()) - 1)
+        self.assertEqual(self.request(cookies={db_router.STICKY_COOKIE: expired})[0], 'replica1')
+        self.assertEqual(self.request(cookies={db_router.STICKY_COOKIE: 'junk'})[0], 'replica1')
+
+    def test_writes_always_go_to_primary(self):
+        token = db_router._read_alias.set('replica1')
+        try:
+            self.assertEqual(self.router.db_for_write(Video), 'default')
+        finally:
+            db_router._read_alias.reset(token)
+
+    def test_migrations_skip_replicas(self):
+        with mock.patch.object(db_router, 'replica_aliases', return_value=['replica1']):
+            self.assertIs(self.router.allow_migrate('replica1', 'videos'), False)
+            self.assertIsNone(self.router.allow_migrate('default', 'videos'))
+
+    @override_settings(DB_REPLICA_CHECK_INTERVAL=60)
+    def test_health_checks_are_cached_and_skip_unhealthy(self):
+        health = {'replica1': False, 'replica2': True}
+        with mock.patch.object(db_router, 'replica_aliases', return_value=list(health)), \
+                mock.patch.object(db_router, '_check', side_effect=health.get) as check:
+            for _ in range(3):
+                self.assertEqual(db_router.healthy_replica(), 'replica2')
+            self.assertLessEqual(check.call_count, 2)
+            health['replica2'] = False
+            # Still within the check interval
+            self.assertEqual(db_router.healthy_replica(), 'replica2')
+            db_router._health.clear()
+            self.assertIsNone(db_router.healthy_replica())
+
+
+class ReplicaTransactionTests(TestCase):
+    def test_reads_inside_a_transaction_use_primary(self):
+        router = db_router.ReplicaRouter()
+        token = db_router._read_alias.set('replica1')
+        try:
+            # TestCase wraps every test in a transaction on the primary
+            self.assertIsNone(router.db_for_read(Video))
+        finally:
+            db_router._read_alias.reset(token)
+
+
+class FastJsonTests(SimpleTestCase):
+    data = {
+        'created_at': datetime(2026, 1, 10, 12, 30, 0, 123456, tzinfo=dt_timezone.utc),
+        'day': date(2026, 1, 10),
+        'price': Decimal('1.50'),
+        'nested': {'ids': [1, 2], 'name': 'caf\u00e9'},
+        'comments': [{'id': i, 'created_at': datetime(2026, 1, i, tzinfo=dt_timezone.utc)} for i in range(1, 30)],
+    }
+
+    def streamed(self, data):
+        response = fastjson.StreamingJsonResponse(data)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        return list(response.streaming_content)
+
+    def test_formatted_like_django(self):
+        content = fastjson.JsonResponse(self.data).content
+        self.assertEqual(json.loads(content), json.loads(http.JsonResponse(self.data).content))
+        self.assertIn(b'"created_at":"2026-01-10T12:30:00.123Z"', content)
+        self.assertIn(b'"day":"2026-01-10"', content)
+        self.assertIn(b'"price":"1.50"', content)
+        with self.assertRaises(TypeError):
+            fastjson.JsonResponse([])
+
+    def test_streamed_matches_json_response(self):
+        expected = json.loads(fastjson.JsonResponse(self.data).content)
+        for chunk_size in (fastjson.CHUNK_SIZE, 100):
+            with mock.patch.object(fastjson, 'CHUNK_SIZE', chunk_size):
+                chunks = self.streamed({**self.data, 'comments': iter(self.data['comments'])})
+            self.assertEqual(json.loads(b''.join(chunks)), expected)
+        # Small chunks flush the array part by part
+        self.assertGreater(len(chunks), 1)
+
+    def test_streamed_empty(self):
+        self.assertEqual(b''.join(self.streamed({'comments': iter([])})), b'{"comments":[]}')
+        self.assertEqual(b''.join(self.streamed({'comments': iter([]), 'count': 0})), b'{"comments":[],"count":0}')
+        self.assertEqual(b''.join(self.streamed({})), b'{}')
+
+
+@override_settings(**TEST_SETTINGS)
+class MediaServeTests(SimpleTestCase):
+    DATA = bytes(range(256)) * 4  # 1024 bytes
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        settings = self.settings(MEDIA_ROOT=root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        os.makedirs(os.path.join(root, 'videos'))
+        self.path = os.path.join(root, 'videos', 'clip.mp4')
+        with open(self.path, 'wb') as f:
+            f.write(self.DATA)
+
+    def get(self, method='get', **headers):
+        request = getattr(RequestFactory(), method)('/media/videos/clip.mp4', headers=headers)
+        response = media.serve(request, 'videos/clip.mp4')
+        self.addCleanup(response.close)
+        return response
+
+    def body(self, response):
+        if response.streaming:
+            return b''.join(response.streaming_content)
+        return response.content
+
+    def assertPartial(self, response, start, end):
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes {start}-{end}/{len(self.DATA)}')
+        self.assertEqual(int(response['Content-Length']), end + 1 - start)
+        self.assertEqual(self.body(response), self.DATA[start:end + 1])
+
+    def test_parse_range(self):
+        self.assertEqual(media.parse_range('bytes=0-99', 1000), [(0, 99)])
+        self.assertEqual(media.parse_range('bytes=-100', 1000), [(900, 999)])
+        self.assertEqual(media.parse_range('bytes=-5000', 1000), [(0, 999)])
+        self.assertEqual(media.parse_range('bytes=900-', 1000), [(900, 999)])
+        self.assertEqual(media.parse_range('bytes=900-5000', 1000), [(900, 999)])
+        # Sorted, with overlapping and adjacent ranges merged
+        self.assertEqual(media.parse_range('bytes=500-599, 0-9, 5-20, 21-30', 1000), [(0, 30), (500, 599)])
+        # Nothing satisfiable
+        self.assertEqual(media.parse_range('bytes=1000-', 1000), [])
+        self.assertEqual(media.parse_range('bytes=-0', 1000), [])
+        # Ignored altogether
+        for header in (None, '', 'items=0-1', 'bytes=', 'bytes=5-1', 'bytes=a-b', 'bytes=-',
+                       'bytes=' + ','.join(f'{i * 10}-{i * 10}' for i in range(media.MAX_RANGES + 1))):
+            self.assertIsNone(media.parse_range(header, 1000), header)
+
+    def test_whole_file(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'video/mp4')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(int(response['Content-Length']), len(self.DATA))
+        self.assertEqual(self.body(response), self.DATA)
+
+    def test_single_range(self):
+        self.assertPartial(self.get(Range='bytes=100-199'), 100, 199)
+
+    def test_suffix_range(self):
+        self.assertPartial(self.get(Range='bytes=-24'), 1000, 1023)
+
+    def test_open_ended_range(self):
+        self.assertPartial(self.get(Range='bytes=1000-'), 1000, 1023)
+
+    def test_range_covering_the_file_is_a_full_response(self):
+        response = self.get(Range='bytes=0-')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.DATA)
+
+    def test_head_range(self):
+        response = self.get(method='head', Range='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(response.content, b'')
+
+    def test_multiple_ranges(self):
+        response = self.get(Range='bytes=0-9, 1000-')
+        self.assertEqual(response.status_code, 206)
+        content_type, _, boundary = response['Content-Type'].partition('; boundary=')
+        self.assertEqual(content_type, 'multipart/byteranges')
+        body = self.body(response)
+        self.assertEqual(int(response['Content-Length']), len(body))
+        parts = body.split(f'--{boundary}'.encode())
+        self.assertEqual(parts[0], b'\r\n')
+        self.assertEqual(parts[-1], b'--\r\n')
+        for part, (start, end) in zip(parts[1:-1], [(0, 9), (1000, 1023)]):
+            headers, _, data = part.partition(b'\r\n\r\n')
+            self.assertIn(f'Content-Range: bytes {start}-{end}/1024'.encode(), headers)
+            self.assertIn(b'Content-Type: video/mp4', headers)
+            self.assertEqual(data, self.DATA[start:end + 1] + b'\r\n')
+
+    def test_unsatisfiable_range(self):
+        response = self.get(Range='bytes=2000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+
+    def test_if_range(self):
+        response = self.get()
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertPartial(self.get(Range='bytes=0-9', If_Range=etag), 0, 9)
+        self.assertPartial(self.get(Range='bytes=0-9', If_Range=last_modified), 0, 9)
+
+    def test_stale_if_range_sends_the_whole_file(self):
+        mtime = os.stat(self.path).st_mtime
+        for condition in ('"stale"', f'W/{self.get()["ETag"]}', http_date(mtime - 60)):
+            response = self.get(Range='bytes=0-9', If_Range=condition)
+            self.assertEqual(response.status_code, 200, condition)
+            self.assertEqual(self.body(response), self.DATA)
+
+    def test_not_modified(self):
+        response = self.get()
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        for headers in ({'If-None-Match': etag}, {'If-Modified-Since': last_modified},
+                        {'If-None-Match': etag, 'Range': 'bytes=0-9'}):
+            response = self.get(**headers)
+            self.assertEqual(response.status_code, 304, headers)
+            self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.get(If_None_Match='"other"').status_code, 200)
+
+    def test_changed_file_gets_a_new_etag(self):
+        etag = self.get()['ETag']
+        with open(self.path, 'ab') as f:
+            f.write(b'more')
+        response = self.get(If_None_Match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_missing_and_outside_files(self):
+        for path in ('videos/none.mp4', 'videos', '../etc/passwd'):
+            request = RequestFactory().get(f'/media/{path}')
+            with self.assertRaises(media.Http404, msg=path):
+                media.serve(request, path)
+
+
+@override_settings(**TEST_SETTINGS)
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def scrape(self, remote_addr='127.0.0.1', **headers):
+        request = RequestFactory().get('/metrics', REMOTE_ADDR=remote_addr, headers=headers)
+        return metrics.metrics_view(request)
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_token(self):
+        self.assertEqual(self.scrape().status_code, 403)
+        self.assertEqual(self.scrape(Authorization='Bearer wrong').status_code, 403)
+        response = self.scrape(remote_addr='203.0.113.5', Authorization='Bearer s3cret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'snapshare_metrics_workers 1', response.content)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_internal_networks_without_token(self):
+        for address in ('127.0.0.1', '10.1.2.3', '192.168.0.9', '::1'):
+            self.assertEqual(self.scrape(remote_addr=address).status_code, 200, address)
+        for address in ('203.0.113.5', '2001:db8::1', ''):
+            self.assertEqual(self.scrape(remote_addr=address).status_code, 403, address)
+        # Forwarded by the proxy, so from anywhere
+        self.assertEqual(self.scrape(X_Forwarded_For='203.0.113.5').status_code, 403)
+        with override_settings(METRICS_ALLOWED_NETWORKS=[]):
+            self.assertEqual(self.scrape().status_code, 403)
+
+    def recorded(self):
+        labels = ('<unresolved>', 'GET')
+        data = metrics.snapshot()
+        return data['counters'].get(('requests_total', labels + (200,))), \
+            data['histograms'][('db_queries', labels)][-1]
+
+    def test_middleware(self):
+        def get_response(request):
+            Video.objects.count()
+            return HttpResponse('ok')
+
+        middleware = metrics.MetricsMiddleware(get_response)
+        self.assertFalse(iscoroutinefunction(middleware))
+        middleware(RequestFactory().get('/'))
+        self.assertEqual(self.recorded(), (1, 1))
+        # Queries outside a request are not counted
+        Video.objects.count()
+        self.assertEqual(self.recorded(), (1, 1))
+
+    def test_async_middleware(self):
+        async def get_response(request):
+            await sync_to_async(Video.objects.count)()
+            await sync_to_async(Video.objects.exists)()
+            return HttpResponse('ok')
+
+        middleware = metrics.MetricsMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(RequestFactory().get('/'))
+        self.assertEqual(response.content, b'ok')
+        self.assertEqual(self.recorded(), (1, 2))
+
+
+class SigningStorage:
+    """Hands out a freshly signed URL on each call, like a private bucket."""
+    expiration_secs = 3600
+
+    def __init__(self):
+        self.signed = []
+
+    def url(self, name):
+        self.signed.append(name)
+        return f'https://media.example.com/{name}?sig={len(self.signed)}'
+
+
+class StoredFile:
+    def __init__(self, storage, name):
+        self.storage, self.name = storage, name
+
+    def __bool__(self):
+        return bool(self.name)
+
+    @property
+    def url(self):
+        return self.storage.url(self.name)
+
+
+@override_settings(**TEST_SETTINGS, MEDIA_URL_CACHE_ALIAS='default', MEDIA_URL_EXPIRY_MARGIN_SECS=300)
+class MediaURLTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        local = mock.patch.dict(cloud_storage._local_urls, clear=True)
+        local.start()
+        self.addCleanup(local.stop)
+        self.storage = SigningStorage()
+
+    def resolve(self, *names, now=None):
+        files = [StoredFile(self.storage, name) for name in names]
+        with mock.patch.object(cloud_storage.time, 'time', return_value=now or 1_000_000):
+            return cloud_storage.resolve_media_urls(files)
+
+    def test_memoized(self):
+        [url] = self.resolve('a.jpg')
+        # Not even a cache round trip
+        with mock.patch.object(cloud_storage, 'caches') as caches:
+            self.assertEqual(self.resolve('a.jpg', now=1_003_000), [url])
+        caches.__getitem__.assert_not_called()
+        self.assertEqual(self.storage.signed, ['a.jpg'])
+        # Another worker, without the local copy, gets it from the shared cache
+        cloud_storage._local_urls.clear()
+        self.assertEqual(self.resolve('a.jpg', now=1_003_000), [url])
+        self.assertEqual(self.storage.signed, ['a.jpg'])
+
+    def test_other_name(self):
+        [url] = self.resolve('a.jpg')
+        [other] = self.resolve('b.jpg')
+        self.assertNotEqual(other, url)
+        self.assertEqual(self.storage.signed, ['a.jpg', 'b.jpg'])
+
+    def test_signed_again_near_expiry(self):
+        [url] = self.resolve('a.jpg')
+        # Inside the margin before the hour is up
+        [renewed] = self.resolve('a.jpg', now=1_000_000 + 3600 - 299)
+        self.assertNotEqual(renewed, url)
+        self.assertEqual(self.storage.signed, ['a.jpg', 'a.jpg'])
+        self.assertEqual(self.resolve('a.jpg', now=1_000_000 + 3600), [renewed])
+
+    def test_batch(self):
+        urls = self.resolve('a.jpg', '', 'b.jpg', 'a.jpg')
+        self.assertEqual(urls[1], None)
+        self.assertEqual(urls[0], urls[3])
+        self.assertEqual(self.storage.signed, ['a.jpg', 'b.jpg'])
+        self.assertIsNone(cloud_storage.get_azure_media_url(StoredFile(self.storage, '')))
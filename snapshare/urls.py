@@ -1,10 +1,16 @@
 ﻿from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
-from django.conf.urls.static import static
+
+from . import media, metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('videos.urls')),
     path('users/', include('users.urls')),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path('metrics', metrics.metrics_view, name='metrics'),
+]
+
+# Media on local disk is served by Django itself (Azure serves its own)
+if settings.MEDIA_URL.startswith('/'):
+    urlpatterns.append(path(f'{settings.MEDIA_URL.lstrip("/")}<path:path>', media.serve, name='media'))
@@ -0,0 +1,9 @@
+from snapshare.serialization import Field, MediaURLField, Serializer
+
+
+class CurrentUserSerializer(Serializer):
+    username = Field()
+    email = Field()
+    role = Field()
+    profile_picture = MediaURLField('profile_picture')
+    bio = Field()
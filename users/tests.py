@@ -0,0 +1,19 @@
+from django.test import TestCase
+
+from snapshare.testing import Budget, QueryBudgetMixin
+
+
+class UserQueryBudgetTests(QueryBudgetMixin, TestCase):
+    urlconf = 'users.urls'
+    budgets = [
+        Budget('signup', 0, 2),
+        Budget('login', 0, 2),
+        Budget('logout', 0, 4),
+        Budget('profile', 0, 7, user='creator'),
+        Budget('current_user', 0, 2),
+        Budget('current_user_async', 0, 2),
+        Budget('password_reset', 1, 1, method='post', data={'email': 'consumer@example.com'}),
+        Budget('password_reset_done', 0, 2),
+        Budget('password_reset_confirm', 1, 3, args=lambda case: ['MQ', 'set-password']),
+        Budget('password_reset_complete', 0, 2),
+    ]
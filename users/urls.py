@@ -13,6 +13,7 @@ urlpatterns = [
     
     # API URLs
     path('api/current_user/', views.current_user, name='current_user'),
+    path('api/async/current_user/', views.current_user_async, name='current_user_async'),
     
     # Password reset URLs
     path('password_reset/', 
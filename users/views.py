@@ -2,11 +2,15 @@
 from django.contrib.auth import login, authenticate, logout
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+from asgiref.sync import sync_to_async
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from .models import CustomUser
 from .forms import CustomUserCreationForm, CustomAuthenticationForm
+from .serializers import CurrentUserSerializer
+from snapshare.fastjson import JsonResponse
+from snapshare.serialization import InvalidFields
 
 def signup(request):
     if request.method == 'POST':
@@ -62,11 +66,22 @@ def profile(request):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def current_user(request):
-    user = request.user
-    return JsonResponse({
-        'username': user.username,
-        'email': user.email,
-        'role': user.role,
-        'profile_picture': user.profile_picture.url if user.profile_picture else None,
-        'bio': user.bio,
-    })
\ No newline at end of file
+    try:
+        serializer = CurrentUserSerializer.from_request(request)
+    except InvalidFields as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(serializer.to_dict(request.user))
+
+
+@require_GET
+async def current_user_async(request):
+    """current_user for ASGI deployments (session authentication only)."""
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=403)
+    try:
+        serializer = CurrentUserSerializer.from_request(request)
+    except InvalidFields as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    # to_dict resolves the profile picture URL, which may call the storage
+    return JsonResponse(await sync_to_async(serializer.to_dict)(user))
@@ -1,12 +1,15 @@
 from django.contrib import admin
 from .models import Video, Comment, Rating
+from . import search
 
 @admin.register(Video)
 class VideoAdmin(admin.ModelAdmin):
     list_display = ('title', 'creator', 'genre', 'age_rating', 'views', 'upload_date')
     list_filter = ('genre', 'age_rating', 'upload_date')
     search_fields = ('title', 'description', 'creator__username')
-    readonly_fields = ('views', 'upload_date')
+    readonly_fields = ('views', 'like_count', 'rating_count', 'comment_count', 'upload_date',
+                       'duration', 'width', 'height', 'video_codec', 'audio_codec',
+                       'bitrate', 'file_size', 'moov_offset', 'faststart')
     fieldsets = (
         (None, {
             'fields': ('title', 'description', 'creator')
@@ -14,15 +17,26 @@ class VideoAdmin(admin.ModelAdmin):
         ('Media', {
             'fields': ('video_file', 'thumbnail')
         }),
+        ('File details', {
+            'fields': ('duration', 'width', 'height', 'video_codec', 'audio_codec',
+                       'bitrate', 'file_size', 'moov_offset', 'faststart'),
+            'classes': ('collapse',)
+        }),
         ('Metadata', {
             'fields': ('publisher', 'producer', 'genre', 'age_rating')
         }),
         ('Statistics', {
-            'fields': ('views', 'upload_date'),
+            'fields': ('views', 'like_count', 'rating_count', 'comment_count', 'upload_date'),
             'classes': ('collapse',)
         }),
     )
 
+    def get_search_results(self, request, queryset, search_term):
+        # Use the GIN-indexed search vector instead of icontains scans
+        if search_term and search.supported(queryset):
+            return search.search(queryset, search_term), False
+        return super().get_search_results(request, queryset, search_term)
+
 @admin.register(Comment)
 class CommentAdmin(admin.ModelAdmin):
     list_display = ('truncated_text', 'user', 'video', 'created_at')
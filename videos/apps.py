@@ -2,4 +2,7 @@ from django.apps import AppConfig
 
 class VideosConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'videos'
\ No newline at end of file
+    name = 'videos'
+
+    def ready(self):
+        from . import signals  # noqa: F401
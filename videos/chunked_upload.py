@@ -0,0 +1,302 @@
+"""
+Resumable chunked uploads streamed through the server.
+
+A client creates an UploadSession, PUTs fixed-size chunks in any order (in
+parallel if it likes), asks for the session status to resume after a
+dropped connection, and finally commits.  Chunk bodies are streamed from
+the request straight into a staging backend in small pieces, so a worker
+never holds more than ``STREAM_BLOCK_SIZE`` bytes of an upload in memory:
+
+* ``FileSystemChunkBackend`` writes each chunk to its own part file and on
+  commit streams the parts, in order, into the default storage.
+* ``AzureChunkBackend`` stages each chunk as an uncommitted block on the
+  target blob and commits the block list.
+
+Committing marks the session COMMITTING and releases its row lock before
+the file is assembled, which for a large upload takes a while.  The staged
+chunks are only discarded once the session is recorded as COMMITTED, so a
+commit that fails part way can be retried.
+"""
+import base64
+import hashlib
+import os
+import shutil
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from . import upload_tokens
+from .models import UploadChunk, UploadSession
+
+STREAM_BLOCK_SIZE = 64 * 1024
+# A commit still COMMITTING after this long died part way and may be retried
+COMMIT_TIMEOUT = timedelta(hours=1)
+
+
+class ChunkError(ValueError):
+    pass
+
+
+class HashingReader:
+    """Reads at most ``length`` bytes from ``stream`` while hashing them."""
+
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.remaining = length
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.stream.read(min(size, STREAM_BLOCK_SIZE))
+        self.remaining -= len(data)
+        self.size += len(data)
+        self.sha256.update(data)
+        return data
+
+    def __iter__(self):
+        while True:
+            data = self.read(STREAM_BLOCK_SIZE)
+            if not data:
+                return
+            yield data
+
+
+class ConcatenatedReader:
+    """File-like object reading a list of files back to back."""
+
+    def __init__(self, paths):
+        self.paths = list(paths)
+        self.current = None
+
+    def read(self, size=-1):
+        while True:
+            if self.current is None:
+                if not self.paths:
+                    return b''
+                self.current = open(self.paths.pop(0), 'rb')
+            data = self.current.read(size if size and size > 0 else STREAM_BLOCK_SIZE)
+            if data:
+                return data
+            self.current.close()
+            self.current = None
+
+    def close(self):
+        if self.current is not None:
+            self.current.close()
+
+
+class FileSystemChunkBackend:
+    def __init__(self, root=None):
+        self.root = root or settings.CHUNKED_UPLOAD_DIR
+
+    def _session_dir(self, session):
+        return os.path.join(self.root, str(session.pk))
+
+    def _part_path(self, session, index):
+        return os.path.join(self._session_dir(session), f'{index:08d}.part')
+
+    def stage(self, session, index, reader):
+        os.makedirs(self._session_dir(session), exist_ok=True)
+        final_path = self._part_path(session, index)
+        # Write to a private temp file and rename, so a retried or parallel
+        # PUT of the same chunk never leaves a half-written part behind
+        temp_path = f'{final_path}.{os.getpid()}.{id(reader)}.tmp'
+        try:
+            with open(temp_path, 'wb') as part:
+                for data in reader:
+                    part.write(data)
+            os.replace(temp_path, final_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def commit(self, session, chunks):
+        reader = ConcatenatedReader(self._part_path(session, chunk.index) for chunk in chunks)
+        try:
+            return default_storage.save(session.blob_name, File(reader, name=session.blob_name))
+        finally:
+            reader.close()
+
+    def discard(self, session):
+        shutil.rmtree(self._session_dir(session), ignore_errors=True)
+
+
+class AzureChunkBackend:
+    def _blob_client(self, session):
+        from azure.storage.blob import BlobServiceClient
+
+        service = BlobServiceClient(
+            account_url=f'https://{settings.AZURE_ACCOUNT_NAME}.blob.core.windows.net',
+            credential=settings.AZURE_ACCOUNT_KEY,
+        )
+        return service.get_blob_client(settings.AZURE_CONTAINER, session.blob_name)
+
+    @staticmethod
+    def _block_id(index):
+        return base64.b64encode(f'{index:08d}'.encode()).decode()
+
+    def stage(self, session, index, reader):
+        self._blob_client(session).stage_block(
+            self._block_id(index), reader, length=reader.remaining
+        )
+
+    def commit(self, session, chunks):
+        from azure.storage.blob import BlobBlock
+
+        self._blob_client(session).commit_block_list(
+            [BlobBlock(block_id=self._block_id(chunk.index)) for chunk in chunks]
+        )
+        return session.blob_name
+
+    def discard(self, session):
+        # Uncommitted blocks are garbage collected by Azure after a week
+        pass
+
+
+def get_backend():
+    if settings.CHUNKED_UPLOAD_BACKEND == 'azure':
+        return AzureChunkBackend()
+    return FileSystemChunkBackend()
+
+
+def start_session(user, kind, filename, total_size, chunk_size=None):
+    if total_size is None or int(total_size) < 0:
+        raise ChunkError('A non-negative file size is required')
+    if int(total_size) > settings.CHUNKED_UPLOAD_MAX_SIZE:
+        raise ChunkError('File is too large')
+    chunk_size = int(chunk_size or settings.CHUNKED_UPLOAD_CHUNK_SIZE)
+    if not 0 < chunk_size <= settings.CHUNKED_UPLOAD_MAX_CHUNK_SIZE:
+        raise ChunkError('Invalid chunk size')
+    return UploadSession.objects.create(
+        user=user,
+        kind=kind,
+        filename=os.path.basename(filename or ''),
+        blob_name=upload_tokens.new_blob_name(user, kind, filename),
+        total_size=int(total_size),
+        chunk_size=chunk_size,
+    )
+
+
+def put_chunk(session, index, stream, content_length, checksum=None):
+    """
+    Stream one chunk from ``stream`` into the staging backend.
+
+    Re-sending a chunk replaces it, which is how a client retries a chunk
+    whose checksum did not match.
+    """
+    if session.status == UploadSession.COMMITTED:
+        raise ChunkError('Upload session is already committed')
+    if session.status != UploadSession.ACTIVE:
+        raise ChunkError('Upload session is being committed')
+    if not 0 <= index < session.total_chunks:
+        raise ChunkError('Chunk index out of range')
+    expected = session.expected_chunk_size(index)
+    if content_length != expected:
+        raise ChunkError(f'Chunk {index} must be {expected} bytes, got {content_length}')
+
+    reader = HashingReader(stream, content_length)
+    get_backend().stage(session, index, reader)
+    digest = reader.sha256.hexdigest()
+    error = None
+    if reader.size != expected:
+        error = f'Chunk {index} was truncated after {reader.size} bytes'
+    elif checksum and checksum.lower() != digest:
+        error = f'Checksum mismatch for chunk {index}'
+    if error:
+        # The staged data was overwritten, so the chunk must be sent again
+        UploadChunk.objects.filter(session=session, index=index).delete()
+        raise ChunkError(error)
+
+    values = {'offset': index * session.chunk_size, 'size': reader.size, 'checksum': digest}
+    try:
+        with transaction.atomic():
+            chunk, _ = UploadChunk.objects.update_or_create(session=session, index=index, defaults=values)
+    except IntegrityError:
+        # A parallel PUT of the same chunk created the row first
+        UploadChunk.objects.filter(session=session, index=index).update(**values)
+        chunk = UploadChunk.objects.get(session=session, index=index)
+    return chunk
+
+
+def session_status(session):
+    chunks = list(session.chunks.all())
+    received = {chunk.index for chunk in chunks}
+    missing = [index for index in range(session.total_chunks) if index not in received]
+    # Bytes received contiguously from the start: where a sequential client resumes
+    offset = (missing[0] * session.chunk_size) if missing else session.total_size
+    return {
+        'id': str(session.pk),
+        'kind': session.kind,
+        'blob_name': session.blob_name,
+        'status': session.status,
+        'total_size': session.total_size,
+        'chunk_size': session.chunk_size,
+        'total_chunks': session.total_chunks,
+        'offset': offset,
+        'missing': missing,
+        'chunks': [
+            {'index': chunk.index, 'offset': chunk.offset, 'size': chunk.size, 'checksum': chunk.checksum}
+            for chunk in chunks
+        ],
+    }
+
+
+def commit_session(session):
+    """Assemble the chunks into the final blob and return its storage name."""
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=session.pk)
+        if session.status == UploadSession.COMMITTED:
+            return session.blob_name
+        if session.status == UploadSession.COMMITTING and session.updated_at > timezone.now() - COMMIT_TIMEOUT:
+            raise ChunkError('Upload session is already being committed')
+        chunks = list(session.chunks.order_by('index'))
+        if len(chunks) != session.total_chunks:
+            raise ChunkError(f'{session.total_chunks - len(chunks)} chunks are still missing')
+        session.status = UploadSession.COMMITTING
+        session.save(update_fields=['status', 'updated_at'])
+
+    backend = get_backend()
+    try:
+        blob_name = backend.commit(session, chunks)
+        with transaction.atomic():
+            session.blob_name = blob_name
+            session.status = UploadSession.COMMITTED
+            session.save(update_fields=['blob_name', 'status', 'updated_at'])
+            transaction.on_commit(lambda: backend.discard(session))
+    except Exception:
+        # Every chunk is still staged, so the client can commit again
+        UploadSession.objects.filter(pk=session.pk, status=UploadSession.COMMITTING).update(
+            status=UploadSession.ACTIVE,
+        )
+        raise
+    # upload_video accepts the committed blob like a direct upload
+    upload_tokens.add_claim(session.user, session.kind, session.blob_name)
+    return session.blob_name
+
+
+def expire_sessions(max_age=None):
+    """Discard uncommitted sessions idle for ``max_age`` seconds along with their staged chunks."""
+    max_age = settings.CHUNKED_UPLOAD_EXPIRY_SECS if max_age is None else max_age
+    cutoff = timezone.now() - timedelta(seconds=max_age)
+    backend = get_backend()
+    expired = 0
+    sessions = (
+        UploadSession.objects.filter(
+            status__in=[UploadSession.ACTIVE, UploadSession.COMMITTING], updated_at__lt=cutoff,
+        )
+        .exclude(chunks__created_at__gte=cutoff)
+        .distinct()
+    )
+    for session in sessions.iterator():
+        backend.discard(session)
+        session.delete()
+        expired += 1
+    return expired
@@ -12,6 +12,12 @@ class VideoUploadForm(forms.ModelForm):
             'description': forms.Textarea(attrs={'rows': 4}),
         }
 
+    def __init__(self, *args, uploaded=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        # Files already uploaded straight to storage are not posted again
+        for field in uploaded:
+            self.fields[field].required = False
+
 class CommentForm(forms.ModelForm):
     class Meta:
         model = Comment
@@ -0,0 +1,273 @@
+import asyncio
+import json
+import random
+import resource
+import subprocess
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from videos.models import Video
+
+# name: (method, signed in, takes a video id, share of the traffic)
+ENDPOINTS = {
+    'home': ('GET', False, False, 30),
+    'video_detail': ('GET', True, True, 25),
+    'video_list_api': ('GET', False, False, 15),
+    'video_detail_api': ('GET', False, True, 15),
+    'current_user': ('GET', True, False, 10),
+    'like_video': ('POST', True, True, 5),
+    'video_list_api_async': ('GET', False, False, 15),
+    'video_detail_api_async': ('GET', False, True, 15),
+    'current_user_async': ('GET', True, False, 10),
+}
+DEFAULT_ENDPOINTS = ['home', 'video_detail', 'video_list_api', 'video_detail_api', 'current_user', 'like_video']
+ASYNC_ENDPOINTS = ['video_list_api_async', 'video_detail_api_async', 'current_user_async']
+PERCENTILES = (50, 95, 99)
+MAX_VIDEOS = 100000
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def _summary(samples, elapsed):
+    latencies = sorted(sample[0] for sample in samples)
+    count = len(samples)
+    result = {
+        'requests': count,
+        'errors': sum(1 for sample in samples if sample[2] >= 400),
+        'throughput_rps': round(count / elapsed, 2) if elapsed else None,
+        'mean_ms': round(sum(latencies) / count * 1000, 2) if count else None,
+    }
+    for pct in PERCENTILES:
+        value = percentile(latencies, pct)
+        result[f'p{pct}_ms'] = round(value * 1000, 2) if value is not None else None
+    result['max_ms'] = round(latencies[-1] * 1000, 2) if count else None
+    result['queries_per_request'] = round(sum(sample[1] for sample in samples) / count, 2) if count else None
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Queries are counted by a wrapper installed on every connection the run
+# opens, into the counter of the request being handled in that context
+_current_counter = ContextVar('bench_query_counter', default=None)
+
+
+def _count_query(execute, sql, params, many, context):
+    counter = _current_counter.get()
+    if counter is not None:
+        counter[0] += 1
+    return execute(sql, params, many, context)
+
+
+def _install_counter(sender, connection, **kwargs):
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+class Command(BaseCommand):
+    help = ('Drive the main views concurrently, in process, and print latency percentiles, '
+            'throughput and queries per request as JSON. Run it against `seed_snapshare` data; '
+            'compare the async API with `--asgi` against `--endpoint video_list_api '
+            '--endpoint video_detail_api --endpoint current_user`.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=8, help='Number of concurrent clients')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds to measure for')
+        parser.add_argument('--warmup', type=int, default=20,
+                            help='Unmeasured requests per client before measuring')
+        parser.add_argument('--endpoint', action='append', choices=list(ENDPOINTS),
+                            help='Only drive these endpoints (repeatable; default: all the sync views)')
+        parser.add_argument('--prefix', default='seed',
+                            help='Sign in as users with this seed_snapshare prefix, if there are any')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the request mix')
+        parser.add_argument('--output', help='Write the report to this file instead of stdout')
+        parser.add_argument('--asgi', action='store_true',
+                            help='Drive the endpoints through the ASGI handler from concurrent tasks on one '
+                                 'event loop, as an ASGI server would (default endpoints: the async API views)')
+
+    def _run_wsgi(self, options, pick, users):
+        """One thread per client, like a threaded WSGI server."""
+        User = get_user_model()
+        samples = []
+        lock = threading.Lock()
+        errors = []
+        clock = {}
+
+        def start_clock():
+            # Run by the last thread to finish warming up, before any is released
+            clock['started'] = time.monotonic()
+            clock['deadline'] = clock['started'] + options['duration']
+
+        barrier = threading.Barrier(options['concurrency'], action=start_clock)
+
+        def request(rng, clients):
+            name, method, needs_user, url = pick(rng)
+            counter = [0]
+            token = _current_counter.set(counter)
+            try:
+                start = time.perf_counter()
+                response = clients[needs_user].generic(method, url, secure=True)
+                elapsed = time.perf_counter() - start
+            finally:
+                _current_counter.reset(token)
+            return name, elapsed, counter[0], response.status_code
+
+        def worker(index):
+            rng = random.Random(options['seed'] * 1000 + index)
+            local = []
+            try:
+                clients = (Client(raise_request_exception=False), Client(raise_request_exception=False))
+                clients[True].force_login(User.objects.get(pk=rng.choice(users)))
+                for _ in range(options['warmup']):
+                    request(rng, clients)
+                barrier.wait()
+                while time.monotonic() < clock['deadline']:
+                    local.append(request(rng, clients))
+            except threading.BrokenBarrierError:
+                pass
+            except Exception as e:
+                errors.append(e)
+                barrier.abort()
+            finally:
+                connections.close_all()
+                with lock:
+                    samples.extend(local)
+
+        threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(options['concurrency'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise CommandError(f'A client thread failed: {errors[0]!r}')
+        return samples, time.monotonic() - clock['started']
+
+    def _run_asgi(self, options, pick, users):
+        """One task per client on a single event loop, like an ASGI server."""
+        User = get_user_model()
+        clock = {}
+
+        async def request(rng, clients):
+            name, method, needs_user, url = pick(rng)
+            # Mutated, not reassigned, so queries on the threads the request
+            # fans out to (which get a copy of the context) are counted too
+            counter = [0]
+            token = _current_counter.set(counter)
+            try:
+                start = time.perf_counter()
+                response = await clients[needs_user].generic(method, url, secure=True)
+                elapsed = time.perf_counter() - start
+            finally:
+                _current_counter.reset(token)
+            return name, elapsed, counter[0], response.status_code
+
+        async def worker(index, barrier):
+            rng = random.Random(options['seed'] * 1000 + index)
+            local = []
+            try:
+                clients = (AsyncClient(raise_request_exception=False), AsyncClient(raise_request_exception=False))
+                await clients[True].aforce_login(await User.objects.aget(pk=rng.choice(users)))
+                for _ in range(options['warmup']):
+                    await request(rng, clients)
+                if barrier.n_waiting == barrier.parties - 1:
+                    clock['started'] = time.monotonic()
+                    clock['deadline'] = clock['started'] + options['duration']
+                await barrier.wait()
+                while time.monotonic() < clock['deadline']:
+                    local.append(await request(rng, clients))
+            except asyncio.BrokenBarrierError:
+                pass
+            except Exception:
+                await barrier.abort()
+                raise
+            return local
+
+        async def main():
+            barrier = asyncio.Barrier(options['concurrency'])
+            return await asyncio.gather(*(worker(i, barrier) for i in range(options['concurrency'])),
+                                        return_exceptions=True)
+
+        results = asyncio.run(main())
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            raise CommandError(f'A client task failed: {errors[0]!r}')
+        return [sample for result in results for sample in result], time.monotonic() - clock['started']
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['duration'] <= 0:
+            raise CommandError('--concurrency and --duration must be positive.')
+        videos = list(Video.objects.order_by('-views').values_list('pk', 'views')[:MAX_VIDEOS])
+        User = get_user_model()
+        users = list(User.objects.filter(username__startswith=f'{options["prefix"]}_').values_list('pk', flat=True)[:1000]
+                     or User.objects.values_list('pk', flat=True)[:1000])
+        if not videos or not users:
+            raise CommandError('Needs videos and users; run `manage.py seed_snapshare` first.')
+
+        names = options['endpoint'] or (ASYNC_ENDPOINTS if options['asgi'] else DEFAULT_ENDPOINTS)
+        weights = [ENDPOINTS[name][3] for name in names]
+        video_ids = [pk for pk, _ in videos]
+        # Popular videos get proportionally more traffic
+        video_weights = [views + 1 for _, views in videos]
+
+        def pick(rng):
+            name = rng.choices(names, weights)[0]
+            method, needs_user, takes_video, _ = ENDPOINTS[name]
+            url = reverse(name, args=[rng.choices(video_ids, video_weights)[0]] if takes_video else [])
+            return name, method, needs_user, url
+
+        connection_created.connect(_install_counter)
+        hosts = list(settings.ALLOWED_HOSTS) + ['testserver']
+        try:
+            with override_settings(ALLOWED_HOSTS=hosts, DEBUG=False):
+                self.stderr.write(f'Warming up {options["concurrency"]} clients, then measuring for '
+                                  f'{options["duration"]:g}s...')
+                run = self._run_asgi if options['asgi'] else self._run_wsgi
+                samples, elapsed = run(options, pick, users)
+        finally:
+            connection_created.disconnect(_install_counter)
+
+        report = {
+            'commit': _git_commit(),
+            'database': connection.vendor,
+            'dataset': {'videos': Video.objects.count(), 'users': User.objects.count()},
+            'mode': 'asgi' if options['asgi'] else 'wsgi',
+            'concurrency': options['concurrency'],
+            'duration_s': round(elapsed, 2),
+            # Of the whole process, warm-up and setup included (Linux reports KiB)
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'total': _summary([sample[1:] for sample in samples], elapsed),
+            'endpoints': {
+                name: _summary([sample[1:] for sample in samples if sample[0] == name], elapsed)
+                for name in names
+            },
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stderr.write(f'Wrote {options["output"]}')
+        else:
+            self.stdout.write(output)
+
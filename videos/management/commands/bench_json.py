@@ -0,0 +1,85 @@
+import json
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.http import JsonResponse as StdlibJsonResponse
+
+from snapshare.fastjson import JsonResponse, StreamingJsonResponse
+from videos.models import Comment, Video
+from videos.serializers import CommentSerializer, VideoDetailSerializer
+
+
+def _data(video_id, stream):
+    """The video_detail_api payload, with the comments materialized or as an iterator."""
+    serializer = VideoDetailSerializer()
+    videos = serializer.prepare(Video.objects.all(), extra_only=('rating_sum', 'rating_count'))
+    video = videos.get(pk=video_id)
+    comment_serializer = CommentSerializer()
+    comments = comment_serializer.prepare(Comment.objects.filter(video_id=video_id)).order_by('-created_at')
+    if stream:
+        comments = map(comment_serializer.to_dict, comments.iterator(chunk_size=1000))
+    else:
+        comments = comment_serializer.many(comments)
+    return {
+        'video': serializer.to_dict(video),
+        'comments': comments,
+        'average_rating': video.average_rating,
+        'rating_count': video.rating_count,
+    }
+
+
+def _render(mode, video_id):
+    """Build and consume the response the way a server would; returns the bytes sent."""
+    if mode == 'streaming':
+        return sum(len(chunk) for chunk in StreamingJsonResponse(_data(video_id, stream=True)).streaming_content)
+    response_class = StdlibJsonResponse if mode == 'stdlib' else JsonResponse
+    return len(response_class(_data(video_id, stream=False)).content)
+
+
+MODES = {
+    'stdlib': 'django.http.JsonResponse, comments in a list (before)',
+    'orjson': 'orjson JsonResponse, comments in a list',
+    'streaming': 'orjson, comments streamed from a chunked iterator',
+}
+
+
+class Command(BaseCommand):
+    help = ('Compare peak memory and throughput of rendering video_detail_api for a heavily commented '
+            'video with the standard library encoder, orjson, and orjson streaming')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--video', type=int, help='Video id (default: the one with the most comments)')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed renders per mode')
+        parser.add_argument('--mode', action='append', choices=list(MODES), help='Only these modes (repeatable)')
+
+    def handle(self, *args, **options):
+        video_id = options['video'] or Video.objects.order_by('-comment_count').values_list('pk', flat=True).first()
+        if video_id is None or not Video.objects.filter(pk=video_id).exists():
+            raise CommandError('Needs a video; run `manage.py seed_snapshare` first.')
+        comment_count = Comment.objects.filter(video_id=video_id).count()
+
+        results = {}
+        for mode in options['mode'] or list(MODES):
+            _render(mode, video_id)  # warm up
+            started = time.perf_counter()
+            for _ in range(options['repeat']):
+                size = _render(mode, video_id)
+            elapsed = time.perf_counter() - started
+
+            # A separate pass, as tracing slows everything down
+            tracemalloc.start()
+            try:
+                _render(mode, video_id)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            results[mode] = {
+                'description': MODES[mode],
+                'bytes': size,
+                'responses_per_s': round(options['repeat'] / elapsed, 2),
+                'mb_per_s': round(size * options['repeat'] / elapsed / 1e6, 2),
+                'peak_memory_mb': round(peak / 1e6, 2),
+            }
+
+        self.stdout.write(json.dumps({'video': video_id, 'comments': comment_count, 'modes': results}, indent=2))
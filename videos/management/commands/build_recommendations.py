@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from videos import recommendations
+
+
+class Command(BaseCommand):
+    help = ('Compute "more like this" recommendations from likes and ratings: by default only for videos '
+            'whose likes or ratings changed since their last refresh')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Recompute the recommendations of every video')
+        parser.add_argument('--limit', type=int, default=5000,
+                            help='Most queued videos refreshed in one run')
+
+    def handle(self, *args, **options):
+        if options['full']:
+            count = recommendations.rebuild()
+            self.stdout.write(self.style.SUCCESS(f'{count} videos have recommendations.'))
+        else:
+            count = recommendations.refresh(limit=options['limit'])
+            self.stdout.write(self.style.SUCCESS(f'Refreshed the recommendations of {count} videos.'))
@@ -0,0 +1,134 @@
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from videos.models import Video
+
+# Planner switches that make the fallbacks stand out: with them off a
+# sequential scan or sort only appears when no index can serve the query
+PLANNER_SETTINGS = ('SET LOCAL enable_seqscan = off', 'SET LOCAL enable_sort = off')
+IGNORED_TABLES = ('pg_catalog.', 'pg_class', 'django_session', 'django_migrations')
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Run EXPLAIN (ANALYZE, BUFFERS) on the queries the main views issue and fail '
+            'if any of them needs a sequential scan or an explicit sort (PostgreSQL only)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--allow-seqscan', action='append', default=[], metavar='TABLE',
+                            help='Table whose sequential scans are acceptable')
+        parser.add_argument('--show-plans', action='store_true',
+                            help='Print the full plan of every query')
+
+    def _pages(self, client, video, user):
+        """(label, url, signed in, sorting allowed) for every view checked."""
+        first_page = client.get(f'{reverse("video_list_api")}?cursor=', secure=True).json()
+        word = (video.title.split() or ['video'])[0]
+        return [
+            ('home', reverse('home'), False, False),
+            ('video_detail', reverse('video_detail', args=[video.pk]), False, False),
+            ('video_detail (signed in)', reverse('video_detail', args=[video.pk]), True, False),
+            ('video_list_api', reverse('video_list_api'), False, False),
+            ('video_list_api (cursor)', f'{reverse("video_list_api")}?cursor=', False, False),
+            ('video_list_api (next page)',
+             f'{reverse("video_list_api")}?{urlencode({"cursor": first_page.get("next") or ""})}', False, False),
+            ('video_list_api (trending)', f'{reverse("video_list_api")}?sort=trending&cursor=', False, False),
+            ('video_list_api (top)', f'{reverse("video_list_api")}?sort=top&cursor=', False, False),
+            ('video_detail_api', reverse('video_detail_api', args=[video.pk]), False, False),
+            # Results are ordered by rank, which no index can provide
+            ('video_search_api', f'{reverse("video_search_api")}?{urlencode({"q": word})}', False, True),
+        ]
+
+    def _problems(self, node, allowed_tables, sort_allowed):
+        problems = []
+        if node['Node Type'] == 'Seq Scan' and node.get('Relation Name') not in allowed_tables:
+            problems.append(f'Seq Scan on {node.get("Relation Name")}')
+        if node['Node Type'] == 'Sort' and not sort_allowed:
+            problems.append(f'Sort on {", ".join(node.get("Sort Key", []))}')
+        for child in node.get('Plans', []):
+            problems.extend(self._problems(child, allowed_tables, sort_allowed))
+        return problems
+
+    def _explain(self, sql):
+        with connection.cursor() as cursor:
+            for statement in PLANNER_SETTINGS:
+                cursor.execute(statement)
+            cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}')
+            return cursor.fetchone()[0][0]
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('explain_queries needs a PostgreSQL database.')
+        video = Video.objects.order_by('-upload_date').first()
+        user = get_user_model().objects.order_by('pk').first()
+        if video is None or user is None:
+            raise CommandError('Needs at least one user and one video.')
+
+        # A private cache so responses are rendered (not served from the
+        # response cache) and no views are counted against real data
+        cache_settings = {**settings.CACHES, 'explain': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                                        'LOCATION': 'explain-queries'}}
+        failures = 0
+        checked = 0
+        with override_settings(CACHES=cache_settings, RESPONSE_CACHE_ALIAS='explain', VIEW_COUNT_CACHE_ALIAS='explain',
+                               ALLOWED_HOSTS=['testserver'], DEBUG=False):
+            try:
+                with transaction.atomic():
+                    client = Client()
+                    for label, url, signed_in, sort_allowed in self._pages(client, video, user):
+                        if signed_in:
+                            client.force_login(user)
+                        else:
+                            client.logout()
+                        caches['explain'].clear()
+                        with CaptureQueriesContext(connection) as captured:
+                            response = client.get(url, secure=True)
+                        if response.status_code != 200:
+                            raise CommandError(f'{label}: {url} returned {response.status_code}')
+
+                        self.stdout.write(self.style.MIGRATE_HEADING(f'{label}  {url}'))
+                        for query in captured.captured_queries:
+                            sql = query['sql']
+                            if not sql.lstrip().upper().startswith('SELECT') or any(t in sql for t in IGNORED_TABLES):
+                                continue
+                            plan = self._explain(sql)
+                            checked += 1
+                            problems = self._problems(plan['Plan'], options['allow_seqscan'], sort_allowed)
+                            summary = (f'{plan["Execution Time"]:.2f} ms, '
+                                       f'buffers hit={plan["Plan"].get("Shared Hit Blocks", 0)} '
+                                       f'read={plan["Plan"].get("Shared Read Blocks", 0)}')
+                            if problems:
+                                failures += 1
+                                self.stdout.write(self.style.ERROR(f'  FAIL {summary}: {"; ".join(problems)}'))
+                                self.stdout.write(f'       {sql[:300]}')
+                            else:
+                                self.stdout.write(f'  ok   {summary}')
+                            if options['show_plans']:
+                                self.stdout.write(self._format(plan['Plan']))
+                    raise _Rollback
+            except _Rollback:
+                pass
+
+        if failures:
+            raise CommandError(f'{failures} of {checked} queries need a sequential scan or sort.')
+        self.stdout.write(self.style.SUCCESS(f'All {checked} queries are served by indexes.'))
+
+    def _format(self, node, depth=2):
+        relation = f' on {node["Relation Name"]}' if 'Relation Name' in node else ''
+        index = f' using {node["Index Name"]}' if 'Index Name' in node else ''
+        lines = [f'{"  " * depth}-> {node["Node Type"]}{relation}{index} '
+                 f'(rows={node.get("Actual Rows")} time={node.get("Actual Total Time")})']
+        for child in node.get('Plans', []):
+            lines.append(self._format(child, depth + 1))
+        return '\n'.join(lines)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from videos import viewcounts
+
+
+class Command(BaseCommand):
+    help = 'Write all buffered video view counts to the database'
+
+    def handle(self, *args, **options):
+        flushed = viewcounts.flush()
+        self.stdout.write(self.style.SUCCESS(f'Flushed {flushed} buffered views.'))
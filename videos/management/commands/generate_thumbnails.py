@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from videos import thumbnails
+from videos.models import Video
+
+
+class Command(BaseCommand):
+    help = 'Generate resized WebP/JPEG thumbnails for videos that are missing them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('video_ids', nargs='*', type=int,
+                            help='Only these videos (default: all)')
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate even if the variants are up to date')
+
+    def handle(self, *args, **options):
+        videos = Video.objects.exclude(thumbnail='').only('id', 'thumbnail', 'thumbnail_variants')
+        if options['video_ids']:
+            videos = videos.filter(pk__in=options['video_ids'])
+
+        generated = failed = 0
+        for video in videos.iterator(chunk_size=500):
+            if thumbnails.is_current(video) and not options['force']:
+                continue
+            try:
+                if thumbnails.generate_variants(video.pk, force=options['force']):
+                    generated += 1
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f'Video {video.pk}: {e}')
+        self.stdout.write(self.style.SUCCESS(f'Generated thumbnails for {generated} videos ({failed} failed).'))
@@ -0,0 +1,282 @@
+"""
+Import a catalogue of videos from a manifest of metadata and local files.
+
+The manifest is JSON Lines (one object per line) or CSV with a header row,
+with the columns title, description, video, thumbnail, publisher, producer,
+genre, age_rating and optionally creator (a username; defaults to
+``--creator``).  ``video`` and ``thumbnail`` are paths to local files,
+relative to the manifest's directory unless absolute.
+
+Rows are read, validated and uploaded as a stream: at most ``--workers``
+uploads run at once and only a few times that many rows are held in
+memory, so manifests of any length import in constant memory.  Uploaded
+rows are inserted ``--batch-size`` at a time with ``bulk_create``.
+
+Files are stored under a name derived from the manifest's checksum and the
+row number, and after every batch the number of the last row before which
+everything is done goes to the checkpoint file.  Running the command again
+after a failure skips the rows up to the checkpoint, keeps files already
+uploaded in full and leaves out the rows already inserted, so nothing is
+uploaded or imported twice.
+"""
+import csv
+import hashlib
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from PIL import Image
+
+from videos import media_info, response_cache, search, thumbnails
+from videos.models import Video
+
+FIELDS = ('title', 'description', 'publisher', 'producer', 'genre', 'age_rating')
+FILES = ('video', 'thumbnail')
+FORMATS = ('jsonl', 'csv')
+
+
+def _checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def read_manifest(path, fmt):
+    """Yield (row number, dict) for each row of the manifest, numbered from 1."""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        if fmt == 'csv':
+            yield from enumerate(csv.DictReader(f), start=1)
+            return
+        number = 0
+        for line in f:
+            if not line.strip():
+                continue
+            number += 1
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                row = e
+            yield number, row
+
+
+def _upload(storage, path, name):
+    """Store the local file ``path`` as ``name``, unless an earlier run already did. Returns the stored name."""
+    if storage.exists(name):
+        if storage.size(name) == os.path.getsize(path):
+            return name
+        storage.delete(name)  # cut short by the failure being resumed from
+    with open(path, 'rb') as f:
+        return storage.save(name, File(f, name=os.path.basename(path)))
+
+
+class Command(BaseCommand):
+    help = ('Import videos from a JSONL or CSV manifest of metadata and local video and thumbnail files, '
+            'resuming from a checkpoint after a failure')
+
+    def add_arguments(self, parser):
+        parser.add_argument('manifest', help='Path of the .jsonl or .csv manifest')
+        parser.add_argument('--format', choices=FORMATS, help='Manifest format (default: by file extension)')
+        parser.add_argument('--creator', help='Username of the creator of rows without a creator column')
+        parser.add_argument('--base-dir', help='Directory file paths are relative to (default: the manifest\'s)')
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent uploads')
+        parser.add_argument('--batch-size', type=int, default=500, help='Videos per insert')
+        parser.add_argument('--checkpoint', help='Checkpoint file (default: the manifest path + .checkpoint)')
+        parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and start from row 1')
+        parser.add_argument('--dry-run', action='store_true', help='Only validate the rows')
+
+    def handle(self, *args, **options):
+        path = options['manifest']
+        if not os.path.isfile(path):
+            raise CommandError(f'No such manifest: {path}')
+        fmt = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if fmt not in FORMATS:
+            raise CommandError(f'Unknown manifest format {fmt!r}; pass --format ({", ".join(FORMATS)}).')
+        if options['workers'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--workers and --batch-size must be at least 1.')
+
+        self.base_dir = options['base_dir'] or os.path.dirname(os.path.abspath(path))
+        self.default_creator = options['creator']
+        self.creators = {}
+        self.import_id = _checksum(path)
+        self.checkpoint_path = options['checkpoint'] or f'{path}.checkpoint'
+        self.done_through = 0 if options['restart'] else self._read_checkpoint()
+        if self.done_through:
+            self.stdout.write(f'Resuming after row {self.done_through}.')
+        self.finished = set()
+        self.batch = []
+        self.created = self.existing = self.invalid = self.failed = 0
+        self.dry_run = options['dry_run']
+        self.batch_size = options['batch_size']
+
+        rows = (
+            (number, row) for number, row in read_manifest(path, fmt) if number > self.done_through
+        )
+        if self.dry_run:
+            valid = sum(1 for number, row in rows if self._validate(number, row))
+            self.stdout.write(self.style.SUCCESS(f'{valid} valid rows, {self.invalid} invalid.'))
+            return
+
+        storage = Video._meta.get_field('video_file').storage
+        window = options['workers'] * 4
+        pending = {}
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            for number, row in rows:
+                video = self._validate(number, row)
+                if video is None:
+                    continue
+                future = pool.submit(self._transfer, storage, video, video.local_files)
+                pending[future] = (number, video)
+                if len(pending) >= window:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    self._collect(pending, done)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                self._collect(pending, done)
+        self._flush()
+
+        if self.created:
+            response_cache.bump_list_version()
+        summary = (f'Imported {self.created} videos ({self.existing} already imported, '
+                   f'{self.invalid} invalid, {self.failed} failed to upload).')
+        if self.failed:
+            self.stdout.write(self.style.WARNING(f'{summary} Run the command again to retry the failed rows.'))
+        else:
+            self.stdout.write(self.style.SUCCESS(summary))
+
+    def _read_checkpoint(self):
+        try:
+            with open(self.checkpoint_path) as f:
+                checkpoint = json.load(f)
+        except FileNotFoundError:
+            return 0
+        if checkpoint.get('manifest') != self.import_id:
+            raise CommandError(f'{self.checkpoint_path} is for a different manifest; pass --restart to ignore it.')
+        return checkpoint['done_through']
+
+    def _write_checkpoint(self):
+        # Written aside and renamed, so a crash never leaves half a checkpoint
+        partial = f'{self.checkpoint_path}.tmp'
+        with open(partial, 'w') as f:
+            json.dump({'manifest': self.import_id, 'done_through': self.done_through}, f)
+        os.replace(partial, self.checkpoint_path)
+
+    def _reject(self, number, message):
+        self.invalid += 1
+        self.stderr.write(f'Row {number}: {message}')
+        self.finished.add(number)
+
+    def _creator(self, username):
+        if username not in self.creators:
+            User = get_user_model()
+            self.creators[username] = User.objects.filter(username=username, role=User.CREATOR).first()
+        return self.creators[username]
+
+    def _validate(self, number, row):
+        """An unsaved Video for the row, with its local files in ``local_files``; None if it is invalid."""
+        if not isinstance(row, dict):
+            self._reject(number, f'not a JSON object ({row})')
+            return None
+        # JSON values can be anything; CSV ones are always strings
+        wrong = [field for field in ('creator', *FIELDS, *FILES) if not isinstance(row.get(field) or '', str)]
+        if wrong:
+            self._reject(number, '; '.join(f'{field}: not a string ({row[field]!r})' for field in wrong))
+            return None
+        username = row.get('creator') or self.default_creator
+        if not username:
+            self._reject(number, 'no creator; add a creator column or pass --creator')
+            return None
+        creator = self._creator(username)
+        if creator is None:
+            self._reject(number, f'no creator named {username!r}')
+            return None
+
+        video = Video(creator=creator, **{field: (row.get(field) or '').strip() for field in FIELDS})
+        try:
+            video.clean_fields(exclude=['video_file', 'thumbnail', 'creator'])
+        except ValidationError as e:
+            errors = '; '.join(f'{field}: {" ".join(messages)}' for field, messages in e.message_dict.items())
+            self._reject(number, errors)
+            return None
+
+        video.local_files = {}
+        for field in FILES:
+            local = row.get(field) or ''
+            local = os.path.join(self.base_dir, local) if local else ''
+            if not os.path.isfile(local):
+                self._reject(number, f'{field}: no such file {row.get(field)!r}')
+                return None
+            video.local_files[field] = local
+        try:
+            with Image.open(video.local_files['thumbnail']) as image:
+                image.verify()
+        except Exception:
+            self._reject(number, f'thumbnail: not an image {row.get("thumbnail")!r}')
+            return None
+
+        # The row number keeps the names apart, and the same on every run
+        for field, model_field in (('video', 'video_file'), ('thumbnail', 'thumbnail')):
+            basename = os.path.basename(video.local_files[field])
+            file_field = Video._meta.get_field(model_field)
+            name = file_field.generate_filename(video, f'imports/{self.import_id}/{number}-{basename}')
+            if len(name) > file_field.max_length:
+                self._reject(number, f'{field}: file name too long {basename!r}')
+                return None
+            getattr(video, model_field).name = name
+        return video
+
+    def _transfer(self, storage, video, local_files):
+        """Runs in the pool: upload both files. Returns their stored names."""
+        return {
+            model_field: _upload(storage, local_files[field], getattr(video, model_field).name)
+            for field, model_field in (('video', 'video_file'), ('thumbnail', 'thumbnail'))
+        }
+
+    def _collect(self, pending, done):
+        for future in done:
+            number, video = pending.pop(future)
+            try:
+                names = future.result()
+            except Exception as e:
+                # Not finished, so the checkpoint stops before it and a rerun retries it
+                self.failed += 1
+                self.stderr.write(f'Row {number}: upload failed: {e}')
+                continue
+            for model_field, name in names.items():
+                getattr(video, model_field).name = name
+            self.batch.append((number, video))
+            if len(self.batch) >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        """Insert the uploaded rows that an earlier run has not, and move the checkpoint on."""
+        batch, self.batch = self.batch, []
+        if batch:
+            imported = set(
+                Video.objects.filter(video_file__in=[video.video_file.name for _, video in batch])
+                .values_list('video_file', flat=True)
+            )
+            new = [video for _, video in batch if video.video_file.name not in imported]
+            self.existing += len(batch) - len(new)
+            with transaction.atomic():
+                created = Video.objects.bulk_create(new)
+                # bulk_create sends no post_save, which would queue these
+                for video in created:
+                    transaction.on_commit(lambda pk=video.pk: (thumbnails.schedule(pk), media_info.schedule(pk)))
+            search.update_search_vectors(Video.objects.filter(pk__in=[video.pk for video in created]))
+            self.created += len(created)
+            self.finished.update(number for number, _ in batch)
+
+        done_through = self.done_through
+        while done_through + 1 in self.finished:
+            done_through += 1
+            self.finished.remove(done_through)
+        if done_through != self.done_through:
+            self.done_through = done_through
+            self._write_checkpoint()
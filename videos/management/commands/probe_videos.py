@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from videos import media_info
+from videos.models import Video
+
+
+class Command(BaseCommand):
+    help = 'Record duration, resolution and codecs of video files that have not been probed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('video_ids', nargs='*', type=int,
+                            help='Only these videos (default: all)')
+        parser.add_argument('--force', action='store_true',
+                            help='Probe again even if the metadata is up to date')
+        parser.add_argument('--faststart', action='store_true',
+                            help='Also rewrite files that are not in faststart layout')
+
+    def handle(self, *args, **options):
+        videos = Video.objects.exclude(video_file='').only('id', 'video_file', 'probed_file')
+        if options['video_ids']:
+            videos = videos.filter(pk__in=options['video_ids'])
+
+        probed = failed = 0
+        for video in videos.iterator(chunk_size=500):
+            if media_info.is_current(video) and not options['force']:
+                continue
+            try:
+                if media_info.probe_video(video.pk, rewrite=options['faststart'] or None, force=options['force']):
+                    probed += 1
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f'Video {video.pk}: {e}')
+        self.stdout.write(self.style.SUCCESS(f'Probed {probed} videos ({failed} failed).'))
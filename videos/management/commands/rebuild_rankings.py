@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from videos import ranking
+
+
+class Command(BaseCommand):
+    help = 'Recompute the trending and top rankings of all videos from their hourly activity'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backfill', action='store_true',
+                            help='First refill the comment and rating counts of the ranking window '
+                                 'from the comments and ratings themselves (e.g. after first deploying)')
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            ranking.backfill()
+        ranked = ranking.rebuild_rankings()
+        self.stdout.write(self.style.SUCCESS(f'Ranked {ranked} videos.'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from videos.models import Video
+
+
+class Command(BaseCommand):
+    help = 'Recompute like, rating and comment counters on videos that have drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of drifted videos repaired per UPDATE')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report how many videos have drifted')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            self.stdout.write(f'{Video.objects.drifted().count()} videos have drifted counters.')
+            return
+
+        repaired = Video.objects.reconcile_drifted(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Repaired counters on {repaired} videos.'))
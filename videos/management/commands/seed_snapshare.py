@@ -0,0 +1,183 @@
+import random
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from videos import ranking, response_cache, search
+from videos.models import Comment, Rating, Video
+
+WORDS = (
+    'city night river storm summer winter road home last first lost found dark light ocean '
+    'mountain desert forest machine dream story secret silent broken golden wild quiet red '
+    'blue journey escape return island signal echo garden shadow fire glass paper stone'
+).split()
+COMPANIES = ('Northlight', 'Bluewater', 'Red Barn', 'Open Field', 'Parallax', 'Tin Roof')
+
+
+def zipf_weights(count, exponent):
+    """Weights of ranks 1..count under a power law; rank 1 is the most popular."""
+    return [1 / (rank ** exponent) for rank in range(1, count + 1)]
+
+
+def _sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+class Command(BaseCommand):
+    help = ('Fill the database with a generated dataset (users, videos, comments, ratings, likes) '
+            'for benchmarking; popularity follows a power law')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--creators', type=float, default=0.1,
+                            help='Fraction of users with the creator role')
+        parser.add_argument('--videos', type=int, default=5000)
+        parser.add_argument('--comments', type=int, default=50000)
+        parser.add_argument('--ratings', type=int, default=50000)
+        parser.add_argument('--likes', type=int, default=100000)
+        parser.add_argument('--days', type=int, default=365,
+                            help='Spread upload dates over this many days')
+        parser.add_argument('--exponent', type=float, default=1.1,
+                            help='Power-law exponent of video and creator popularity')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for repeatable datasets')
+        parser.add_argument('--prefix', default='seed',
+                            help='Username prefix of the generated users')
+        parser.add_argument('--password', default='snapshare',
+                            help='Password of every generated user')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--clear', action='store_true',
+                            help='Delete users (and their content) from a previous run with the same prefix first')
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        prefix = f'{options["prefix"]}_'
+
+        existing = User.objects.filter(username__startswith=prefix)
+        if existing.exists():
+            if not options['clear']:
+                raise CommandError(f'Users named {prefix}* already exist; pass --clear to replace them.')
+            deleted, _ = existing.delete()
+            self.stdout.write(f'Deleted {deleted} rows from a previous run.')
+        if options['users'] < 1 or (options['videos'] and options['creators'] <= 0):
+            raise CommandError('Needs at least one user, and a creator if there are videos.')
+
+        with transaction.atomic():
+            users = self._users(User, rng, options, prefix)
+            creators = [user for user in users if user.role == User.CREATOR]
+            videos = self._videos(rng, options, creators)
+
+            # Popularity ranks: a random permutation, so pk order says nothing
+            video_weights = zipf_weights(len(videos), options['exponent'])
+            by_popularity = rng.sample(videos, len(videos))
+            self._comments(rng, options, by_popularity, video_weights, users)
+            self._pairs(rng, options, 'ratings', by_popularity, video_weights, users)
+            self._pairs(rng, options, 'likes', by_popularity, video_weights, users)
+
+            seeded = Video.objects.filter(pk__in=[video.pk for video in videos])
+            seeded.reconcile_counters()
+        search.update_search_vectors(seeded, batch_size=batch_size)
+        # Recent comments and ratings make up the trending and top feeds
+        ranking.backfill()
+        ranking.rebuild_rankings()
+        response_cache.bump_list_version()
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(users)} users ({len(creators)} creators) and {len(videos)} videos.'
+        ))
+
+    def _users(self, User, rng, options, prefix):
+        password = make_password(options['password'])  # hashed once, shared by every user
+        creator_count = max(1, round(options['users'] * options['creators'])) if options['videos'] else 0
+        users = [
+            User(
+                username=f'{prefix}{i}',
+                email=f'{prefix}{i}@example.com',
+                password=password,
+                role=User.CREATOR if i < creator_count else User.CONSUMER,
+                bio=_sentence(rng, rng.randint(0, 12)),
+            )
+            for i in range(options['users'])
+        ]
+        users = User.objects.bulk_create(users, batch_size=options['batch_size'])
+        self.stdout.write(f'{len(users)} users')
+        return users
+
+    def _videos(self, rng, options, creators):
+        now = timezone.now()
+        # A few prolific creators and a long tail
+        creator_weights = zipf_weights(len(creators), options['exponent'])
+        views_weights = zipf_weights(options['videos'], options['exponent'])
+        view_ranks = rng.sample(range(options['videos']), options['videos'])
+        videos = [
+            Video(
+                title=_sentence(rng, rng.randint(2, 6)),
+                description='\n'.join(_sentence(rng, rng.randint(8, 30)) for _ in range(rng.randint(1, 3))),
+                video_file='videos/seed.mp4',
+                thumbnail='thumbnails/seed.jpg',
+                creator=rng.choices(creators, creator_weights)[0],
+                publisher=rng.choice(COMPANIES),
+                producer=rng.choice(COMPANIES),
+                genre=rng.choice(Video.GENRE_CHOICES)[0],
+                age_rating=rng.choice(Video.AGE_RATING_CHOICES)[0],
+                views=int(1_000_000 * views_weights[view_ranks[i]]),
+            )
+            for i in range(options['videos'])
+        ]
+        videos = Video.objects.bulk_create(videos, batch_size=options['batch_size'])
+        # upload_date is auto_now_add, so spread the dates in a second pass
+        for video in videos:
+            video.upload_date = now - timedelta(seconds=rng.uniform(0, options['days'] * 86400))
+        Video.objects.bulk_update(videos, ['upload_date'], batch_size=options['batch_size'])
+        self.stdout.write(f'{len(videos)} videos')
+        return videos
+
+    def _comments(self, rng, options, videos, weights, users):
+        if not videos:
+            return
+        now = timezone.now()
+        batch = []
+        created = 0
+        for video in rng.choices(videos, weights, k=options['comments']):
+            batch.append(Comment(video=video, user=rng.choice(users), text=_sentence(rng, rng.randint(3, 40))))
+            if len(batch) >= options['batch_size']:
+                created += self._save_comments(rng, batch, now)
+                batch = []
+        created += self._save_comments(rng, batch, now)
+        self.stdout.write(f'{created} comments')
+
+    def _save_comments(self, rng, comments, now):
+        comments = Comment.objects.bulk_create(comments)
+        for comment in comments:
+            age = (now - comment.video.upload_date).total_seconds()
+            comment.created_at = now - timedelta(seconds=rng.uniform(0, age))
+        Comment.objects.bulk_update(comments, ['created_at'])
+        return len(comments)
+
+    def _pairs(self, rng, options, kind, videos, weights, users):
+        """Up to ``options[kind]`` distinct (video, user) ratings or likes."""
+        if not videos:
+            return
+        count = min(options[kind], len(videos) * len(users))
+        pairs = set()
+        # Popular videos saturate; give up after a bounded number of draws
+        for _ in range(20):
+            missing = count - len(pairs)
+            if not missing:
+                break
+            for video in rng.choices(videos, weights, k=missing):
+                pairs.add((video.pk, rng.choice(users).pk))
+        pairs = list(pairs)[:count]
+        if kind == 'ratings':
+            rows = [Rating(video_id=video_id, user_id=user_id, rating=rng.choices((1, 2, 3, 4, 5), (1, 1, 2, 4, 4))[0])
+                    for video_id, user_id in pairs]
+            Rating.objects.bulk_create(rows, batch_size=options['batch_size'])
+        else:
+            Like = Video.likes.through
+            Like.objects.bulk_create([Like(video_id=video_id, customuser_id=user_id) for video_id, user_id in pairs],
+                                     batch_size=options['batch_size'])
+        self.stdout.write(f'{len(pairs)} {kind}')
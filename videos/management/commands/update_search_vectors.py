@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from videos import search
+from videos.models import Video
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search vectors of all videos (PostgreSQL only)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of videos updated per UPDATE')
+
+    def handle(self, *args, **options):
+        if not search.supported(Video.objects.all()):
+            self.stdout.write('Full-text search needs PostgreSQL; nothing to do.')
+            return
+        updated = search.update_search_vectors(Video.objects.all(), batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Updated search vectors of {updated} videos.'))
@@ -0,0 +1,87 @@
+"""
+Video file metadata.
+
+After a video file is saved, a background job reads its MP4 boxes (see
+videos.mp4) and records duration, dimensions, codecs, bitrate and where the
+``moov`` box sits on the Video.  With ``VIDEO_FASTSTART_REWRITE`` on, a file
+whose ``moov`` trails the media data is also copied into faststart layout
+and the Video switched over to the copy.
+"""
+import logging
+import os
+
+from django.conf import settings
+from django.core.files import File
+
+from snapshare.cloud_storage import open_range_reader
+
+from . import mp4, response_cache
+from .models import Video
+
+logger = logging.getLogger(__name__)
+
+FIELDS = (
+    'duration', 'width', 'height', 'video_codec', 'audio_codec',
+    'bitrate', 'file_size', 'moov_offset', 'faststart',
+)
+
+
+def is_current(video):
+    return bool(video.video_file) and video.probed_file == video.video_file.name
+
+
+def _empty():
+    return {field: '' if field.endswith('codec') else None for field in FIELDS}
+
+
+def _rewrite_faststart(storage, name, reader):
+    layout = mp4.FaststartLayout.plan(reader)
+    if layout is None:
+        return None
+    root, extension = os.path.splitext(name)
+    return storage.save(f'{root}_faststart{extension}', File(layout, name=os.path.basename(name)))
+
+
+def probe_video(video_id, rewrite=None, force=False):
+    """Record a video's file metadata. Returns True if the Video was updated."""
+    video = Video.objects.only('id', 'video_file', 'probed_file').get(pk=video_id)
+    if not video.video_file or (is_current(video) and not force):
+        return False
+    if rewrite is None:
+        rewrite = settings.VIDEO_FASTSTART_REWRITE
+
+    name = video.video_file.name
+    storage = video.video_file.storage
+    new_name = None
+    with open_range_reader(storage, name) as reader:
+        try:
+            info = mp4.probe(reader)
+        except mp4.MP4Error as e:
+            # Not an MP4 (WebM, AVI, ...) or damaged; remember it was tried
+            logger.info('Could not read MP4 metadata of %s: %s', name, e)
+            info = {**_empty(), 'file_size': reader.size}
+        else:
+            if rewrite and not info['faststart']:
+                new_name = _rewrite_faststart(storage, name, reader)
+
+    values = info
+    if new_name:
+        with open_range_reader(storage, new_name) as reader:
+            values = {**mp4.probe(reader), 'video_file': new_name}
+
+    # Only record the result if the file was not replaced meanwhile
+    updated = Video.objects.filter(pk=video.pk, video_file=name).update(
+        probed_file=new_name or name, **values
+    )
+    if new_name:
+        storage.delete(name if updated else new_name)
+    if updated:
+        response_cache.bump_video_version(video.pk)
+    return bool(updated)
+
+
+def schedule(video_id):
+    """Queue probing of a video's file for the job worker."""
+    from .tasks import probe_video as probe_task
+
+    return probe_task.enqueue({'video_id': video_id}, unique_key=f'mediainfo:{video_id}')
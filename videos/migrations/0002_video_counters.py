@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:20
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    Video = apps.get_model('videos', 'Video')
+    Comment = apps.get_model('videos', 'Comment')
+    Rating = apps.get_model('videos', 'Rating')
+
+    def per_video(queryset, aggregate):
+        return Coalesce(Subquery(
+            queryset.filter(video=OuterRef('pk')).order_by().values('video')
+            .annotate(total=aggregate).values('total')
+        ), 0)
+
+    Video.objects.update(
+        like_count=per_video(Video.likes.through.objects.all(), Count('*')),
+        rating_sum=per_video(Rating.objects.all(), Sum('rating')),
+        rating_count=per_video(Rating.objects.all(), Count('*')),
+        comment_count=per_video(Comment.objects.all(), Count('*')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:36
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+from snapshare.postgres import AddIndexIfPostgres, is_postgres
+
+
+def backfill_search_vectors(apps, schema_editor):
+    # The vector of videos.search.search_vector() as of this migration,
+    # written out so later changes to that module cannot break it
+    connection = schema_editor.connection
+    if not is_postgres(connection):
+        return
+    qn = connection.ops.quote_name
+    Video = apps.get_model('videos', 'Video')
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    video_table, creator = qn(Video._meta.db_table), qn(Video._meta.get_field('creator').column)
+    user_table, user_pk = qn(User._meta.db_table), qn(User._meta.pk.column)
+    username = qn(User._meta.get_field('username').column)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            UPDATE {video_table} AS video SET search_vector =
+                setweight(to_tsvector(%(config)s::regconfig, COALESCE(video.title, '')), 'A')
+                || setweight(to_tsvector(%(config)s::regconfig, COALESCE(video.description, '')), 'B')
+                || setweight(to_tsvector(%(config)s::regconfig, COALESCE(
+                    (SELECT {username} FROM {user_table} WHERE {user_pk} = video.{creator}), '')), 'C')
+                || setweight(to_tsvector(%(config)s::regconfig,
+                    COALESCE(video.publisher, '') || ' ' || COALESCE(video.producer, '')), 'D')
+            """,
+            {'config': settings.SEARCH_CONFIG},
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0005_video_media_info'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_search_vectors, migrations.RunPython.noop),
+        AddIndexIfPostgres(
+            model_name='video',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='video_search_vector_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:37
+
+from django.conf import settings
+from django.db import migrations, models
+
+from snapshare.postgres import AddIndexConcurrently, RunSQLIfPostgres
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('videos', '0006_video_search_vector'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='comment',
+            index=models.Index(fields=['video', '-created_at', '-id'], name='comment_video_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='rating',
+            index=models.Index(fields=['video', 'rating'], name='rating_video_rating_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='video',
+            index=models.Index(fields=['-upload_date', '-id'], name='video_upload_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='video',
+            index=models.Index(fields=['creator', '-upload_date'], name='video_creator_date_idx'),
+        ),
+        # The auto-created likes table only has its (video, user) unique
+        # index; this serves "which of these videos has the user liked"
+        RunSQLIfPostgres(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS videos_video_likes_user_video_idx '
+            'ON videos_video_likes (customuser_id, video_id)',
+            'DROP INDEX CONCURRENTLY IF EXISTS videos_video_likes_user_video_idx',
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:54
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0007_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VideoRanking',
+            fields=[
+                ('video', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ranking', serialize=False, to='videos.video')),
+                ('trending', models.FloatField()),
+                ('top_week', models.FloatField()),
+                ('updated_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-trending', '-video'], name='ranking_trending_idx'), models.Index(fields=['-top_week', '-video'], name='ranking_top_week_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='VideoActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.IntegerField(help_text='Hours since the Unix epoch')),
+                ('views', models.IntegerField(db_default=0, default=0)),
+                ('likes', models.IntegerField(db_default=0, default=0)),
+                ('comments', models.IntegerField(db_default=0, default=0)),
+                ('rating_sum', models.IntegerField(db_default=0, default=0, help_text='Stars given')),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activity', to='videos.video')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['updated_at'], name='activity_updated_idx'), models.Index(fields=['hour'], name='activity_hour_idx')],
+                'unique_together': {('video', 'hour')},
+            },
+        ),
+    ]
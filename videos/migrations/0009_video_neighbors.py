@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0008_video_rankings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NeighborQueue',
+            fields=[
+                ('video', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to='videos.video')),
+                ('marked_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='VideoNeighbor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('neighbor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbor_of', to='videos.video')),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbors', to='videos.video')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['video', '-score'], name='neighbor_video_score_idx')],
+                'unique_together': {('video', 'neighbor')},
+            },
+        ),
+    ]
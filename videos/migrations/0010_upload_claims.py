@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:18
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0009_video_neighbors'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadClaim',
+            fields=[
+                ('blob_name', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('kind', models.CharField(max_length=20)),
+                ('claimed_at', models.DateTimeField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['claimed_at'], name='upload_claim_claimed_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0011_upload_session_committing'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RankingUpdate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -1,9 +1,68 @@
-﻿from django.db import models
+﻿import uuid
+
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db import connections, models, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 User = get_user_model()
 
+
+def _count_subquery(queryset, expression=None):
+    # Correlated per-video aggregate usable inside an UPDATE
+    aggregate = expression if expression is not None else Count('*')
+    return Coalesce(
+        Subquery(
+            queryset.filter(video=OuterRef('pk'))
+            .order_by()
+            .values('video')
+            .annotate(total=aggregate)
+            .values('total')
+        ),
+        0,
+    )
+
+
+class VideoQuerySet(models.QuerySet):
+    def with_true_counters(self):
+        return self.annotate(
+            true_like_count=_count_subquery(Video.likes.through.objects.all()),
+            true_rating_sum=_count_subquery(Rating.objects.all(), Sum('rating')),
+            true_rating_count=_count_subquery(Rating.objects.all()),
+            true_comment_count=_count_subquery(Comment.objects.all()),
+        )
+
+    def drifted(self):
+        """Videos whose stored counters disagree with the underlying rows."""
+        return self.with_true_counters().filter(
+            ~Q(like_count=F('true_like_count'))
+            | ~Q(rating_sum=F('true_rating_sum'))
+            | ~Q(rating_count=F('true_rating_count'))
+            | ~Q(comment_count=F('true_comment_count'))
+        )
+
+    def reconcile_counters(self):
+        """Recompute the denormalized counters in a single set-based UPDATE."""
+        return self.update(
+            like_count=_count_subquery(Video.likes.through.objects.all()),
+            rating_sum=_count_subquery(Rating.objects.all(), Sum('rating')),
+            rating_count=_count_subquery(Rating.objects.all()),
+            comment_count=_count_subquery(Comment.objects.all()),
+        )
+
+    def reconcile_drifted(self, batch_size=1000):
+        """Repair only the drifted videos, ``batch_size`` per UPDATE. Returns the number repaired."""
+        drifted = list(self.drifted().order_by('pk').values_list('pk', flat=True))
+        repaired = 0
+        for start in range(0, len(drifted), batch_size):
+            repaired += self.filter(pk__in=drifted[start:start + batch_size]).reconcile_counters()
+        return repaired
+
+
 class Video(models.Model):
     AGE_RATING_CHOICES = [
         ('G', 'General Audiences'),
@@ -35,18 +94,113 @@ class Video(models.Model):
     age_rating = models.CharField(max_length=5, choices=AGE_RATING_CHOICES)
     views = models.PositiveIntegerField(default=0)
     likes = models.ManyToManyField(User, related_name='liked_videos', blank=True)
+
+    # Denormalized counters, kept in step by toggle_like(), rate(),
+    # add_comment() and the deletion of comments and ratings (see
+    # videos.signals); `manage.py reconcile_counters` repairs any drift.
+    like_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+
+    # Resized WebP/JPEG copies of the thumbnail, see videos.thumbnails
+    thumbnail_variants = models.JSONField(default=dict, blank=True, editable=False)
+
+    # Read from the video file's MP4 boxes by videos.media_info; probed_file
+    # is the video_file name they were read from
+    duration = models.FloatField(null=True, blank=True, editable=False, help_text='Seconds')
+    width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    video_codec = models.CharField(max_length=10, blank=True, editable=False)
+    audio_codec = models.CharField(max_length=10, blank=True, editable=False)
+    bitrate = models.PositiveIntegerField(null=True, blank=True, editable=False, help_text='Bits per second')
+    file_size = models.BigIntegerField(null=True, blank=True, editable=False)
+    moov_offset = models.BigIntegerField(null=True, blank=True, editable=False)
+    faststart = models.BooleanField(null=True, editable=False,
+                                    help_text='Whether the moov box precedes the media data')
+    probed_file = models.CharField(max_length=100, blank=True, editable=False)
+
+    # Weighted full-text vector maintained by videos.search (PostgreSQL only)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = VideoQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='video_search_vector_idx'),
+            # Latest videos (home, API list and its cursor pages)
+            models.Index(fields=['-upload_date', '-id'], name='video_upload_date_idx'),
+            # "More from this creator" on the detail page
+            models.Index(fields=['creator', '-upload_date'], name='video_creator_date_idx'),
+        ]
     
     def __str__(self):
         return self.title
     
     def total_likes(self):
-        return self.likes.count()
+        return self.like_count
+
+    @property
+    def average_rating(self):
+        if not self.rating_count:
+            return None
+        return self.rating_sum / self.rating_count
+
+    def _lock_row(self):
+        # Row lock on the video serializes counter updates for it
+        Video.objects.select_for_update().filter(pk=self.pk).values_list('pk', flat=True).get()
+
+    def toggle_like(self, user):
+        """Like or unlike the video for ``user``; returns True if now liked."""
+        with transaction.atomic():
+            self._lock_row()
+            if self.likes.filter(id=user.id).exists():
+                self.likes.remove(user)
+                liked, delta = False, -1
+            else:
+                self.likes.add(user)
+                liked, delta = True, 1
+            Video.objects.filter(pk=self.pk).update(like_count=F('like_count') + delta)
+            VideoActivity.objects.record('likes', {self.pk: delta})
+        self.refresh_from_db(fields=['like_count'])
+        return liked
+
+    def rate(self, user, value):
+        """Create or change ``user``'s rating and update the rating totals."""
+        with transaction.atomic():
+            self._lock_row()
+            previous = Rating.objects.filter(video=self, user=user).values_list('rating', flat=True).first()
+            rating, _ = Rating.objects.update_or_create(
+                video=self,
+                user=user,
+                defaults={'rating': value}
+            )
+            Video.objects.filter(pk=self.pk).update(
+                rating_sum=F('rating_sum') + value - (previous or 0),
+                rating_count=F('rating_count') + (1 if previous is None else 0),
+            )
+            VideoActivity.objects.record('rating_sum', {self.pk: value - (previous or 0)})
+        self.refresh_from_db(fields=['rating_sum', 'rating_count'])
+        return rating
+
+    def add_comment(self, user, text):
+        with transaction.atomic():
+            comment = Comment.objects.create(video=self, user=user, text=text)
+            Video.objects.filter(pk=self.pk).update(comment_count=F('comment_count') + 1)
+            VideoActivity.objects.record('comments', {self.pk: 1})
+        return comment
 
 class Comment(models.Model):
     video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='comments')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     text = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # A video's comments, newest first, paged by (created_at, id)
+            models.Index(fields=['video', '-created_at', '-id'], name='comment_video_created_idx'),
+        ]
     
     def __str__(self):
         return f'{self.user.username} - {self.text[:50]}'
@@ -61,6 +215,211 @@ class Rating(models.Model):
     
     class Meta:
         unique_together = ('video', 'user')
+        indexes = [
+            # Index-only scans for per-video rating sums (counter reconciliation)
+            models.Index(fields=['video', 'rating'], name='rating_video_rating_idx'),
+        ]
     
     def __str__(self):
-        return f'{self.user.username} - {self.rating} stars'
\ No newline at end of file
+        return f'{self.user.username} - {self.rating} stars'
+
+class UploadSession(models.Model):
+    """A resumable, chunked upload of one file (see videos.chunked_upload)."""
+    ACTIVE = 'active'
+    COMMITTING = 'committing'
+    COMMITTED = 'committed'
+
+    STATUS_CHOICES = [
+        (ACTIVE, 'Active'),
+        (COMMITTING, 'Committing'),
+        (COMMITTED, 'Committed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    kind = models.CharField(max_length=20)
+    filename = models.CharField(max_length=255)
+    blob_name = models.CharField(max_length=255)
+    total_size = models.PositiveBigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=ACTIVE)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.filename} ({self.status})'
+
+    @property
+    def total_chunks(self):
+        return max(1, -(-self.total_size // self.chunk_size))
+
+    def expected_chunk_size(self, index):
+        if index == self.total_chunks - 1:
+            return self.total_size - index * self.chunk_size
+        return self.chunk_size
+
+
+class UploadChunk(models.Model):
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='chunks')
+    index = models.PositiveIntegerField()
+    offset = models.PositiveBigIntegerField()
+    size = models.PositiveIntegerField()
+    checksum = models.CharField(max_length=64)  # hex SHA-256
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('session', 'index')
+        ordering = ['index']
+
+    def __str__(self):
+        return f'{self.session_id} #{self.index}'
+
+
+class UploadClaim(models.Model):
+    """
+    A blob path handed out to a user for an upload (see videos.upload_tokens).
+    In the database rather than a cache, so whichever worker receives the
+    upload form can check it.
+    """
+    blob_name = models.CharField(max_length=255, primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    kind = models.CharField(max_length=20)
+    claimed_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['claimed_at'], name='upload_claim_claimed_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.blob_name} ({self.kind})'
+
+
+def current_hour(when=None):
+    """Hours since the Unix epoch, the bucket of ``when`` (default: now)."""
+    return int((when or timezone.now()).timestamp() // 3600)
+
+
+class VideoActivityQuerySet(models.QuerySet):
+    def record(self, field, counts, hour=None):
+        """
+        Add ``counts`` ({video_id: n}) to ``field`` of each video's bucket for
+        ``hour`` (default: the current one) with one upsert per 500 videos.
+        """
+        counts = [(video_id, n) for video_id, n in counts.items() if n]
+        if not counts:
+            return
+        hour = current_hour() if hour is None else hour
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        column = qn(self.model._meta.get_field(field).column)
+        updated_at = connection.ops.adapt_datetimefield_value(timezone.now())
+        for start in range(0, len(counts), 500):
+            batch = counts[start:start + 500]
+            # ON CONFLICT ... DO UPDATE is understood by PostgreSQL and SQLite
+            sql = (
+                f'INSERT INTO {table} (video_id, hour, {column}, updated_at) '
+                f'VALUES {", ".join(["(%s, %s, %s, %s)"] * len(batch))} '
+                f'ON CONFLICT (video_id, hour) DO UPDATE SET '
+                f'{column} = {table}.{column} + EXCLUDED.{column}, updated_at = EXCLUDED.updated_at'
+            )
+            params = [value for video_id, n in batch for value in (video_id, hour, n, updated_at)]
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+
+
+class VideoActivity(models.Model):
+    """
+    Activity on a video during one hour, the input of the trending and top
+    rankings (see videos.ranking). Net counts: an unlike subtracts a like.
+    """
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='activity')
+    hour = models.IntegerField(help_text='Hours since the Unix epoch')
+    views = models.IntegerField(default=0, db_default=0)
+    likes = models.IntegerField(default=0, db_default=0)
+    comments = models.IntegerField(default=0, db_default=0)
+    rating_sum = models.IntegerField(default=0, db_default=0, help_text='Stars given')
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    objects = VideoActivityQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ('video', 'hour')
+        indexes = [
+            # Buckets changed since the last ranking update
+            models.Index(fields=['updated_at'], name='activity_updated_idx'),
+            # Buckets leaving the ranking window, and pruning
+            models.Index(fields=['hour'], name='activity_hour_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.video_id} @ {self.hour}'
+
+
+class VideoRanking(models.Model):
+    """Precomputed feed scores of a video with activity in the ranking window."""
+    video = models.OneToOneField(Video, on_delete=models.CASCADE, primary_key=True, related_name='ranking')
+    # Log of the exponentially decayed activity, see videos.ranking
+    trending = models.FloatField()
+    # Weighted activity of the last RANKING_WINDOW_DAYS, undecayed
+    top_week = models.FloatField()
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-trending', '-video'], name='ranking_trending_idx'),
+            models.Index(fields=['-top_week', '-video'], name='ranking_top_week_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.video_id}: {self.trending:.2f} / {self.top_week:.0f}'
+
+
+class RankingUpdate(models.Model):
+    """
+    When the rankings were last brought up to date, by update_rankings() or
+    rebuild_rankings(); a single row. The next update rescores what changed since.
+    """
+    started_at = models.DateTimeField()
+
+    def __str__(self):
+        return f'Rankings as of {self.started_at}'
+
+
+class VideoNeighbor(models.Model):
+    """One of a video's most similar videos by who liked and rated both (see videos.recommendations)."""
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='neighbors')
+    neighbor = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='neighbor_of')
+    score = models.FloatField()
+
+    class Meta:
+        unique_together = ('video', 'neighbor')
+        indexes = [
+            # A video's recommendations, best first
+            models.Index(fields=['video', '-score'], name='neighbor_video_score_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.video_id} -> {self.neighbor_id} ({self.score:.3f})'
+
+
+class NeighborQueueQuerySet(models.QuerySet):
+    def add(self, video_ids):
+        """Queue ``video_ids`` for a neighbor refresh, or move their mark to now."""
+        marked_at = timezone.now()
+        self.bulk_create(
+            [self.model(video_id=video_id, marked_at=marked_at) for video_id in video_ids],
+            update_conflicts=True, unique_fields=['video'], update_fields=['marked_at'],
+        )
+
+
+class NeighborQueue(models.Model):
+    """Videos whose likes or ratings changed since their neighbors were computed."""
+    video = models.OneToOneField(Video, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    marked_at = models.DateTimeField()
+
+    objects = NeighborQueueQuerySet.as_manager()
+
+    def __str__(self):
+        return f'{self.video_id} ({self.marked_at})'
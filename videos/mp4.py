@@ -0,0 +1,319 @@
+"""
+Streaming ISO-BMFF (MP4/MOV) inspection and faststart rewriting.
+
+Only box headers and the ``moov`` box are read, through a ``RangeReader``,
+so probing a multi-gigabyte upload costs a handful of small range requests
+rather than a download.  ``probe()`` returns:
+
+    {"duration": 62.5, "width": 1920, "height": 1080,
+     "video_codec": "avc1", "audio_codec": "mp4a", "bitrate": 4123456,
+     "file_size": 32212254, "moov_offset": 32180000, "faststart": False}
+
+A file whose ``moov`` comes after the media data cannot start playing until
+the browser has fetched its end.  ``FaststartLayout`` describes the same
+file with ``moov`` moved to the front (chunk offsets in ``stco``/``co64``
+shifted to match) and streams it out without holding the media in memory.
+"""
+import struct
+
+from snapshare.cloud_storage import RangeReader
+
+# Boxes on the path to the sample tables; everything else is copied as is
+CONTAINERS = {b'moov', b'trak', b'mdia', b'minf', b'stbl'}
+MAX_MOOV_SIZE = 64 * 1024 * 1024
+COPY_BLOCK_SIZE = 1024 * 1024
+
+
+class MP4Error(ValueError):
+    pass
+
+
+class Box:
+    __slots__ = ('type', 'offset', 'size', 'header_size')
+
+    def __init__(self, box_type, offset, size, header_size):
+        self.type = box_type
+        self.offset = offset
+        self.size = size
+        self.header_size = header_size
+
+    @property
+    def end(self):
+        return self.offset + self.size
+
+    @property
+    def payload_offset(self):
+        return self.offset + self.header_size
+
+    def __repr__(self):
+        return f'<Box {self.type.decode("latin-1")} @{self.offset}+{self.size}>'
+
+
+class BytesReader(RangeReader):
+    """RangeReader over bytes already in memory, e.g. a loaded moov box."""
+
+    def __init__(self, data):
+        super().__init__(None, None)
+        self.data = data
+        self._size = len(data)
+
+    def read_at(self, offset, length):
+        return self.data[offset:offset + length]
+
+
+def read_boxes(reader, start=0, end=None):
+    """Yield the boxes between ``start`` and ``end``, reading only their headers."""
+    end = reader.size if end is None else end
+    offset = start
+    while offset + 8 <= end:
+        header = reader.read_at(offset, 16)
+        size, box_type = struct.unpack('>I4s', header[:8])
+        header_size = 8
+        if size == 1:
+            if len(header) < 16:
+                raise MP4Error(f'Truncated header at {offset}')
+            size = struct.unpack('>Q', header[8:16])[0]
+            header_size = 16
+        elif size == 0:
+            # Extends to the end of its parent
+            size = end - offset
+        if size < header_size or offset + size > end:
+            raise MP4Error(f'Invalid {box_type!r} box at {offset}')
+        yield Box(box_type, offset, size, header_size)
+        offset += size
+
+
+def _children(reader, box):
+    return read_boxes(reader, box.payload_offset, box.end)
+
+
+def _find(reader, box, *path):
+    """First descendant of ``box`` along the box types in ``path``."""
+    for child in _children(reader, box):
+        if child.type == path[0]:
+            return child if len(path) == 1 else _find(reader, child, *path[1:])
+    return None
+
+
+def _timescale_duration(reader, box):
+    # mvhd and mdhd share this layout after the version/flags word
+    version = reader.read_at(box.payload_offset, 1)[0]
+    if version == 1:
+        timescale, duration = struct.unpack('>IQ', reader.read_at(box.payload_offset + 20, 12))
+    else:
+        timescale, duration = struct.unpack('>II', reader.read_at(box.payload_offset + 12, 8))
+    return timescale, duration
+
+
+def _seconds(timescale, duration):
+    if not timescale or duration in (0, 0xFFFFFFFF, 0xFFFFFFFFFFFFFFFF):
+        return None
+    return duration / timescale
+
+
+def _track_info(reader, trak):
+    info = {}
+    hdlr = _find(reader, trak, b'mdia', b'hdlr')
+    if hdlr is not None:
+        info['handler'] = reader.read_at(hdlr.payload_offset + 8, 4)
+    mdhd = _find(reader, trak, b'mdia', b'mdhd')
+    if mdhd is not None:
+        info['duration'] = _seconds(*_timescale_duration(reader, mdhd))
+    tkhd = _find(reader, trak, b'tkhd')
+    if tkhd is not None:
+        # Presentation size in 16.16 fixed point closes the box
+        width, height = struct.unpack('>II', reader.read_at(tkhd.end - 8, 8))
+        info['width'], info['height'] = width >> 16, height >> 16
+    stsd = _find(reader, trak, b'mdia', b'minf', b'stbl', b'stsd')
+    if stsd is not None:
+        entry = next(read_boxes(reader, stsd.payload_offset + 8, stsd.end), None)
+        if entry is not None:
+            info['codec'] = entry.type.decode('latin-1').strip()
+            if info.get('handler') == b'vide' and not info.get('width'):
+                # Coded size from the visual sample entry
+                info['width'], info['height'] = struct.unpack('>HH', reader.read_at(entry.offset + 32, 4))
+    return info
+
+
+def parse_moov(data):
+    """Duration, dimensions and codecs from the bytes of a ``moov`` box."""
+    reader = BytesReader(data)
+    moov = next(read_boxes(reader))
+    result = {'duration': None, 'width': None, 'height': None, 'video_codec': '', 'audio_codec': ''}
+
+    mvhd = _find(reader, moov, b'mvhd')
+    if mvhd is not None:
+        result['duration'] = _seconds(*_timescale_duration(reader, mvhd))
+
+    for trak in _children(reader, moov):
+        if trak.type != b'trak':
+            continue
+        track = _track_info(reader, trak)
+        if result['duration'] is None and track.get('duration'):
+            result['duration'] = track['duration']
+        if track.get('handler') == b'vide' and not result['video_codec']:
+            result['video_codec'] = track.get('codec', '')
+            result['width'] = track.get('width') or None
+            result['height'] = track.get('height') or None
+        elif track.get('handler') == b'soun' and not result['audio_codec']:
+            result['audio_codec'] = track.get('codec', '')
+    return result
+
+
+def _top_level(reader, stop_at_moov=False):
+    boxes = []
+    for box in read_boxes(reader):
+        boxes.append(box)
+        if stop_at_moov and box.type == b'moov':
+            break
+    if not boxes or boxes[0].type not in (b'ftyp', b'styp', b'free', b'skip', b'wide', b'moov', b'mdat'):
+        raise MP4Error('Not an ISO base media file')
+    return boxes
+
+
+def _read_moov(reader, moov):
+    if moov.size > MAX_MOOV_SIZE:
+        raise MP4Error(f'moov box is too large ({moov.size} bytes)')
+    return reader.read_at(moov.offset, moov.size)
+
+
+def probe(reader):
+    """Metadata of the MP4 behind ``reader``; see the module docstring."""
+    boxes = _top_level(reader, stop_at_moov=True)
+    moov = boxes[-1]
+    if moov.type != b'moov':
+        raise MP4Error('No moov box')
+    result = parse_moov(_read_moov(reader, moov))
+    result['file_size'] = reader.size
+    result['moov_offset'] = moov.offset
+    result['faststart'] = not any(box.type == b'mdat' for box in boxes)
+    result['bitrate'] = round(reader.size * 8 / result['duration']) if result['duration'] else None
+    return result
+
+
+def _header(box_type, payload_size):
+    if payload_size + 8 <= 0xFFFFFFFF:
+        return struct.pack('>I4s', payload_size + 8, box_type)
+    return struct.pack('>I4sQ', 1, box_type, payload_size + 16)
+
+
+def _parse_tree(reader, box):
+    """(type, children) for containers on the sample table path, else (type, raw bytes)."""
+    if box.type in CONTAINERS:
+        return box.type, [_parse_tree(reader, child) for child in _children(reader, box)]
+    return box.type, reader.read_at(box.offset, box.size)
+
+
+def _chunk_offsets(raw):
+    box = next(read_boxes(BytesReader(raw)))
+    count = struct.unpack('>I', raw[box.header_size + 4:box.header_size + 8])[0]
+    fmt = '>%dQ' if box.type == b'co64' else '>%dI'
+    width = 8 if box.type == b'co64' else 4
+    start = box.header_size + 8
+    return raw[box.header_size:box.header_size + 4], struct.unpack(fmt % count, raw[start:start + count * width])
+
+
+def _serialize(node, shift, co64):
+    box_type, content = node
+    if isinstance(content, list):
+        payload = b''.join(_serialize(child, shift, co64) for child in content)
+    elif box_type in (b'stco', b'co64'):
+        version_flags, offsets = _chunk_offsets(content)
+        offsets = [shift(offset) for offset in offsets]
+        box_type = b'co64' if co64 or box_type == b'co64' else b'stco'
+        fmt = '>%dQ' if box_type == b'co64' else '>%dI'
+        payload = version_flags + struct.pack('>I', len(offsets)) + struct.pack(fmt % len(offsets), *offsets)
+    else:
+        return content
+    return _header(box_type, len(payload)) + payload
+
+
+def _max_chunk_offset(node, shift):
+    box_type, content = node
+    if isinstance(content, list):
+        return max((_max_chunk_offset(child, shift) for child in content), default=0)
+    if box_type == b'stco':
+        return max((shift(offset) for offset in _chunk_offsets(content)[1]), default=0)
+    return 0
+
+
+class FaststartLayout:
+    """
+    The file behind ``reader`` with ``moov`` placed right after ``ftyp``.
+
+    Use ``FaststartLayout.plan(reader)``, which returns None if the file is
+    already faststart; the layout is then read like a file (``read``/``size``)
+    to stream the rewritten copy into storage.
+    """
+
+    def __init__(self, reader, boxes, moov_bytes):
+        self.reader = reader
+        self.order = [box for box in boxes if box.type == b'ftyp'][:1]
+        moov = next(box for box in boxes if box.type == b'moov')
+        self.order += [moov] + [box for box in boxes if box not in self.order and box is not moov]
+
+        tree = _parse_tree(BytesReader(moov_bytes), next(read_boxes(BytesReader(moov_bytes))))
+        # The moov size only depends on whether stco has to become co64
+        co64 = False
+        while True:
+            moov_size = len(_serialize(tree, lambda offset: offset, co64))
+            shift = self._shift_for(boxes, moov, moov_size)
+            if co64 or _max_chunk_offset(tree, shift) <= 0xFFFFFFFF:
+                break
+            co64 = True
+        self.moov_bytes = _serialize(tree, shift, co64)
+        self.moov = moov
+        self.size = sum(box.size for box in self.order if box is not moov) + len(self.moov_bytes)
+        self._pieces = iter(self._iter_pieces())
+        self._buffer = b''
+
+    def _shift_for(self, boxes, moov, moov_size):
+        new_offsets = {}
+        position = 0
+        for box in self.order:
+            new_offsets[box.offset] = position
+            position += moov_size if box is moov else box.size
+        spans = [(box.offset, box.end, new_offsets[box.offset]) for box in boxes if box is not moov]
+
+        def shift(offset):
+            for start, end, new_start in spans:
+                if start <= offset < end:
+                    return offset - start + new_start
+            raise MP4Error(f'Chunk offset {offset} is outside the media data')
+        return shift
+
+    @classmethod
+    def plan(cls, reader):
+        boxes = _top_level(reader)
+        moov = next((box for box in boxes if box.type == b'moov'), None)
+        if moov is None:
+            raise MP4Error('No moov box')
+        if not any(box.type == b'mdat' and box.offset < moov.offset for box in boxes):
+            return None
+        return cls(reader, boxes, _read_moov(reader, moov))
+
+    def _iter_pieces(self):
+        for box in self.order:
+            if box is self.moov:
+                yield self.moov_bytes
+                continue
+            offset = box.offset
+            while offset < box.end:
+                data = self.reader.read_at(offset, min(COPY_BLOCK_SIZE, box.end - offset))
+                if not data:
+                    raise MP4Error('File ended early')
+                offset += len(data)
+                yield data
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            # The rest of the file
+            data, self._buffer = self._buffer + b''.join(self._pieces), b''
+            return data
+        while len(self._buffer) < size:
+            piece = next(self._pieces, None)
+            if piece is None:
+                break
+            self._buffer += piece
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
@@ -0,0 +1,141 @@
+"""
+Keyset (cursor) pagination.
+
+Pages are selected with a ``WHERE (a, b) < (last_a, last_b)`` style filter
+on an indexed ordering instead of ``OFFSET``, so every page costs the same
+no matter how deep it is, and no ``COUNT(*)`` is needed to paginate.
+"""
+import base64
+import json
+
+from django.db import connections
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class CursorPage:
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.object_list = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+
+class CursorPaginator:
+    """
+    Paginate ``queryset`` by ``ordering``, which must end in a unique field
+    (normally the primary key) so the position of every row is well defined.
+    """
+
+    def __init__(self, queryset, ordering, per_page=10):
+        self.queryset = queryset
+        self.ordering = list(ordering)
+        self.per_page = per_page
+        self.fields = [name.lstrip('-') for name in self.ordering]
+        self.descending = [name.startswith('-') for name in self.ordering]
+
+    def _field(self, name):
+        # An annotation (e.g. a score from a related table) or a model field
+        annotation = self.queryset.query.annotations.get(name)
+        if annotation is not None:
+            return annotation.output_field
+        return self.queryset.model._meta.get_field(name)
+
+    def encode_cursor(self, obj, direction):
+        values = []
+        for name in self.fields:
+            value = getattr(obj, name)
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        payload = json.dumps({'d': direction, 'v': values}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            direction, raw = payload['d'], payload['v']
+            if direction not in ('n', 'p') or len(raw) != len(self.fields):
+                raise InvalidCursor('Malformed cursor')
+            values = [self._field(name).to_python(value) for name, value in zip(self.fields, raw)]
+        except InvalidCursor:
+            raise
+        except Exception as e:
+            raise InvalidCursor(f'Invalid cursor: {e}') from e
+        return direction, values
+
+    def _after(self, values, reverse=False):
+        # Lexicographic "comes after" for the ordering, e.g. for
+        # (-upload_date, -id): upload_date < d OR (upload_date = d AND id < i)
+        condition = Q()
+        for i, name in enumerate(self.fields):
+            lookup = 'lt' if self.descending[i] != reverse else 'gt'
+            term = Q(**{f'{name}__{lookup}': values[i]})
+            for prev_name, prev_value in zip(self.fields[:i], values[:i]):
+                term &= Q(**{prev_name: prev_value})
+            condition |= term
+        return condition
+
+    def get_page(self, cursor=None):
+        direction, values = ('n', None) if not cursor else self.decode_cursor(cursor)
+        queryset = self.queryset
+        if direction == 'n':
+            if values is not None:
+                queryset = queryset.filter(self._after(values))
+            rows = list(queryset.order_by(*self.ordering)[:self.per_page + 1])
+            has_more = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            has_next, has_prev = has_more, values is not None
+        else:
+            reversed_ordering = [
+                name[1:] if name.startswith('-') else f'-{name}' for name in self.ordering
+            ]
+            queryset = queryset.filter(self._after(values, reverse=True))
+            rows = list(queryset.order_by(*reversed_ordering)[:self.per_page + 1])
+            has_more = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            # The row the cursor was taken from may be gone, and with it
+            # everything after the page
+            last = rows[-1] if rows else None
+            has_next = last is not None and self.queryset.filter(
+                self._after([getattr(last, name) for name in self.fields])
+            ).exists()
+            has_prev = has_more
+
+        return CursorPage(
+            rows,
+            next_cursor=self.encode_cursor(rows[-1], 'n') if rows and has_next else None,
+            prev_cursor=self.encode_cursor(rows[0], 'p') if rows and has_prev else None,
+        )
+
+
+def estimate_count(queryset):
+    """
+    Cheap row count for an unfiltered queryset: the planner's estimate on
+    PostgreSQL, an exact COUNT(*) elsewhere or when the queryset is filtered.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql' and not queryset.query.where:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        # reltuples is -1 for tables that have never been analyzed
+        if row and row[0] >= 0:
+            return row[0]
+    return queryset.count()
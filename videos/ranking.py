@@ -0,0 +1,193 @@
+"""
+Trending and top-this-week rankings.
+
+Activity is counted per video and hour in ``VideoActivity``: views as they
+are flushed from the view buffer, likes, stars and comments as they happen.
+``update_rankings()`` (a maintenance job every ``RANKING_UPDATE_INTERVAL``
+seconds) rescores only the videos whose buckets changed since its last run
+or dropped out of the ``RANKING_WINDOW_DAYS`` window, and stores the scores
+in ``VideoRanking`` where the feeds read them through an index.
+
+A bucket's weight is ``RANKING_WEIGHTS`` applied to its counts.  The top
+score is the plain sum over the window.  The trending score decays every
+bucket by half per ``RANKING_HALF_LIFE_HOURS`` of age, but is kept as a log
+relative to a fixed origin (the Unix epoch) rather than to the present:
+
+    trending = ln(sum(weight * exp((hour - now) / tau))) + now / tau
+
+which equals ``ln(sum(weight * exp(hour / tau)))``.  Time passing therefore
+never changes a stored score, and a video nobody touches keeps its score
+while new activity on others scores ever higher; only videos with new
+activity need rescoring.  Computing it relative to ``now`` keeps ``exp()``
+from overflowing.
+
+``rebuild_rankings()`` recomputes every score with one INSERT ... SELECT.
+"""
+import logging
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count, ExpressionWrapper, F, FloatField, Sum, Value
+from django.db.models.functions import Exp, Greatest, Ln, TruncHour
+from django.utils import timezone
+
+from . import response_cache
+from .models import Comment, Rating, RankingUpdate, VideoActivity, VideoRanking, current_hour
+
+logger = logging.getLogger(__name__)
+
+SORTS = ('latest', 'trending', 'top')
+BATCH_SIZE = 1000
+# Rows written while the previous update ran may commit after it read them
+OVERLAP = timedelta(minutes=1)
+# Stands in for a weight sum that unlikes took to zero or below
+MIN_WEIGHT = 1e-6
+
+
+def window_hours():
+    return settings.RANKING_WINDOW_DAYS * 24
+
+
+def _weight():
+    weights = settings.RANKING_WEIGHTS
+    return ExpressionWrapper(
+        F('views') * weights['views'] + F('likes') * weights['likes']
+        + F('comments') * weights['comments'] + F('rating_sum') * weights['rating_sum'],
+        output_field=FloatField(),
+    )
+
+
+def _scores(activity, now_hour):
+    """(video_id, trending, top_week) rows for the buckets of ``activity`` in the window."""
+    tau = settings.RANKING_HALF_LIFE_HOURS / math.log(2)
+    decay = Exp(ExpressionWrapper((F('hour') - now_hour) / Value(tau), output_field=FloatField()))
+    return (
+        activity.filter(hour__gt=now_hour - window_hours())
+        .order_by()
+        .values('video_id')
+        .annotate(
+            trending=Ln(Greatest(Sum(_weight() * decay), Value(MIN_WEIGHT))) + Value(now_hour / tau),
+            top_week=Sum(_weight()),
+        )
+        .values_list('video_id', 'trending', 'top_week')
+    )
+
+
+def rescore(video_ids, now_hour=None):
+    """Recompute the rankings of ``video_ids``; those without activity in the window are dropped."""
+    now_hour = current_hour() if now_hour is None else now_hour
+    updated_at = timezone.now()
+    video_ids = sorted(video_ids)
+    for start in range(0, len(video_ids), BATCH_SIZE):
+        batch = video_ids[start:start + BATCH_SIZE]
+        rows = [
+            VideoRanking(video_id=video_id, trending=trending, top_week=top_week, updated_at=updated_at)
+            for video_id, trending, top_week in _scores(VideoActivity.objects.filter(video_id__in=batch), now_hour)
+        ]
+        with transaction.atomic():
+            VideoRanking.objects.bulk_create(
+                rows, update_conflicts=True, unique_fields=['video'],
+                update_fields=['trending', 'top_week', 'updated_at'],
+            )
+            VideoRanking.objects.filter(video_id__in=batch).exclude(
+                video_id__in=[row.video_id for row in rows]
+            ).delete()
+    return len(video_ids)
+
+
+def _last_update():
+    return RankingUpdate.objects.values_list('started_at', flat=True).first()
+
+
+def _set_last_update(started):
+    # Kept in the database: every worker, and rebuild_rankings run from the
+    # command line, must see it, or each run would rescan the whole window
+    RankingUpdate.objects.update_or_create(pk=1, defaults={'started_at': started})
+
+
+def update_rankings():
+    """Rescore the videos with activity since the last run. Returns how many were rescored."""
+    started = timezone.now()
+    now_hour = current_hour(started)
+    last_update = _last_update()
+    since = last_update - OVERLAP if last_update else started - timedelta(hours=window_hours())
+    since_hour = current_hour(since)
+
+    changed = VideoActivity.objects.filter(updated_at__gte=since)
+    # Buckets that were inside the window at the last run and are not now
+    expired = VideoActivity.objects.filter(hour__gt=since_hour - window_hours(), hour__lte=now_hour - window_hours())
+    video_ids = set(changed.values_list('video_id', flat=True).distinct())
+    video_ids.update(expired.values_list('video_id', flat=True).distinct())
+    rescored = rescore(video_ids, now_hour)
+
+    # Kept until every run that could still look for them has passed
+    VideoActivity.objects.filter(hour__lte=since_hour - window_hours()).delete()
+    _set_last_update(started)
+    if rescored:
+        response_cache.bump_list_version()
+    logger.info('Rescored %d videos', rescored)
+    return rescored
+
+
+def backfill(now_hour=None):
+    """
+    Rebuild the comment and star counts in the window from the Comment and
+    Rating rows. Views and likes carry no timestamps, so only the buckets
+    recorded as they happened know them.
+    """
+    now_hour = current_hour() if now_hour is None else now_hour
+    first_hour = now_hour - window_hours() + 1
+    since = datetime.fromtimestamp(first_hour * 3600, tz=dt_timezone.utc)
+    with transaction.atomic():
+        VideoActivity.objects.filter(hour__gte=first_hour).update(comments=0, rating_sum=0)
+        for model, field, total in ((Comment, 'comments', Count('*')), (Rating, 'rating_sum', Sum('rating'))):
+            buckets = {}
+            rows = (
+                model.objects.filter(created_at__gte=since)
+                .annotate(bucket=TruncHour('created_at', tzinfo=dt_timezone.utc))
+                .order_by()
+                .values_list('bucket', 'video_id')
+                .annotate(total=total)
+            )
+            for bucket, video_id, count in rows:
+                buckets.setdefault(current_hour(bucket), {})[video_id] = count
+            for hour, counts in buckets.items():
+                VideoActivity.objects.record(field, counts, hour=hour)
+
+
+def rebuild_rankings():
+    """Replace every ranking with one computed from all the buckets, in a single statement."""
+    started = timezone.now()
+    select = _scores(VideoActivity.objects.all(), current_hour(started))
+    sql, params = select.query.sql_with_params()
+    connection = connections[VideoRanking.objects.db]
+    qn = connection.ops.quote_name
+    updated_at = connection.ops.adapt_datetimefield_value(started)
+    with transaction.atomic():
+        VideoRanking.objects.all().delete()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {qn(VideoRanking._meta.db_table)} (video_id, trending, top_week, updated_at) '
+                f'SELECT scores.*, %s FROM ({sql}) scores',
+                [updated_at, *params],
+            )
+            ranked = cursor.rowcount
+        _set_last_update(started)
+    response_cache.bump_list_version()
+    return ranked
+
+
+def feed(queryset, sort):
+    """
+    ``queryset`` in ``sort`` order ('latest', 'trending' or 'top'), with
+    the ordering to page it by. Ranked feeds annotate the score as ``score``.
+    """
+    if sort == 'latest':
+        return queryset, ('-upload_date', '-id')
+    if sort == 'trending':
+        return queryset.filter(ranking__isnull=False).annotate(score=F('ranking__trending')), ('-score', '-id')
+    if sort == 'top':
+        return queryset.filter(ranking__top_week__gt=0).annotate(score=F('ranking__top_week')), ('-score', '-id')
+    raise ValueError(f'Invalid sort: {sort} (choose from {", ".join(SORTS)})')
@@ -0,0 +1,148 @@
+"""
+"More like this": item-to-item recommendations from likes and ratings.
+
+A batch job loads every like and rating into a sparse user-by-video matrix
+whose entries say how much the user liked the video: 1 for a like, 1 for
+five stars and 0.5 for four (lower ratings are no endorsement); the larger
+applies when a user did both.  Two videos are as similar as the cosine of
+their columns, shrunk towards 0 when few users interacted with both:
+
+    score = cosine * common / (common + RECOMMENDATION_SHRINKAGE)
+
+The ``RECOMMENDATION_NEIGHBORS`` best of each video are stored in
+``VideoNeighbor``, so the detail page and the related-videos API read them
+with one indexed query.
+
+Liking, unliking and rating queue the video in ``NeighborQueue``.  The
+periodic ``refresh()`` recomputes only the queued videos' neighbors; the
+lists of other videos also shift a little when those likes change, which
+the daily ``rebuild()`` picks up.
+"""
+import logging
+from itertools import chain
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from scipy import sparse
+
+from . import response_cache
+from .models import NeighborQueue, Rating, Video, VideoNeighbor
+
+logger = logging.getLogger(__name__)
+
+# Weight of a like, and of a rating by its stars
+LIKE_WEIGHT = 1.0
+RATING_WEIGHTS = {4: 0.5, 5: 1.0}
+# Videos per sparse product; a popular video's row can span most columns
+BATCH_SIZE = 200
+
+
+def _pairs(queryset, fields):
+    """The rows of ``fields`` as an (n, len(fields)) int64 array, without building a list of tuples."""
+    rows = queryset.order_by().values_list(*fields).iterator(chunk_size=10000)
+    return np.fromiter(chain.from_iterable(rows), dtype=np.int64).reshape(-1, len(fields))
+
+
+def load_matrix():
+    """(matrix, video ids): the user-by-video CSC matrix and the id of each column."""
+    likes = _pairs(Video.likes.through.objects.all(), ('customuser_id', 'video_id'))
+    ratings = _pairs(Rating.objects.filter(rating__in=list(RATING_WEIGHTS)), ('user_id', 'video_id', 'rating'))
+    user_ids, user_index = np.unique(np.concatenate([likes[:, 0], ratings[:, 0]]), return_inverse=True)
+    video_ids, video_index = np.unique(np.concatenate([likes[:, 1], ratings[:, 1]]), return_inverse=True)
+    shape = (len(user_ids), len(video_ids))
+
+    n = len(likes)
+    like_matrix = sparse.csc_matrix(
+        (np.full(n, LIKE_WEIGHT), (user_index[:n], video_index[:n])), shape=shape,
+    )
+    stars = np.zeros(6)
+    for rating, weight in RATING_WEIGHTS.items():
+        stars[rating] = weight
+    rating_matrix = sparse.csc_matrix(
+        (stars[ratings[:, 2]], (user_index[n:], video_index[n:])), shape=shape,
+    )
+    return like_matrix.maximum(rating_matrix).tocsc(), video_ids
+
+
+def neighbors(matrix, video_ids, columns, k=None, shrinkage=None):
+    """{video id: [(neighbor id, score), ...] best first} for the given column indexes."""
+    k = k or settings.RECOMMENDATION_NEIGHBORS
+    shrinkage = settings.RECOMMENDATION_SHRINKAGE if shrinkage is None else shrinkage
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+    normalized = matrix @ sparse.diags(1 / np.where(norms > 0, norms, 1))
+    binary = matrix.copy()
+    binary.eliminate_zeros()
+    binary.data[:] = 1
+
+    result = {}
+    for start in range(0, len(columns), BATCH_SIZE):
+        batch = columns[start:start + BATCH_SIZE]
+        similarity = (normalized[:, batch].T @ normalized).tocsr()
+        common = (binary[:, batch].T @ binary).tocsr()
+        common.data = common.data / (common.data + shrinkage)
+        scores = similarity.multiply(common).tocsr()
+        for row, column in enumerate(batch):
+            begin, end = scores.indptr[row], scores.indptr[row + 1]
+            candidates, values = scores.indices[begin:end], scores.data[begin:end]
+            keep = (candidates != column) & (values > 0)
+            candidates, values = candidates[keep], values[keep]
+            if len(values) > k:
+                top = np.argpartition(-values, k)[:k]
+                candidates, values = candidates[top], values[top]
+            order = np.argsort(-values, kind='stable')
+            result[int(video_ids[column])] = [
+                (int(video_ids[candidates[i]]), float(values[i])) for i in order
+            ]
+    return result
+
+
+def _store(video_ids, found):
+    """Replace the neighbors of ``video_ids``; those missing from ``found`` get none."""
+    for start in range(0, len(video_ids), BATCH_SIZE):
+        batch = video_ids[start:start + BATCH_SIZE]
+        rows = [
+            VideoNeighbor(video_id=video_id, neighbor_id=neighbor_id, score=score)
+            for video_id in batch
+            for neighbor_id, score in found.get(video_id, ())
+        ]
+        with transaction.atomic():
+            VideoNeighbor.objects.filter(video_id__in=batch).delete()
+            VideoNeighbor.objects.bulk_create(rows, batch_size=1000)
+            # The detail API caches per video
+            transaction.on_commit(lambda batch=batch: [response_cache.bump_video_version(pk) for pk in batch])
+
+
+def refresh(limit=5000):
+    """Recompute the neighbors of up to ``limit`` queued videos. Returns how many were refreshed."""
+    started = timezone.now()
+    queued = NeighborQueue.objects.order_by('marked_at').values_list('video_id', flat=True)
+    video_ids = list(queued[:limit])
+    if not video_ids:
+        return 0
+    matrix, column_ids = load_matrix()
+    columns = np.flatnonzero(np.isin(column_ids, video_ids))
+    _store(video_ids, neighbors(matrix, column_ids, columns))
+    # Videos queued again while this ran keep their place
+    NeighborQueue.objects.filter(video_id__in=video_ids, marked_at__lte=started).delete()
+    logger.info('Refreshed the neighbors of %d videos', len(video_ids))
+    return len(video_ids)
+
+
+def rebuild():
+    """Recompute the neighbors of every video. Returns how many have any."""
+    started = timezone.now()
+    matrix, column_ids = load_matrix()
+    found = neighbors(matrix, column_ids, np.arange(len(column_ids)))
+    # Videos nobody likes any more lose their neighbors too
+    stale = set(VideoNeighbor.objects.values_list('video_id', flat=True).distinct()) - set(found)
+    _store(sorted(found) + sorted(stale), found)
+    NeighborQueue.objects.filter(marked_at__lte=started).delete()
+    logger.info('Rebuilt the neighbors of %d videos', len(found))
+    return sum(1 for items in found.values() if items)
+
+
+def related(queryset, video_id):
+    """The videos of ``queryset`` recommended for ``video_id``, best first."""
+    return queryset.filter(neighbor_of__video_id=video_id).order_by('-neighbor_of__score', 'pk')
@@ -0,0 +1,225 @@
+"""
+Versioned response cache for the public pages and JSON API.
+
+Cached responses are keyed on version counters instead of relying on short
+TTLs: one global version for anything that shows the latest-videos list and
+one version per video.  Signal handlers (see ``videos.signals``) bump the
+relevant versions when a video, its comments, ratings or likes change, so
+stale entries simply stop being looked up and age out of the cache.
+
+The same versions validate conditional requests: every cacheable response
+carries an ETag derived from its cache key and a Last-Modified time of the
+latest version bump, so an ``If-None-Match`` or ``If-Modified-Since``
+request that is still current gets a 304 from one cache lookup, before the
+view runs or the cached body is even fetched.
+
+Bumps must reach every process, the job worker's included, so the cache is
+off (views run uncached, without validators) unless ``RESPONSE_CACHE_ALIAS``
+is a shared backend such as Redis or a file-based cache.  A version that is
+evicted starts again from a value it never had, so neither cached bodies nor
+ETags from before the eviction match again.
+
+A replica may not have a write yet for up to ``DB_REPLICA_MAX_LAG_SECS``
+after the version bump that followed it, so a response read from one that
+soon is neither stored nor given validators: the next miss builds it again.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from snapshare import db_router
+
+KEY_PREFIX = 'rc'
+# Private to one process: bumps made by any other would never reach them
+LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+LIST_VERSION_KEY = f'{KEY_PREFIX}:v:list'
+HITS_KEY = f'{KEY_PREFIX}:stats:hits'
+MISSES_KEY = f'{KEY_PREFIX}:stats:misses'
+
+
+def _cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def enabled():
+    """Whether responses are cached, i.e. ``RESPONSE_CACHE_ALIAS`` is shared by every process."""
+    return settings.CACHES[settings.RESPONSE_CACHE_ALIAS]['BACKEND'] not in LOCAL_BACKENDS
+
+
+def _video_version_key(video_id):
+    return f'{KEY_PREFIX}:v:video:{video_id}'
+
+
+def _incr(cache, key, initial=0):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, initial, timeout=None)
+        return cache.incr(key)
+
+
+def _new_version():
+    # Seeds a version that is missing (new, or evicted). Never a value the
+    # key had before, or entries stored under that version would be valid again
+    return time.time_ns()
+
+
+def _bumped_at_key(version_key):
+    return f'{version_key}:at'
+
+
+def _bump(key):
+    cache = _cache()
+    _incr(cache, key, initial=_new_version())
+    cache.set(_bumped_at_key(key), int(time.time()), timeout=None)
+
+
+def bump_list_version():
+    _bump(LIST_VERSION_KEY)
+
+
+def bump_video_version(video_id):
+    _bump(_video_version_key(video_id))
+
+
+def _versions(keys):
+    """(versions, time of the latest bump) of the version ``keys``."""
+    cache = _cache()
+    now = int(time.time())
+    found = cache.get_many(keys + [_bumped_at_key(key) for key in keys])
+    # A version or bump time that is not there (new, or evicted) starts now;
+    # add() so that concurrent requests agree on it
+    missing = {key: _new_version() for key in keys if key not in found}
+    missing.update({_bumped_at_key(key): now for key in keys if _bumped_at_key(key) not in found})
+    if missing:
+        for key, value in missing.items():
+            cache.add(key, value, timeout=None)
+        found.update(cache.get_many(list(missing)))
+    versions = [found.get(key, missing.get(key)) for key in keys]
+    return versions, max(found.get(_bumped_at_key(key), now) for key in keys)
+
+
+def stats():
+    cache = _cache()
+    counts = cache.get_many([HITS_KEY, MISSES_KEY])
+    hits, misses = counts.get(HITS_KEY, 0), counts.get(MISSES_KEY, 0)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / (hits + misses) if hits + misses else None,
+    }
+
+
+def _cacheable(request, anonymous_only):
+    if request.method not in ('GET', 'HEAD') or not enabled():
+        return False
+    if anonymous_only and request.user.is_authenticated:
+        return False
+    # Never cache a page that carries someone's flash messages
+    return not len(get_messages(request))
+
+
+def _set_validators(response, validators):
+    etag, last_modified = validators
+    response.headers.setdefault('ETag', etag)
+    response.headers.setdefault('Last-Modified', http_date(last_modified))
+    # Clients may keep the body but must revalidate it before each use
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def _lookup(request, scope, per_video, kwargs):
+    """
+    (key, validators, response or None) for a cacheable request; the
+    response is a 304 if the client's copy is current, else a cache hit.
+    """
+    if per_video:
+        version_keys = [_video_version_key(kwargs['video_id'])]
+    else:
+        version_keys = [LIST_VERSION_KEY]
+    versions, last_modified = _versions(version_keys)
+    versions = ':'.join(str(version) for version in versions)
+    path_hash = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    key = f'{KEY_PREFIX}:{scope}:{versions}:{path_hash}'
+
+    validators = (f'"{hashlib.md5(key.encode()).hexdigest()}"', last_modified)
+    not_modified = get_conditional_response(request, etag=validators[0], last_modified=last_modified)
+    if not_modified is not None:
+        request.response_cache = 'not_modified'
+        return key, validators, _set_validators(not_modified, validators)
+
+    cache = _cache()
+    cached = cache.get(key)
+    if cached is not None:
+        _incr(cache, HITS_KEY)
+        request.response_cache = 'hit'
+        content, content_type = cached
+        return key, validators, _set_validators(HttpResponse(content, content_type=content_type), validators)
+
+    _incr(cache, MISSES_KEY)
+    request.response_cache = 'miss'
+    return key, validators, None
+
+
+def _replica_may_lag(bumped_at):
+    """Whether the request read from a replica that may not have the last bumped write yet."""
+    return db_router.reading_from_replica() and time.time() - bumped_at < settings.DB_REPLICA_MAX_LAG_SECS
+
+
+def _store(key, validators, response):
+    if hasattr(response, 'render') and callable(response.render):
+        response = response.render()
+    if response.status_code == 200 and not response.cookies and not _replica_may_lag(validators[1]):
+        if not response.streaming:
+            _cache().set(
+                key,
+                (response.content, response['Content-Type']),
+                timeout=settings.RESPONSE_CACHE_TIMEOUT,
+            )
+        _set_validators(response, validators)
+    return response
+
+
+def cache_response(scope, per_video=False, anonymous_only=False):
+    """
+    Cache a view's response under ``scope``.
+
+    The key includes the full request path and the current list version,
+    or with ``per_video`` the version of the ``video_id`` view argument
+    instead.  Only 200 responses are stored.  Cacheable requests whose
+    validators match get a 304 instead.  Works on sync and async views.
+    """
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def async_wrapper(request, *args, **kwargs):
+                if not await sync_to_async(_cacheable)(request, anonymous_only):
+                    return await view_func(request, *args, **kwargs)
+                key, validators, cached = await sync_to_async(_lookup)(request, scope, per_video, kwargs)
+                if cached is not None:
+                    return cached
+                response = await view_func(request, *args, **kwargs)
+                return await sync_to_async(_store)(key, validators, response)
+            return async_wrapper
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if not _cacheable(request, anonymous_only):
+                return view_func(request, *args, **kwargs)
+            key, validators, cached = _lookup(request, scope, per_video, kwargs)
+            if cached is not None:
+                return cached
+            return _store(key, validators, view_func(request, *args, **kwargs))
+        return wrapper
+    return decorator
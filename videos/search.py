@@ -0,0 +1,83 @@
+"""
+Full-text search over videos.
+
+On PostgreSQL every video carries a weighted ``tsvector`` (title A,
+description B, creator username C, publisher and producer D) in
+``Video.search_vector``, backed by a GIN index.  It is refreshed by a
+signal whenever a video or its creator's username is saved, and can be
+rebuilt with ``manage.py update_search_vectors``.  Other databases fall
+back to ``icontains`` matching so search still works in tests.
+"""
+import re
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connections
+from django.db.models import F, OuterRef, Q, Subquery
+
+from snapshare.postgres import is_postgres
+
+TEXT_FIELDS = ('title', 'description', 'publisher', 'producer', 'creator__username')
+
+_TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def supported(queryset):
+    return is_postgres(connections[queryset.db])
+
+
+def search_vector():
+    """Expression computing a video's search vector, usable in an UPDATE."""
+    config = settings.SEARCH_CONFIG
+    username = Subquery(get_user_model().objects.filter(pk=OuterRef('creator_id')).order_by().values('username')[:1])
+    return (
+        SearchVector('title', weight='A', config=config)
+        + SearchVector('description', weight='B', config=config)
+        + SearchVector(username, weight='C', config=config)
+        + SearchVector('publisher', 'producer', weight='D', config=config)
+    )
+
+
+def update_search_vectors(queryset, batch_size=1000):
+    """Recompute the vectors of ``queryset`` in primary key batches. Returns the number updated."""
+    if not supported(queryset):
+        return 0
+    ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+    updated = 0
+    for start in range(0, len(ids), batch_size):
+        updated += queryset.model._base_manager.filter(pk__in=ids[start:start + batch_size]).update(
+            search_vector=search_vector()
+        )
+    return updated
+
+
+def terms(text):
+    return _TERM_RE.findall(text or '')[:10]
+
+
+def search(queryset, text):
+    """
+    Videos matching every word of ``text``, the last one as a prefix so
+    results show up while the user is still typing. On PostgreSQL they are
+    annotated with ``rank`` and ordered by it.
+    """
+    words = terms(text)
+    if not words:
+        return queryset.none()
+
+    if not supported(queryset):
+        condition = Q()
+        for word in words:
+            condition &= Q(*[Q(**{f'{field}__icontains': word}) for field in TEXT_FIELDS], _connector=Q.OR)
+        return queryset.filter(condition).order_by('-upload_date', '-id')
+
+    # Words are \w+ only, so they are safe to splice into a raw tsquery
+    raw = ' & '.join(f"'{word}'" for word in words[:-1])
+    raw = f"{raw} & '{words[-1]}':*" if raw else f"'{words[-1]}':*"
+    query = SearchQuery(raw, search_type='raw', config=settings.SEARCH_CONFIG)
+    return (
+        queryset.filter(search_vector=query)
+        .annotate(rank=SearchRank(F('search_vector'), query))
+        .order_by('-rank', '-upload_date', '-id')
+    )
@@ -0,0 +1,76 @@
+from snapshare.cloud_storage import get_azure_media_url, resolve_media_urls
+from snapshare.serialization import Field, MediaURLField, Serializer
+
+from . import media_info, thumbnails
+
+
+class ThumbnailVariantsField(Field):
+    """{width: {"width", "height", "webp", "jpeg"}} with resolved URLs."""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('only', ('thumbnail', 'thumbnail_variants'))
+        super().__init__(**kwargs)
+
+    def value(self, video):
+        return {
+            str(width): {
+                'width': width,
+                'height': height,
+                **{key: get_azure_media_url(file) for key, file in files.items()},
+            }
+            for width, height, files in thumbnails.variants(video)
+        }
+
+    def prefetch(self, videos):
+        resolve_media_urls([file for video in videos for file in thumbnails.variant_files(video)])
+
+
+class VideoListSerializer(Serializer):
+    id = Field()
+    title = Field()
+    description = Field()
+    thumbnail_url = MediaURLField('thumbnail')
+    thumbnails = ThumbnailVariantsField()
+    creator = Field(source='creator.username', select_related=('creator',))
+    views = Field()
+    likes = Field(source='like_count')
+    upload_date = Field()
+
+
+class VideoSearchSerializer(VideoListSerializer):
+    rank = Field(only=(), getter=lambda video: getattr(video, 'rank', None))
+
+
+class VideoDetailSerializer(Serializer):
+    id = Field()
+    title = Field()
+    description = Field()
+    video_url = MediaURLField('video_file')
+    thumbnail_url = MediaURLField('thumbnail')
+    thumbnails = ThumbnailVariantsField()
+    creator = Field(
+        only=('creator__id', 'creator__username'),
+        select_related=('creator',),
+        getter=lambda video: {
+            'id': video.creator.id,
+            'username': video.creator.username,
+        },
+    )
+    publisher = Field()
+    producer = Field()
+    genre = Field(getter=lambda video: video.get_genre_display())
+    age_rating = Field(getter=lambda video: video.get_age_rating_display())
+    views = Field()
+    likes = Field(source='like_count')
+    upload_date = Field()
+    media = Field(
+        only=media_info.FIELDS,
+        getter=lambda video: {field: getattr(video, field) for field in media_info.FIELDS},
+    )
+
+
+class CommentSerializer(Serializer):
+    id = Field()
+    user = Field(source='user.username', select_related=('user',))
+    text = Field()
+    created_at = Field()
@@ -0,0 +1,115 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F, QuerySet
+from django.db.models.functions import Greatest
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import media_info, response_cache, search, thumbnails
+from .models import Comment, NeighborQueue, Rating, Video
+
+SEARCHABLE_FIELDS = {'title', 'description', 'publisher', 'producer', 'creator'}
+
+
+def _invalidate(video_id, include_list=False):
+    # Bump after commit so a concurrent request cannot re-cache the old rows
+    def bump():
+        response_cache.bump_video_version(video_id)
+        if include_list:
+            response_cache.bump_list_version()
+    transaction.on_commit(bump)
+
+
+@receiver([post_save, post_delete], sender=Video)
+def video_changed(sender, instance, **kwargs):
+    _invalidate(instance.pk, include_list=True)
+
+
+@receiver(post_save, sender=Video)
+def thumbnail_saved(sender, instance, raw=False, **kwargs):
+    if raw or not instance.thumbnail or thumbnails.is_current(instance):
+        return
+    video_id = instance.pk
+    transaction.on_commit(lambda: thumbnails.schedule(video_id))
+
+
+@receiver(post_save, sender=Video)
+def video_file_saved(sender, instance, raw=False, **kwargs):
+    if raw or not instance.video_file or media_info.is_current(instance):
+        return
+    video_id = instance.pk
+    transaction.on_commit(lambda: media_info.schedule(video_id))
+
+
+@receiver(post_save, sender=Video)
+def video_text_saved(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and not SEARCHABLE_FIELDS & set(update_fields)):
+        return
+    search.update_search_vectors(Video.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=get_user_model())
+def creator_renamed(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Logins save last_login only; anything else may have changed the username
+    if raw or (update_fields is not None and 'username' not in update_fields):
+        return
+    search.update_search_vectors(Video.objects.filter(creator=instance))
+
+
+@receiver([post_save, post_delete], sender=Comment)
+@receiver([post_save, post_delete], sender=Rating)
+def video_activity_changed(sender, instance, **kwargs):
+    _invalidate(instance.video_id)
+
+
+def _deleted_with_video(origin):
+    # The video's own deletion takes its comments and ratings along: no
+    # counters left to adjust. (The hourly activity is left as it was: the
+    # video may go in the same cascade, e.g. when its creator is deleted.)
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return issubclass(model, Video)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, origin=None, **kwargs):
+    if _deleted_with_video(origin):
+        return
+    Video.objects.filter(pk=instance.video_id).update(comment_count=Greatest(F('comment_count') - 1, 0))
+
+
+@receiver(post_save, sender=Rating)
+def rating_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        NeighborQueue.objects.add([instance.video_id])
+
+
+@receiver(post_delete, sender=Rating)
+def rating_deleted(sender, instance, origin=None, **kwargs):
+    if _deleted_with_video(origin):
+        return
+    video_id = instance.video_id
+    Video.objects.filter(pk=video_id).update(
+        rating_sum=Greatest(F('rating_sum') - instance.rating, 0),
+        rating_count=Greatest(F('rating_count') - 1, 0),
+    )
+    # Deleting the user may take their own videos along: queue after commit,
+    # and only a video that is still there
+    transaction.on_commit(
+        lambda: NeighborQueue.objects.add(Video.objects.filter(pk=video_id).values_list('pk', flat=True))
+    )
+
+
+@receiver(m2m_changed, sender=Video.likes.through)
+def video_likes_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        video_ids = [instance.pk]
+    else:
+        # user.liked_videos.add(...): instance is the user, pk_set the videos
+        video_ids = list(pk_set or ())
+    for video_id in video_ids:
+        _invalidate(video_id, include_list=True)
+    # Their recommendations are recomputed by the next refresh
+    if video_ids:
+        NeighborQueue.objects.add(video_ids)
@@ -0,0 +1,59 @@
+from django.conf import settings
+
+from jobs.queue import task
+
+from . import chunked_upload, media_info, ranking, recommendations, thumbnails, upload_tokens, viewcounts
+from .models import Video
+
+
+@task(queue='media', max_attempts=3)
+def generate_thumbnails(video_id, force=False):
+    try:
+        return thumbnails.generate_variants(video_id, force=force)
+    except Video.DoesNotExist:
+        # Deleted before the job ran; nothing to retry
+        return False
+
+
+@task(queue='media', max_attempts=3)
+def probe_video(video_id, force=False):
+    try:
+        return media_info.probe_video(video_id, force=force)
+    except Video.DoesNotExist:
+        return False
+
+
+@task(queue='maintenance', every=3600)
+def reconcile_counters():
+    return Video.objects.reconcile_drifted()
+
+
+@task(queue='maintenance', every=settings.VIEW_COUNT_FLUSH_INTERVAL)
+def flush_views():
+    # Also queued by record_view() once VIEW_COUNT_MAX_PENDING views are buffered
+    return viewcounts.flush()
+
+
+@task(queue='maintenance', every=settings.RANKING_UPDATE_INTERVAL)
+def update_rankings():
+    return ranking.update_rankings()
+
+
+@task(queue='maintenance', every=settings.RECOMMENDATION_REFRESH_INTERVAL)
+def refresh_recommendations():
+    return recommendations.refresh()
+
+
+@task(queue='maintenance', every=86400)
+def rebuild_recommendations():
+    return recommendations.rebuild()
+
+
+@task(queue='maintenance', every=3600)
+def expire_upload_sessions():
+    return chunked_upload.expire_sessions()
+
+
+@task(queue='maintenance', every=3600)
+def expire_upload_claims():
+    return upload_tokens.expire_claims()
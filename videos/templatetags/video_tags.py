@@ -0,0 +1,51 @@
+from django import template
+
+from snapshare.cloud_storage import get_azure_media_url
+from videos import thumbnails
+
+register = template.Library()
+
+
+@register.filter
+def media_url(file_field):
+    """Cached (and, for signed storage, stable) URL of a file field."""
+    return get_azure_media_url(file_field) or ''
+
+
+@register.filter
+def duration(seconds):
+    """Seconds as M:SS, or H:MM:SS for an hour or more."""
+    if seconds is None:
+        return ''
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f'{hours}:{minutes:02d}:{seconds:02d}'
+    return f'{minutes}:{seconds:02d}'
+
+
+@register.filter
+def has_thumbnail_variants(video):
+    """Whether the resized variants of the video's current thumbnail exist."""
+    return thumbnails.is_current(video)
+
+
+@register.simple_tag
+def thumbnail_srcset(video, image_format='webp'):
+    """``srcset`` value listing every stored width of the thumbnail."""
+    return ', '.join(
+        f'{get_azure_media_url(files[image_format])} {width}w'
+        for width, _, files in thumbnails.variants(video)
+    )
+
+
+@register.simple_tag
+def thumbnail_url(video, width, image_format='jpeg'):
+    """URL of the smallest stored variant at least ``width`` wide, else the original."""
+    variants = thumbnails.variants(video)
+    for variant_width, _, files in variants:
+        if variant_width >= int(width):
+            return get_azure_media_url(files[image_format])
+    if variants:
+        return get_azure_media_url(variants[-1][2][image_format])
+    return get_azure_media_url(video.thumbnail) or ''
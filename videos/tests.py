@@ -0,0 +1,1425 @@
+import csv
+import hashlib
+import json
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import math
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache, caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from jobs.models import Job
+from snapshare import db_router
+from snapshare.cloud_storage import RangeReader
+from snapshare.serialization import InvalidFields
+from snapshare.testing import TEST_SETTINGS, Budget, QueryBudgetMixin
+from videos import (
+    chunked_upload, media_info, mp4, ranking, response_cache, search, tasks, thumbnails, upload_tokens, user_state,
+    viewcounts,
+)
+from videos.pagination import CursorPaginator, InvalidCursor
+from videos.serializers import VideoDetailSerializer, VideoListSerializer
+from videos.management.commands import import_videos
+from videos.models import (
+    NeighborQueue, RankingUpdate, Rating, UploadClaim, UploadSession, Video, VideoActivity, VideoRanking,
+    current_hour,
+)
+
+
+def video_id(case):
+    return [case.video.pk]
+
+
+def upload_session_id(case):
+    return [case.upload_session.pk]
+
+
+def make_video(creator, **fields):
+    fields = {
+        'title': 'Test video', 'description': 'Testing', 'video_file': 'videos/test.mp4',
+        'thumbnail': 'thumbnails/test.jpg', 'publisher': 'p', 'producer': 'p', 'genre': 'drama',
+        'age_rating': 'G', **fields,
+    }
+    return Video.objects.create(creator=creator, **fields)
+
+
+class VideoQueryBudgetTests(QueryBudgetMixin, TestCase):
+    urlconf = 'videos.urls'
+    # Budget(url name, anonymous, signed in): signing in costs the session
+    # and user lookups
+    budgets = [
+        Budget('home', 1, 4),
+        Budget('upload_video', 0, 2, user='creator'),
+        # Views are written straight away without Redis (as here): two queries
+        Budget('video_detail', 6, 10, args=video_id),
+        Budget('like_video', 0, 13, method='post', args=video_id),
+        # The count estimate falls back to COUNT(*) on an unanalyzed table
+        Budget('video_list_api', 3, 5),
+        Budget('video_search_api', 1, 3, data={'q': 'budget'}),
+        Budget('video_detail_api', 2, 4, args=video_id),
+        # Two queries however many ids are asked for
+        Budget('video_state_api', 0, 4, data={'ids': ','.join(str(pk) for pk in range(1, 101))}),
+        Budget('video_related_api', 1, 3, args=video_id),
+        Budget('video_list_api_async', 3, 3),
+        Budget('video_detail_api_async', 2, 2, args=video_id),
+        Budget('upload_tokens', 0, 2, method='post', user='creator', json_body=True,
+               data={'files': [{'kind': 'video', 'filename': 'clip.mp4'}]}),
+        Budget('upload_session_create', 0, 4, method='post', user='creator', json_body=True,
+               data={'kind': 'video', 'filename': 'clip.mp4', 'size': 1024}),
+        Budget('upload_session_status', 0, 4, args=upload_session_id, user='creator'),
+        Budget('upload_chunk', 0, 3, method='put', args=lambda case: [case.upload_session.pk, 1],
+               user='creator'),
+        Budget('upload_session_commit', 0, 8, method='post', args=upload_session_id, user='creator'),
+    ]
+
+
+@override_settings(**TEST_SETTINGS)
+class RatingDeleteTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.creator = User.objects.create_user('creator', 'creator@example.com', 'pw', role=User.CREATOR)
+        cls.consumer = User.objects.create_user('consumer', 'consumer@example.com', 'pw')
+        cls.video = make_video(cls.creator)
+
+    def test_delete_rated_video(self):
+        self.video.rate(self.consumer, 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.video.delete()
+        self.assertFalse(Video.objects.filter(pk=self.video.pk).exists())
+        self.assertFalse(NeighborQueue.objects.exists())
+
+    def test_delete_user_who_rated(self):
+        self.video.rate(self.consumer, 5)
+        NeighborQueue.objects.all().delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.consumer.delete()
+        self.assertFalse(Rating.objects.exists())
+        # The video stays, and its neighbors need recomputing
+        self.assertEqual(list(NeighborQueue.objects.values_list('video_id', flat=True)), [self.video.pk])
+
+
+class CounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.creator = User.objects.create_user('creator', 'creator@example.com', 'pw', role=User.CREATOR)
+        cls.consumer = User.objects.create_user('consumer', 'consumer@example.com', 'pw')
+        cls.video = make_video(cls.creator)
+
+    def counters(self):
+        return Video.objects.values_list('like_count', 'rating_sum', 'rating_count', 'comment_count').get(
+            pk=self.video.pk)
+
+    def test_like_rate_comment(self):
+        self.assertTrue(self.video.toggle_like(self.consumer))
+        self.assertTrue(self.video.toggle_like(self.creator))
+        self.assertFalse(self.video.toggle_like(self.consumer))
+        self.assertEqual(self.video.like_count, 1)
+        self.video.rate(self.consumer, 2)
+        self.video.rate(self.creator, 5)
+        self.video.rate(self.consumer, 4)
+        self.assertEqual((self.video.rating_sum, self.video.rating_count, self.video.average_rating), (9, 2, 4.5))
+        self.video.add_comment(self.consumer, 'First')
+        self.video.add_comment(self.consumer, 'Second')
+        self.assertEqual(self.counters(), (1, 9, 2, 2))
+        self.assertFalse(Video.objects.drifted().exists())
+
+    def test_deleting_comments_and_ratings(self):
+        comment = self.video.add_comment(self.consumer, 'First')
+        self.video.add_comment(self.creator, 'Second')
+        self.video.rate(self.consumer, 2)
+        self.video.rate(self.creator, 5)
+
+        comment.delete()
+        self.assertEqual(self.counters(), (0, 7, 2, 1))
+        Rating.objects.filter(user=self.creator).delete()
+        self.assertEqual(self.counters(), (0, 2, 1, 1))
+        # Through the user's deletion too
+        self.video.add_comment(self.consumer, 'Third')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.consumer.delete()
+        self.assertEqual(self.counters(), (0, 0, 0, 1))
+        self.assertFalse(Video.objects.drifted().exists())
+
+    def test_deleting_a_creator_with_their_own_activity(self):
+        self.video.rate(self.creator, 5)
+        self.video.add_comment(self.creator, 'Mine')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.creator.delete()
+        self.assertFalse(Video.objects.exists())
+
+    def test_never_below_zero(self):
+        comment = self.video.add_comment(self.consumer, 'First')
+        rating = self.video.rate(self.consumer, 3)
+        Video.objects.filter(pk=self.video.pk).update(rating_sum=1, rating_count=0, comment_count=0)
+        comment.delete()
+        rating.delete()
+        self.assertEqual(self.counters(), (0, 0, 0, 0))
+
+    def test_reconcile(self):
+        other = make_video(self.creator)
+        self.video.toggle_like(self.consumer)
+        self.video.rate(self.consumer, 4)
+        self.video.add_comment(self.consumer, 'First')
+        # Drift, as from writes that bypassed the model methods
+        Video.objects.filter(pk=self.video.pk).update(like_count=7, rating_sum=0, rating_count=3, comment_count=0)
+        Video.objects.filter(pk=other.pk).update(comment_count=2)
+        self.assertEqual(set(Video.objects.drifted().values_list('pk', flat=True)), {self.video.pk, other.pk})
+
+        out = StringIO()
+        call_command('reconcile_counters', '--dry-run', stdout=out)
+        self.assertIn('2 videos have drifted counters.', out.getvalue())
+        self.assertEqual(self.counters(), (7, 0, 3, 0))
+        call_command('reconcile_counters', '--batch-size', '1', stdout=out)
+        self.assertIn('Repaired counters on 2 videos.', out.getvalue())
+        self.assertEqual(self.counters(), (1, 4, 1, 1))
+        self.assertEqual(Video.objects.get(pk=other.pk).comment_count, 0)
+        self.assertEqual(tasks.reconcile_counters(), 0)
+
+
+@override_settings(**TEST_SETTINGS)
+class UserStateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.creator = User.objects.create_user('creator', 'creator@example.com', 'pw', role=User.CREATOR)
+        cls.consumer = User.objects.create_user('consumer', 'consumer@example.com', 'pw')
+        cls.liked, cls.rated, cls.both, cls.untouched = (make_video(cls.creator) for _ in range(4))
+        cls.liked.toggle_like(cls.consumer)
+        cls.rated.rate(cls.consumer, 3)
+        cls.both.toggle_like(cls.consumer)
+        cls.both.rate(cls.consumer, 5)
+        # Someone else's likes and ratings are not the consumer's
+        cls.untouched.toggle_like(cls.creator)
+        cls.untouched.rate(cls.creator, 1)
+
+    def state(self, *video_ids):
+        return self.client.get(reverse('video_state_api'), {'ids': ','.join(map(str, video_ids))}, secure=True)
+
+    def test_state(self):
+        self.client.force_login(self.consumer)
+        videos = (self.liked, self.rated, self.both, self.untouched)
+        response = self.state(*(video.pk for video in videos), self.untouched.pk, 999999)
+        self.assertEqual(response.status_code, 200)
+        expected = {
+            str(video.pk): {
+                'liked': Video.likes.through.objects.filter(video=video, customuser=self.consumer).exists(),
+                'rating': Rating.objects.filter(video=video, user=self.consumer).values_list('rating', flat=True)
+                .first(),
+            }
+            for video in videos
+        }
+        self.assertEqual(expected[str(self.untouched.pk)], {'liked': False, 'rating': None})
+        self.assertEqual(response.json(), {'videos': {**expected, '999999': {'liked': False, 'rating': None}}})
+        self.assertEqual(response.json()['videos'][str(self.both.pk)], {'liked': True, 'rating': 5})
+
+        self.client.force_login(self.creator)
+        self.assertEqual(self.state(self.untouched.pk, self.liked.pk).json()['videos'], {
+            str(self.untouched.pk): {'liked': True, 'rating': 1},
+            str(self.liked.pk): {'liked': False, 'rating': None},
+        })
+
+    def test_invalid(self):
+        with self.assertLogs('django.request', 'WARNING'):
+            self.assertEqual(self.state(self.liked.pk).status_code, 403)
+        self.client.force_login(self.consumer)
+        self.assertEqual(self.state().status_code, 400)
+        self.assertEqual(self.state('x').status_code, 400)
+        self.assertEqual(self.state(*range(1, user_state.MAX_IDS + 2)).status_code, 400)
+
+    def test_attach(self):
+        videos = list(Video.objects.filter(pk__in=[self.liked.pk, self.both.pk, self.untouched.pk]).order_by('pk'))
+        user_state.attach(videos, self.consumer)
+        self.assertEqual([(video.is_liked, video.user_rating) for video in videos],
+                         [(True, None), (True, 5), (False, None)])
+        user_state.attach(videos, AnonymousUser(), rating=False)
+        self.assertEqual([video.is_liked for video in videos], [False, False, False])
+
+
+@override_settings(**TEST_SETTINGS)
+class SparseFieldsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.creator = User.objects.create_user('creator', 'creator@example.com', 'pw', role=User.CREATOR)
+        cls.video = make_video(cls.creator, title='Sparse')
+
+    def get(self, name, fields, *args):
+        return self.client.get(reverse(name, args=args), {'fields': fields}, secure=True)
+
+    def test_only_the_requested_fields(self):
+        response = self.get('video_list_api', 'title, id,,')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['videos'], [{'id': self.video.pk, 'title': 'Sparse'}])
+        for name in ('video_detail_api', 'video_detail_api_async'):
+            response = self.get(name, 'creator,likes', self.video.pk)
+            self.assertEqual(response.status_code, 200, name)
+            self.assertEqual(response.json()['video'], {
+                'creator': {'id': self.creator.pk, 'username': 'creator'}, 'likes': 0,
+            })
+        # Without ?fields= everything is there
+        self.assertEqual(set(self.client.get(reverse('video_list_api'), secure=True).json()['videos'][0]),
+                         set(VideoListSerializer.fields))
+
+    def test_unknown_fields(self):
+        for name, args in (('video_list_api', ()), ('video_search_api', ()), ('video_detail_api', (self.video.pk,)),
+                           ('video_detail_api_async', (self.video.pk,))):
+            response = self.get(name, 'id,password,creator__email', *args)
+            self.assertEqual(response.status_code, 400, name)
+            self.assertEqual(response.json(), {'error': 'Unknown fields: password, creator__email'})
+        # A field of another serializer is unknown too
+        self.assertEqual(self.get('video_list_api', 'video_url').status_code, 400)
+
+    def test_query_is_narrowed(self):
+        serializer = VideoListSerializer(['title', 'creator'])
+        video = serializer.prepare(Video.objects.all()).get()
+        self.assertEqual(serializer.to_dict(video), {'title': 'Sparse', 'creator': 'creator'})
+        self.assertIn('description', video.get_deferred_fields())
+        self.assertNotIn('title', video.get_deferred_fields())
+        with self.assertNumQueries(0):
+            serializer.to_dict(video)
+        # Always in the serializer's order, whatever the order asked for
+        self.assertEqual(VideoDetailSerializer(['views', 'id']).selected, ['id', 'views'])
+        with self.assertRaises(InvalidFields):
+            VideoDetailSerializer(['rating'])
+
+
+class SharedCacheMixin:
+    """A file-based default cache in a temporary directory, shared with other processes."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.cache_dir = tempfile.mkdtemp()
+        cls._cache_override = override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': cls.cache_dir},
+        })
+        cls._cache_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._cache_override.disable()
+        shutil.rmtree(cls.cache_dir, ignore_errors=True)
+        super().tearDownClass()
+
+    def run_elsewhere(self, code):
+        """Run ``code`` in a separate Django process that shares the cache."""
+        env = {
+            **os.environ, 'DJANGO_SETTINGS_MODULE': 'snapshare.settings', 'CACHE_DIR': self.cache_dir,
+            'REDIS_URL': '', 'DB_ENGINE': 'sqlite',
+        }
+        subprocess.run([sys.executable, '-c', f'import django; django.setup(); {code}'], env=env,
+                       cwd=settings.BASE_DIR, check=True)
+
+
+@override_settings(**TEST_SETTINGS)
+class ResponseCacheTests(SharedCacheMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.creator = User.objects.create_user('creator', 'creator@example.com', 'pw', role=User.CREATOR)
+        cls.video = make_video(cls.creator, title='Cached title')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_hit(self):
+        url = reverse('video_list_api')
+        first = self.client.get(url, secure=True)
+        with self.assertNumQueries(0):
+            cached = self.client.get(url, secure=True)
+        self.assertEqual(cached.content, first.content)
+
+    def test_bump_from_another_process(self):
+        url = reverse('video_list_api')
+        self.assertContains(self.client.get(url, secure=True), 'Cached title')
+        # Changed without signals, as a job would after its own bump
+        Video.objects.filter(pk=self.video.pk).update(title='Renamed')
+        self.assertContains(self.client.get(url, secure=True), 'Cached title')
+        self.run_elsewhere('from videos import response_cache; response_cache.bump_list_version()')
+        self.assertContains(self.client.get(url, secure=True), 'Renamed')
+
+    def test_evicted_version_never_comes_back(self):
+        url = reverse('video_list_api')
+        self.assertContains(self.client.get(url, secure=True), 'Cached title')
+        Video.objects.filter(pk=self.video.pk).update(title='Renamed')
+        response_cache.bump_list_version()
+        response_cache.bump_list_version()
+        self.assertContains(self.client.get(url, secure=True), 'Renamed')
+        # Culled, as the file cache does once it is full: the body stored
+        # under the first version is still there but must not be served
+        cache.delete(response_cache.LIST_VERSION_KEY)
+        self.assertContains(self.client.get(url, secure=True), 'Renamed')
+        # And a bump after the eviction does not land on an old version either
+        Video.objects.filter(pk=self.video.pk).update(title='Renamed again')
+        cache.delete(response_cache.LIST_VERSION_KEY)
+        response_cache.bump_list_version()
+        self.assertContains(self.client.get(url, secure=True), 'Renamed again')
+
+    def test_off_with_local_memory_cache(self):
+        url = reverse('video_list_api')
+        with override_settings(CACHES=TEST_SETTINGS['CACHES']):
+            self.client.get(url, secure=True)
+            Video.objects.filter(pk=self.video.pk).update(title='Renamed')
+            response = self.client.get(url, secure=True)
+        self.assertContains(response, 'Renamed')
+        self.assertNotIn('ETag', response)
+
+    def test_replica_reads_right_after_a_bump_are_not_stored(self):
+        url = reverse('video_list_api')
+        response_cache.bump_list_version()
+        with mock.patch.object(db_router, 'reading_from_replica', return_value=True):
+            response = self.client.get(url, secure=True)
+            self.assertEqual(response.status_code, 200)
+            # Possibly older than the bumped write: no validators, built again next time
+            self.assertNotIn('ETag', response)
+            self.assertEqual(response_cache.stats()['misses'], 1)
+            self.client.get(url, secure=True)
+            self.assertEqual(response_cache.stats()['misses'], 2)
+
+            # Once every healthy replica has caught up, it is stored
+            bumped_at = response_cache._bumped_at_key(response_cache.LIST_VERSION_KEY)
+            cache.set(bumped_at, int(time.time()) - settings.DB_REPLICA_MAX_LAG_SECS - 1, timeout=None)
+            self.assertIn('ETag', self.client.get(url, secure=True))
+            with self.assertNumQueries(0):
+                self.client.get(url, secure=True)
+
+    def test_primary_reads_are_stored_right_after_a_bump(self):
+        url = reverse('video_list_api')
+        response_cache.bump_list_version()
+        self.assertIn('ETag', self.client.get(url, secure=True))
+        with self.assertNumQueries(0):
+            self.client.get(url, secure=True)
+
+    def test_not_modified(self):
+        for url in (reverse('video_list_api'), reverse('video_detail_api', args=[self.video.pk]),
+                    reverse('video_list_api_async'), reverse('home')):
+            response = self.client.get(url, secure=True)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertIn('no-cache', response['Cache-Control'])
+            etag, last_modified = response['ETag'], response['Last-Modified']
+            with self.assertNumQueries(0):
+                response = self.client.get(url, secure=True, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304, url)
+            self.assertEqual(response['ETag'], etag)
+            response = self.client.get(url, secure=True, headers={'If-Modified-Since': last_modified})
+            self.assertEqual(response.status_code, 304, url)
+            response = self.client.get(url, secure=True, headers={'If-None-Match': '"other"'})
+            self.assertEqual(response.status_code, 200, url)
+        self.assertEqual(response_cache.stats()['misses'], 4)
+
+    def test_modified_after_a_bump(self):
+        list_url = reverse('video_list_api')
+        detail_url = reverse('video_detail_api', args=[self.video.pk])
+        list_etag = self.client.get(list_url, secure=True)['ETag']
+        detail_etag = self.client.get(detail_url, secure=True)['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other = make_video(self.creator, title='Newer')
+        response = self.client.get(list_url, secure=True, headers={'If-None-Match': list_etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], list_etag)
+        self.assertContains(response, 'Newer')
+        # Another video's change leaves this one's validators alone
+        response_cache.bump_video_version(other.pk)
+        response = self.client.get(detail_url, secure=True, headers={'If-None-Match': detail_etag})
+        self.assertEqual(response.status_code, 304)
+
+        Video.objects.filter(pk=self.video.pk).update(title='Renamed')
+        response_cache.bump_video_version(self.video.pk)
+        response = self.client.get(detail_url, secure=True, headers={'If-None-Match': detail_etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Renamed')
+
+    def test_validators_from_before_an_eviction_do_not_match(self):
+        url = reverse('video_list_api')
+        response = self.client.get(url, secure=True)
+        etag = response['ETag']
+        response_cache.bump_list_version()
+        cache.delete(response_cache.LIST_VERSION_KEY)
+        cache.delete(response_cache._bumped_at_key(response_cache.LIST_VERSION_KEY))
+        response = self.client.get(url, secure=True, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_streamed_detail_matches_the_buffered_one(self):
+        consumer = get_user_model().objects.create_user('consumer', 'consumer@example.com', 'pw')
+        for text in ('First', 'Second', 'Third'):
+            self.video.add_comment(consumer, text)
+        self.video.rate(consumer, 4)
+        url = reverse('video_detail_api', args=[self.video.pk])
+        with override_settings(API_STREAM_COMMENTS_OVER=2):
+            streamed = self.client.get(url, secure=True)
+            empty = make_video(self.creator)
+            Video.objects.filter(pk=empty.pk).update(comment_count=3)
+            streamed_empty = self.client.get(reverse('video_detail_api', args=[empty.pk]), secure=True)
+        buffered = self.client.get(url, secure=True)
+        self.assertFalse(buffered.streaming)
+        self.assertTrue(streamed.streaming)
+        self.assertEqual(json.loads(b''.join(streamed.streaming_content)), buffered.json())
+        self.assertEqual(json.loads(b''.join(streamed_empty.streaming_content))['comments'], [])
+
+    def test_signed_in_home_is_not_validated(self):
+        url = reverse('home')
+        etag = self.client.get(url, secure=True)['ETag']
+        self.client.force_login(self.creator)
+        response = self.client.get(url, secure=True, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
+
+
+@override_settings(**TEST_SETTINGS)
+class UploadClaimTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.creator = User.objects.create_user('creator', 'creator@example.com', 'pw', role=User.CREATOR)
+        cls.other = User.objects.create_user('other', 'other@example.com', 'pw', role=User.CREATOR)
+
+    def test_claims(self):
+        blob_name = upload_tokens.new_blob_name(self.creator, 'video', 'clip.mp4')
+        upload_tokens.add_claim(self.creator, 'video', blob_name)
+        # Per-process caches play no part
+        cache.clear()
+        self.assertTrue(upload_tokens.is_claimed(self.creator, 'video', blob_name))
+        self.assertFalse(upload_tokens.is_claimed(self.creator, 'thumbnail', blob_name))
+        self.assertFalse(upload_tokens.is_claimed(self.other, 'video', blob_name))
+        self.assertFalse(upload_tokens.is_claimed(self.creator, 'video', ''))
+        upload_tokens.release_claim(self.creator, blob_name)
+        self.assertFalse(upload_tokens.is_claimed(self.creator, 'video', blob_name))
+
+    def test_expiry(self):
+        upload_tokens.add_claim(self.creator, 'video', 'videos/old.mp4')
+        upload_tokens.add_claim(self.creator, 'video', 'videos/new.mp4')
+        UploadClaim.objects.filter(pk='videos/old.mp4').update(
+            claimed_at=timezone.now() - timedelta(seconds=settings.UPLOAD_CLAIM_TIMEOUT + 1),
+        )
+        self.assertFalse(upload_tokens.is_claimed(self.creator, 'video', 'videos/old.mp4'))
+        self.assertEqual(upload_tokens.expire_claims(), 1)
+        self.assertEqual(list(UploadClaim.objects.values_list('pk', flat=True)), ['videos/new.mp4'])
+
+    def test_upload_form_accepts_claimed_blobs(self):
+        blobs = {
+            kind: upload_tokens.new_blob_name(self.creator, kind, filename)
+            for kind, filename in (('video', 'clip.mp4'), ('thumbnail', 'still.jpg'))
+        }
+        for kind, blob_name in blobs.items():
+            upload_tokens.add_claim(self.creator, kind, blob_name)
+        cache.clear()  # as if the form reached another worker
+        self.client.force_login(self.creator)
+        response = self.client.post(reverse('upload_video'), {
+            'title': 'Direct', 'description': 'Uploaded to storage directly', 'publisher': 'p', 'producer': 'p',
+            'genre': 'drama', 'age_rating': 'G', 'video_blob': blobs['video'], 'thumbnail_blob': blobs['thumbnail'],
+        }, secure=True)
+        video = Video.objects.get(title='Direct')
+        self.assertRedirects(response, reverse('video_detail', args=[video.pk]), fetch_redirect_response=False)
+        self.assertEqual((video.video_file.name, video.thumbnail.name), (blobs['video'], blobs['thumbnail']))
+        self.assertFalse(UploadClaim.objects.exists())
+
+        # Someone else's paths are not accepted
+        upload_tokens.add_claim(self.other, 'video', 'videos/theirs.mp4')
+        response = self.client.post(reverse('upload_video'), {
+            'title': 'Stolen', 'description': 'd', 'publisher': 'p', 'producer': 'p', 'genre': 'drama',
+            'age_rating': 'G', 'video_blob': 'videos/theirs.mp4', 'thumbnail_blob': blobs['thumbnail'],
+        }, secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Video.objects.filter(title='Stolen').exists())
+
+
+@override_settings(**TEST_SETTINGS)
+class ImportVideosTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.creator = User.objects.create_user('importer', 'importer@example.com', 'pw', role=User.CREATOR)
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, ignore_errors=True)
+        media_root = os.path.join(self.dir, 'media')
+        settings_override = self.settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        Image.new('RGB', (8, 8)).save(os.path.join(self.dir, 'still.png'))
+        with open(os.path.join(self.dir, 'clip.mp4'), 'wb') as f:
+            f.write(b'\0' * 1000)
+
+    def row(self, number, **fields):
+        return {
+            'title': f'Imported {number}', 'description': 'From a manifest', 'video': 'clip.mp4',
+            'thumbnail': 'still.png', 'publisher': 'p', 'producer': 'p', 'genre': 'drama', 'age_rating': 'G',
+            **fields,
+        }
+
+    def manifest(self, rows, name='manifest.jsonl'):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            for row in rows:
+                f.write((row if isinstance(row, str) else json.dumps(row)) + '\n')
+        return path
+
+    def run_import(self, path, **options):
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_videos', path, creator='importer', stdout=stdout, stderr=stderr, **options)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def checkpoint(self, path):
+        with open(f'{path}.checkpoint') as f:
+            return json.load(f)['done_through']
+
+    def test_validation(self):
+        with open(os.path.join(self.dir, 'fake.png'), 'w') as f:
+            f.write('not an image')
+        path = self.manifest([
+            self.row(1),
+            self.row(2, genre='bogus'),
+            self.row(3, title=123),
+            self.row(4, video=['clip.mp4']),
+            self.row(5, video='missing.mp4'),
+            self.row(6, thumbnail='fake.png'),
+            self.row(7, creator='nobody'),
+            self.row(8, description=''),
+            'not json',
+            '[1, 2]',
+        ])
+        stdout, stderr = self.run_import(path, dry_run=True)
+        self.assertIn('1 valid rows, 9 invalid.', stdout)
+        for number in range(2, 11):
+            self.assertIn(f'Row {number}: ', stderr)
+        self.assertIn("title: not a string (123)", stderr)
+        self.assertFalse(Video.objects.exists())
+
+        stdout, _ = self.run_import(path)
+        self.assertIn('Imported 1 videos (0 already imported, 9 invalid, 0 failed to upload)', stdout)
+        video = Video.objects.get()
+        self.assertEqual((video.title, video.creator, video.genre), ('Imported 1', self.creator, 'drama'))
+        self.assertTrue(video.video_file.storage.exists(video.video_file.name))
+        self.assertEqual(video.thumbnail.size, os.path.getsize(os.path.join(self.dir, 'still.png')))
+        self.assertEqual(self.checkpoint(path), 10)
+
+    def test_csv(self):
+        path = os.path.join(self.dir, 'manifest.csv')
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(self.row(1)))
+            writer.writeheader()
+            writer.writerows([self.row(1), self.row(2, age_rating='X')])
+        stdout, stderr = self.run_import(path)
+        self.assertIn('Imported 1 videos', stdout)
+        self.assertIn('Row 2: age_rating', stderr)
+
+    def test_resume_after_failed_upload(self):
+        path = self.manifest([self.row(number) for number in range(1, 7)])
+        upload = import_videos._upload
+
+        def failing(storage, local, name):
+            if '/3-' in name:
+                raise OSError('storage unavailable')
+            return upload(storage, local, name)
+
+        with mock.patch.object(import_videos, '_upload', side_effect=failing):
+            stdout, stderr = self.run_import(path, batch_size=2, workers=2)
+        self.assertIn('Imported 5 videos', stdout)
+        self.assertIn('Row 3: upload failed: storage unavailable', stderr)
+        # Stops before the failed row, whatever came after
+        self.assertEqual(self.checkpoint(path), 2)
+
+        with mock.patch.object(import_videos, '_upload', wraps=upload) as uploads:
+            stdout, _ = self.run_import(path, batch_size=2)
+        self.assertIn('Resuming after row 2.', stdout)
+        self.assertIn('Imported 1 videos (3 already imported, 0 invalid, 0 failed to upload)', stdout)
+        self.assertEqual(uploads.call_count, 8)
+        self.assertEqual(self.checkpoint(path), 6)
+        self.assertEqual(sorted(Video.objects.values_list('title', flat=True)),
+                         [f'Imported {number}' for number in range(1, 7)])
+
+        stdout, _ = self.run_import(path)
+        self.assertIn('Imported 0 videos (0 already imported', stdout)
+        self.assertEqual(Video.objects.count(), 6)
+
+    def test_skips_imported_rows_without_a_checkpoint(self):
+        path = self.manifest([self.row(number) for number in range(1, 4)])
+        self.run_import(path)
+        os.remove(f'{path}.checkpoint')
+        with mock.patch.object(FileSystemStorage, 'save') as save:
+            stdout, _ = self.run_import(path)
+        # The files are there in full and the rows inserted
+        save.assert_not_called()
+        self.assertIn('Imported 0 videos (3 already imported', stdout)
+        self.assertEqual(Video.objects.count(), 3)
+
+        # A file cut short is uploaded again
+        video = Video.objects.get(title='Imported 2')
+        with open(video.video_file.path, 'r+b') as f:
+            f.truncate(10)
+        self.run_import(path, restart=True)
+        self.assertEqual(video.video_file.size, 1000)
+        self.assertEqual(Video.objects.count(), 3)
+
+    def test_checkpoint_of_another_manifest(self):
+        path = self.manifest([self.row(1)])
+        self.run_import(path)
+        self.manifest([self.row(1), self.row(2)])
+        with self.assertRaisesMessage(CommandError, 'is for a different manifest'):
+            self.run_import(path)
+
+        self.manifest([self.row(1)])
+        stdout, _ = self.run_import(path, restart=True)
+        self.assertIn('Imported 0 videos (1 already imported', stdout)
+
+
+@override_settings(**TEST_SETTINGS)
+class ChunkedUploadTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.creator = User.objects.create_user('uploader', 'uploader@example.com', 'pw', role=User.CREATOR)
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, ignore_errors=True)
+        settings_override = self.settings(MEDIA_ROOT=os.path.join(self.dir, 'media'),
+                                          CHUNKED_UPLOAD_DIR=os.path.join(self.dir, 'parts'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client.force_login(self.creator)
+        self.data = os.urandom(1000)
+
+    def upload(self):
+        """A session with every chunk of ``self.data`` received."""
+        response = self.client.post(reverse('upload_session_create'), json.dumps({
+            'kind': 'video', 'filename': 'clip.mp4', 'size': len(self.data), 'chunk_size': 512,
+        }), content_type='application/json', secure=True)
+        self.assertEqual(response.status_code, 201)
+        session = UploadSession.objects.get(pk=response.json()['id'])
+        # Out of order, as parallel clients send them
+        for index in (1, 0):
+            chunk = self.data[index * 512:(index + 1) * 512]
+            response = self.client.put(
+                reverse('upload_chunk', args=[session.pk, index]), chunk, content_type='application/octet-stream',
+                headers={'X-Chunk-Checksum': hashlib.sha256(chunk).hexdigest()}, secure=True,
+            )
+            self.assertEqual(response.status_code, 200, response.content)
+        return session
+
+    def commit(self, session):
+        return self.client.post(reverse('upload_session_commit', args=[session.pk]), secure=True)
+
+    def test_commit(self):
+        session = self.upload()
+        parts = chunked_upload.FileSystemChunkBackend()._session_dir(session)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.commit(session)
+        self.assertEqual(response.status_code, 200)
+        blob_name = response.json()['blob_name']
+        with default_storage.open(blob_name) as f:
+            self.assertEqual(f.read(), self.data)
+        session.refresh_from_db()
+        self.assertEqual((session.status, session.blob_name), (UploadSession.COMMITTED, blob_name))
+        self.assertFalse(os.path.exists(parts))
+        self.assertTrue(upload_tokens.is_claimed(self.creator, 'video', blob_name))
+
+        # Committing again is harmless; sending chunks is not
+        self.assertEqual(self.commit(session).json()['blob_name'], blob_name)
+        response = self.client.put(reverse('upload_chunk', args=[session.pk, 0]), self.data[:512],
+                                   content_type='application/octet-stream', secure=True)
+        self.assertEqual(response.status_code, 400)
+
+    def test_failed_commit_can_be_retried(self):
+        session = self.upload()
+        with mock.patch.object(FileSystemStorage, 'save', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                chunked_upload.commit_session(session)
+        session.refresh_from_db()
+        self.assertEqual(session.status, UploadSession.ACTIVE)
+        self.assertEqual(session.chunks.count(), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            blob_name = chunked_upload.commit_session(session)
+        with default_storage.open(blob_name) as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_commit_in_progress(self):
+        session = self.upload()
+        UploadSession.objects.filter(pk=session.pk).update(status=UploadSession.COMMITTING)
+        response = self.commit(session)
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('being committed', response.json()['error'])
+
+        # One that has been at it for too long died part way
+        UploadSession.objects.filter(pk=session.pk).update(
+            updated_at=timezone.now() - chunked_upload.COMMIT_TIMEOUT - timedelta(seconds=1),
+        )
+        self.assertEqual(self.commit(session).status_code, 200)
+
+
+@override_settings(**TEST_SETTINGS)
+class ViewCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.creator = User.objects.create_user('creator', 'creator@example.com', 'pw', role=User.CREATOR)
+        cls.video = make_video(cls.creator)
+        cls.other = make_video(cls.creator)
+
+    def setUp(self):
+        cache.clear()
+        # Buffer in the local-memory cache: this test is the only process
+        self.buffered = viewcounts.buffered
+        patcher = mock.patch.object(viewcounts, 'buffered', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def views(self, video):
+        return Video.objects.values_list('views', flat=True).get(pk=video.pk)
+
+    def test_written_through_without_a_shared_atomic_cache(self):
+        for backend, buffered in (('django.core.cache.backends.locmem.LocMemCache', False),
+                                  ('django.core.cache.backends.filebased.FileBasedCache', False),
+                                  ('django.core.cache.backends.redis.RedisCache', True)):
+            with override_settings(CACHES={'default': {'BACKEND': backend}}):
+                self.assertIs(self.buffered(), buffered, backend)
+
+        with mock.patch.object(viewcounts, 'buffered', self.buffered):
+            for _ in range(2):
+                viewcounts.record_view(self.video.pk)
+            self.assertEqual(self.views(self.video), 2)
+            self.assertEqual(VideoActivity.objects.get(video=self.video).views, 2)
+            self.assertEqual(viewcounts.pending_views(self.video.pk), 0)
+            self.assertEqual(viewcounts.flush(), 0)
+            self.assertEqual(self.views(self.video), 2)
+
+            response = self.client.get(reverse('video_detail', args=[self.video.pk]), secure=True)
+        self.assertEqual(response.context['video'].views, 3)
+        self.assertEqual(self.views(self.video), 3)
+
+    def test_buffer_and_flush(self):
+        for _ in range(3):
+            viewcounts.record_view(self.video.pk)
+        viewcounts.record_view(self.other.pk)
+        self.assertEqual(viewcounts.pending_views(self.video.pk), 3)
+        self.assertEqual(self.views(self.video), 0)
+
+        self.assertEqual(viewcounts.flush(), 4)
+        self.assertEqual((self.views(self.video), self.views(self.other)), (3, 1))
+        self.assertEqual(viewcounts.pending_views(self.video.pk), 0)
+        self.assertEqual(cache.get(viewcounts.INDEX_KEY), set())
+        self.assertEqual(VideoActivity.objects.get(video=self.video).views, 3)
+        self.assertEqual(viewcounts.flush(), 0)
+
+    def test_views_recorded_during_a_flush_are_kept(self):
+        viewcounts.record_view(self.video.pk)
+        viewcounts.record_view(self.video.pk)
+        buffer = caches['default']
+        get_many = buffer.get_many
+
+        def read_then_view(keys, *args, **kwargs):
+            counts = get_many(keys, *args, **kwargs)
+            viewcounts.record_view(self.video.pk)
+            return counts
+
+        with mock.patch.object(buffer, 'get_many', side_effect=read_then_view):
+            self.assertEqual(viewcounts.flush(), 2)
+        self.assertEqual(viewcounts.pending_views(self.video.pk), 1)
+        self.assertEqual(viewcounts.flush(), 1)
+        self.assertEqual(self.views(self.video), 3)
+
+    def test_registration_waits_out_an_abandoned_lock(self):
+        with mock.patch.object(viewcounts, 'LOCK_TIMEOUT', 0.05):
+            cache.add(viewcounts.LOCK_KEY, 'crashed flusher', timeout=0.1)
+            with self.assertLogs('videos.viewcounts', 'WARNING'):
+                viewcounts.record_view(self.video.pk)
+        self.assertEqual(cache.get(viewcounts.INDEX_KEY), {self.video.pk})
+        self.assertEqual(viewcounts.flush(), 1)
+
+    @override_settings(VIEW_COUNT_MAX_PENDING=3)
+    def test_bound_queues_a_flush(self):
+        jobs = Job.objects.filter(task=tasks.flush_views.name, unique_key='viewcounts:flush')
+        viewcounts.record_view(self.video.pk)
+        viewcounts.record_view(self.other.pk)
+        self.assertFalse(jobs.exists())
+        for _ in range(3):
+            viewcounts.record_view(self.video.pk)
+        self.assertEqual(jobs.count(), 1)
+        # Requests never write the views themselves
+        self.assertEqual(self.views(self.video), 0)
+        tasks.flush_views()
+        self.assertEqual((self.views(self.video), self.views(self.other)), (4, 1))
+
+
+def box(box_type, *payload):
+    data = b''.join(payload)
+    return struct.pack('>I4s', len(data) + 8, box_type) + data
+
+
+def full_box(box_type, *payload, version=0):
+    return box(box_type, bytes([version, 0, 0, 0]), *payload)
+
+
+def mp4_track(handler, entry, offsets, width=0, height=0, timescale=1000, duration=62500):
+    return box(
+        b'trak',
+        full_box(b'tkhd', bytes(72), struct.pack('>II', width << 16, height << 16)),
+        box(
+            b'mdia',
+            full_box(b'mdhd', struct.pack('>IIII', 0, 0, timescale, duration), bytes(4)),
+            full_box(b'hdlr', struct.pack('>I4s', 0, handler), bytes(13)),
+            box(b'minf', box(
+                b'stbl',
+                full_box(b'stsd', struct.pack('>I', 1), entry),
+                full_box(b'stco', struct.pack('>I', len(offsets)), struct.pack(f'>{len(offsets)}I', *offsets)),
+            )),
+        ),
+    )
+
+
+def mp4_moov(offsets, duration=62500):
+    """A moov with a 1920x1080 avc1 track and an mp4a track whose chunks start at ``offsets``."""
+    # Visual sample entry: the coded width and height follow 24 bytes of fields
+    avc1 = box(b'avc1', bytes(6), struct.pack('>H', 1), bytes(16), struct.pack('>HH', 1920, 1080), bytes(50))
+    return box(
+        b'moov',
+        full_box(b'mvhd', struct.pack('>IIII', 0, 0, 1000, duration), bytes(80)),
+        mp4_track(b'vide', avc1, offsets, 1920, 1080, timescale=90000, duration=duration * 90),
+        mp4_track(b'soun', box(b'mp4a', bytes(28)), offsets[:1]),
+    )
+
+
+FTYP = box(b'ftyp', b'isom', struct.pack('>I', 512), b'isomiso2avc1mp41')
+# Three chunks, each a different byte repeated
+CHUNKS = [bytes([index + 1]) * 100 for index in range(3)]
+
+
+def mp4_file(moov_first=False, duration=62500):
+    mdat = box(b'mdat', *CHUNKS)
+    if not moov_first:
+        offsets = [len(FTYP) + 8 + 100 * index for index in range(len(CHUNKS))]
+        return FTYP + mdat + mp4_moov(offsets, duration)
+    # The moov's size does not depend on the offset values
+    moov_size = len(mp4_moov([0] * len(CHUNKS)))
+    offsets = [len(FTYP) + moov_size + 8 + 100 * index for index in range(len(CHUNKS))]
+    return FTYP + mp4_moov(offsets, duration) + mdat
+
+
+class SparseReader(RangeReader):
+    """A file of ``size`` bytes that is zeros apart from ``pieces`` ({offset: bytes})."""
+
+    def __init__(self, size, pieces):
+        super().__init__(None, None)
+        self._size = size
+        self.pieces = pieces
+
+    def _fetch(self, offset, length):
+        data = bytearray(length)
+        for start, piece in self.pieces.items():
+            lo, hi = max(start, offset), min(start + len(piece), offset + length)
+            if lo < hi:
+                data[lo - offset:hi - offset] = piece[lo - start:hi - start]
+        return bytes(data)
+
+
+def chunk_offsets(data):
+    """Box type and chunk offsets of the first track of the MP4 ``data``."""
+    reader = mp4.BytesReader(data)
+    moov = next(box for box in mp4.read_boxes(reader) if box.type == b'moov')
+    stbl = mp4._find(reader, moov, b'trak', b'mdia', b'minf', b'stbl')
+    table = next(box for box in mp4._children(reader, stbl) if box.type in (b'stco', b'co64'))
+    return table.type, list(mp4._chunk_offsets(reader.read_at(table.offset, table.size))[1])
+
+
+class MP4Tests(SimpleTestCase):
+    def test_probe(self):
+        data = mp4_file()
+        info = mp4.probe(mp4.BytesReader(data))
+        self.assertEqual(info, {
+            'duration': 62.5, 'width': 1920, 'height': 1080, 'video_codec': 'avc1', 'audio_codec': 'mp4a',
+            'file_size': len(data), 'moov_offset': len(FTYP) + 8 + 300, 'faststart': False,
+            'bitrate': round(len(data) * 8 / 62.5),
+        })
+
+    def test_already_faststart(self):
+        reader = mp4.BytesReader(mp4_file(moov_first=True))
+        info = mp4.probe(reader)
+        self.assertTrue(info['faststart'])
+        self.assertEqual((info['moov_offset'], info['duration']), (len(FTYP), 62.5))
+        self.assertIsNone(mp4.FaststartLayout.plan(reader))
+
+    def test_faststart_layout(self):
+        data = mp4_file()
+        layout = mp4.FaststartLayout.plan(mp4.BytesReader(data))
+        rewritten = layout.read()
+        self.assertEqual(len(rewritten), layout.size)
+        self.assertEqual(rewritten, mp4_file(moov_first=True))
+        self.assertEqual(layout.read(), b'')
+
+        info = mp4.probe(mp4.BytesReader(rewritten))
+        self.assertEqual((info['faststart'], info['moov_offset']), (True, len(FTYP)))
+        self.assertEqual(info['duration'], 62.5)
+        # Every chunk offset still points at its chunk
+        box_type, offsets = chunk_offsets(rewritten)
+        self.assertEqual(box_type, b'stco')
+        for offset, chunk in zip(offsets, CHUNKS):
+            self.assertEqual(rewritten[offset:offset + 100], chunk)
+
+    def test_faststart_layout_in_small_reads(self):
+        data = mp4_file()
+        expected = mp4_file(moov_first=True)
+        layout = mp4.FaststartLayout.plan(mp4.BytesReader(data))
+        pieces = []
+        while piece := layout.read(7):
+            pieces.append(piece)
+        self.assertEqual(b''.join(pieces), expected)
+
+        # read() without a size goes to the end, however many blocks are left
+        with mock.patch.object(mp4, 'COPY_BLOCK_SIZE', 16):
+            layout = mp4.FaststartLayout.plan(mp4.BytesReader(data))
+            start = layout.read(10)
+            self.assertEqual(start + layout.read(-1), expected)
+
+    def test_chunk_offsets_past_4gb_become_co64(self):
+        # Media data reaching just past 4 GiB, with a chunk right below the limit
+        mdat_size = 0x100000000
+        mdat_header = struct.pack('>I4sQ', 1, b'mdat', mdat_size)
+        offsets = [len(FTYP) + 16, 0xFFFFFFF0]
+        moov = mp4_moov(offsets)
+        moov_offset = len(FTYP) + mdat_size
+        reader = SparseReader(moov_offset + len(moov), {0: FTYP + mdat_header, moov_offset: moov})
+
+        layout = mp4.FaststartLayout.plan(reader)
+        box_type, shifted = chunk_offsets(FTYP + layout.moov_bytes)
+        self.assertEqual(box_type, b'co64')
+        self.assertEqual(shifted, [offset + len(layout.moov_bytes) for offset in offsets])
+        self.assertGreater(len(layout.moov_bytes), len(moov))
+        self.assertEqual(layout.size, reader.size - len(moov) + len(layout.moov_bytes))
+
+    def test_truncated(self):
+        data = mp4_file()
+        for cut in (len(FTYP) + 50, len(data) - 20):
+            with self.subTest(cut=cut):
+                reader = mp4.BytesReader(data[:cut])
+                with self.assertRaises(mp4.MP4Error):
+                    mp4.probe(reader)
+                with self.assertRaises(mp4.MP4Error):
+                    mp4.FaststartLayout.plan(reader)
+
+    def test_no_moov(self):
+        reader = mp4.BytesReader(FTYP + box(b'mdat', *CHUNKS))
+        with self.assertRaisesMessage(mp4.MP4Error, 'No moov box'):
+            mp4.probe(reader)
+        with self.assertRaisesMessage(mp4.MP4Error, 'No moov box'):
+            mp4.FaststartLayout.plan(reader)
+
+    def test_not_mp4(self):
+        with self.assertRaises(mp4.MP4Error):
+            mp4.probe(mp4.BytesReader(b'\x1aE\xdf\xa3' + bytes(100)))
+
+
+@override_settings(**TEST_SETTINGS)
+class MediaInfoTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.creator = User.objects.create_user('creator', 'creator@example.com', 'pw', role=User.CREATOR)
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, ignore_errors=True)
+        settings_override = self.settings(MEDIA_ROOT=self.dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def video_with_file(self, data, name='videos/clip.mp4'):
+        return make_video(self.creator, video_file=default_storage.save(name, ContentFile(data)))
+
+    def test_probe_and_rewrite(self):
+        video = self.video_with_file(mp4_file())
+        original = video.video_file.name
+        self.assertTrue(media_info.probe_video(video.pk, rewrite=True))
+        video.refresh_from_db()
+        self.assertNotEqual(video.video_file.name, original)
+        self.assertEqual(video.probed_file, video.video_file.name)
+        self.assertFalse(default_storage.exists(original))
+        with video.video_file.open('rb') as f:
+            self.assertEqual(f.read(), mp4_file(moov_first=True))
+        self.assertEqual((video.duration, video.width, video.video_codec), (62.5, 1920, 'avc1'))
+        self.assertEqual((video.faststart, video.moov_offset), (True, len(FTYP)))
+        # Up to date now
+        self.assertFalse(media_info.probe_video(video.pk, rewrite=True))
+
+    def test_probe_without_rewrite(self):
+        video = self.video_with_file(mp4_file())
+        self.assertTrue(media_info.probe_video(video.pk, rewrite=False))
+        video.refresh_from_db()
+        self.assertEqual(video.probed_file, video.video_file.name)
+        self.assertFalse(video.faststart)
+
+    def test_not_mp4(self):
+        video = self.video_with_file(b'\x1aE\xdf\xa3' + bytes(100), name='videos/clip.webm')
+        self.assertTrue(media_info.probe_video(video.pk, rewrite=True))
+        video.refresh_from_db()
+        self.assertEqual((video.probed_file, video.file_size, video.duration), (video.video_file.name, 104, None))
+
+
+@override_settings(
+    RANKING_WEIGHTS={'views': 1.0, 'likes': 20.0, 'comments': 10.0, 'rating_sum': 2.0},
+    RANKING_HALF_LIFE_HOURS=12.0,
+    RANKING_WINDOW_DAYS=7,
+)
+class RankingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.creator = User.objects.create_user('creator', 'creator@example.com', 'pw', role=User.CREATOR)
+        cls.a, cls.b, cls.c = (make_video(cls.creator, title=title) for title in 'abc')
+
+    def setUp(self):
+        self.now = datetime(2026, 1, 10, 12, 30, tzinfo=dt_timezone.utc)
+        patcher = mock.patch.object(timezone, 'now', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def wait(self, **delta):
+        self.now += timedelta(**delta)
+
+    def record(self, video, hours_ago=0, **counts):
+        for field, n in counts.items():
+            VideoActivity.objects.record(field, {video.pk: n}, hour=current_hour(self.now) - hours_ago)
+
+    def scores(self):
+        return {video_id: (trending, top) for video_id, trending, top
+                in VideoRanking.objects.values_list('video_id', 'trending', 'top_week')}
+
+    def test_rescore(self):
+        self.record(self.a, views=10)
+        self.record(self.a, hours_ago=24, likes=1)
+        self.record(self.b, hours_ago=8 * 24, views=5)  # outside the window
+        VideoRanking.objects.create(video=self.b, trending=1, top_week=1, updated_at=self.now)
+
+        self.assertEqual(ranking.rescore([self.a.pk, self.b.pk]), 2)
+        tau = 12 / math.log(2)
+        trending, top = self.scores()[self.a.pk]
+        self.assertEqual(top, 30)
+        # Two half-lives back weighs a quarter
+        self.assertAlmostEqual(trending, math.log(10 + 20 / 4) + current_hour(self.now) / tau, places=6)
+        self.assertNotIn(self.b.pk, self.scores())
+
+    def test_update_rescores_only_what_changed(self):
+        self.record(self.a, views=1)
+        self.record(self.b, likes=1)
+        self.wait(hours=1)
+        self.assertEqual(ranking.update_rankings(), 2)
+        self.assertEqual(RankingUpdate.objects.get().started_at, self.now)
+
+        self.wait(hours=1)
+        # The watermark is in the database, not in a per-process cache
+        cache.clear()
+        with mock.patch.object(ranking, 'rescore', wraps=ranking.rescore) as rescore:
+            self.assertEqual(ranking.update_rankings(), 0)
+            self.record(self.c, comments=1)
+            self.wait(minutes=5)
+            self.assertEqual(ranking.update_rankings(), 1)
+        self.assertEqual(set(rescore.call_args.args[0]), {self.c.pk})
+        self.assertEqual(set(self.scores()), {self.a.pk, self.b.pk, self.c.pk})
+
+    def test_expired_buckets_drop_out_and_are_pruned(self):
+        self.record(self.a, views=1)
+        self.wait(days=3)
+        self.record(self.b, views=1)
+        self.wait(hours=1)
+        ranking.update_rankings()
+        self.assertEqual(set(self.scores()), {self.a.pk, self.b.pk})
+
+        self.wait(days=4)
+        self.assertEqual(ranking.update_rankings(), 1)
+        self.assertEqual(set(self.scores()), {self.b.pk})
+        # Kept until no later run can still look for it
+        self.assertTrue(VideoActivity.objects.filter(video=self.a).exists())
+
+        self.wait(days=7)
+        self.assertEqual(ranking.update_rankings(), 1)
+        self.assertEqual(self.scores(), {})
+        self.assertFalse(VideoActivity.objects.filter(video=self.a).exists())
+
+    def test_incremental_updates_match_a_rebuild(self):
+        self.record(self.a, hours_ago=200, views=50)
+        self.record(self.a, hours_ago=30, views=7, likes=2)
+        self.record(self.b, hours_ago=5, comments=3, rating_sum=9)
+        ranking.update_rankings()
+        self.wait(hours=20)
+        self.record(self.a, views=4)
+        self.record(self.c, likes=1)
+        self.record(self.c, likes=-1)  # unliked: no weight left
+        ranking.update_rankings()
+        self.wait(days=2, hours=3)
+        self.record(self.b, views=12)
+        self.wait(minutes=5)
+        ranking.update_rankings()
+        incremental = self.scores()
+
+        self.assertEqual(ranking.rebuild_rankings(), 3)
+        rebuilt = self.scores()
+        self.assertEqual(set(incremental), set(rebuilt))
+        for video_id, (trending, top) in rebuilt.items():
+            self.assertAlmostEqual(incremental[video_id][0], trending, places=6)
+            self.assertAlmostEqual(incremental[video_id][1], top, places=6)
+
+        # A rebuild moves the watermark on too
+        self.assertEqual(RankingUpdate.objects.get().started_at, self.now)
+        self.wait(hours=1)
+        self.assertEqual(ranking.update_rankings(), 0)
+
+
+@override_settings(**TEST_SETTINGS)
+class PaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.creator = User.objects.create_user('creator', 'creator@example.com', 'pw', role=User.CREATOR)
+        start = timezone.now() - timedelta(days=1)
+        for i in range(25):
+            video = make_video(cls.creator, title=f'Video {i}')
+            # Pairs share an upload date, so the id breaks the ties
+            Video.objects.filter(pk=video.pk).update(upload_date=start + timedelta(minutes=i // 2))
+        cls.ordered = list(Video.objects.order_by('-upload_date', '-id').values_list('pk', flat=True))
+
+    def paginator(self):
+        return CursorPaginator(Video.objects.all(), ('-upload_date', '-id'), per_page=10)
+
+    def ids(self, page):
+        return [video.pk for video in page]
+
+    def test_forward_and_back(self):
+        pages = [self.paginator().get_page()]
+        while pages[-1].has_next():
+            pages.append(self.paginator().get_page(pages[-1].next_cursor))
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual([pk for page in pages for pk in self.ids(page)], self.ordered)
+        self.assertFalse(pages[0].has_previous())
+        self.assertTrue(pages[1].has_previous())
+
+        # Back from the last page, through the same pages
+        page = pages[-1]
+        for expected in reversed(pages[:-1]):
+            page = self.paginator().get_page(page.prev_cursor)
+            self.assertEqual(self.ids(page), self.ids(expected))
+            self.assertTrue(page.has_next())
+        self.assertFalse(page.has_previous())
+
+    def test_previous_page_without_anything_after_it(self):
+        first = self.paginator().get_page()
+        second = self.paginator().get_page(first.next_cursor)
+        Video.objects.filter(pk__in=self.ordered[10:]).delete()
+        page = self.paginator().get_page(second.prev_cursor)
+        self.assertEqual(self.ids(page), self.ordered[:10])
+        self.assertFalse(page.has_next())
+        self.assertIsNone(page.next_cursor)
+
+    def test_invalid_cursor(self):
+        paginator = self.paginator()
+        other = CursorPaginator(Video.objects.all(), ('-id',)).encode_cursor(Video.objects.first(), 'n')
+        for cursor in ('junk', other, paginator.encode_cursor(Video.objects.first(), 'x')):
+            with self.assertRaises(InvalidCursor, msg=cursor):
+                paginator.get_page(cursor)
+
+    def test_list_api_keeps_numbered_pages_by_default(self):
+        for name in ('video_list_api', 'video_list_api_async'):
+            data = self.client.get(reverse(name), secure=True).json()
+            self.assertEqual((data['count'], data['num_pages']), (25, 3), name)
+            self.assertNotIn('next', data)
+            self.assertEqual([video['id'] for video in data['videos']], self.ordered[:10])
+            data = self.client.get(reverse(name), {'page': 3}, secure=True).json()
+            self.assertEqual([video['id'] for video in data['videos']], self.ordered[20:])
+
+    def test_list_api_cursor_pages(self):
+        for name in ('video_list_api', 'video_list_api_async'):
+            data = self.client.get(reverse(name), {'cursor': ''}, secure=True).json()
+            self.assertEqual(data['count'], 25, name)
+            self.assertIsNone(data['prev'])
+            self.assertNotIn('num_pages', data)
+            data = self.client.get(reverse(name), {'cursor': data['next'], 'count': 'none'}, secure=True).json()
+            self.assertEqual([video['id'] for video in data['videos']], self.ordered[10:20])
+            self.assertNotIn('count', data)
+            self.assertEqual(self.client.get(reverse(name), {'cursor': 'junk'}, secure=True).status_code, 400)
+
+
+@override_settings(**TEST_SETTINGS, THUMBNAIL_WIDTHS=[160, 320, 640])
+class ThumbnailTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.creator = User.objects.create_user('creator', 'creator@example.com', 'pw', role=User.CREATOR)
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = self.settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.video = self.make('thumbnails/wide.png')
+
+    def make(self, name, size=(400, 200)):
+        buffer = BytesIO()
+        Image.new('RGB', size, 'red').save(buffer, 'PNG')
+        name = default_storage.save(name, ContentFile(buffer.getvalue()))
+        return make_video(self.creator, thumbnail=name)
+
+    def refresh(self):
+        self.video.refresh_from_db()
+        return self.video
+
+    def test_variants(self):
+        self.assertTrue(thumbnails.generate_variants(self.video.pk))
+        variants = thumbnails.variants(self.refresh())
+        # Never upscaled: 640 becomes the source's own 400
+        self.assertEqual([(width, height) for width, height, _ in variants], [(160, 80), (320, 160), (400, 200)])
+        for width, height, files in variants:
+            for key, image_format in (('webp', 'WEBP'), ('jpeg', 'JPEG')):
+                with default_storage.open(files[key].name) as f, Image.open(f) as image:
+                    self.assertEqual((image.format, image.size), (image_format, (width, height)))
+
+    def test_idempotent(self):
+        thumbnails.generate_variants(self.video.pk)
+        recorded = self.refresh().thumbnail_variants
+        derived = os.path.join(settings.MEDIA_ROOT, 'thumbnails', 'derived', str(self.video.pk))
+        files = sorted(os.listdir(derived))
+        with mock.patch.object(FileSystemStorage, 'save') as save:
+            self.assertFalse(thumbnails.generate_variants(self.video.pk))
+        save.assert_not_called()
+        # Forced, the same names are overwritten rather than added to
+        self.assertTrue(thumbnails.generate_variants(self.video.pk, force=True))
+        self.assertEqual(self.refresh().thumbnail_variants, recorded)
+        self.assertEqual(sorted(os.listdir(derived)), files)
+
+    def test_replaced_source_is_not_recorded(self):
+        replacement = self.make('thumbnails/other.png')
+        render = thumbnails._render
+
+        def replace_then_render(*args):
+            Video.objects.filter(pk=self.video.pk).update(thumbnail=replacement.thumbnail.name)
+            return render(*args)
+
+        with mock.patch.object(thumbnails, '_render', side_effect=replace_then_render):
+            self.assertFalse(thumbnails.generate_variants(self.video.pk))
+        self.assertEqual(self.refresh().thumbnail_variants, {})
+        self.assertFalse(thumbnails.is_current(self.video))
+        self.assertTrue(thumbnails.generate_variants(self.video.pk))
+        self.assertEqual(self.refresh().thumbnail_variants['source'], replacement.thumbnail.name)
+
+    def test_command(self):
+        done = self.make('thumbnails/done.png')
+        thumbnails.generate_variants(done.pk)
+        broken = make_video(self.creator, thumbnail=default_storage.save('thumbnails/broken.png', ContentFile(b'no')))
+        out, err = StringIO(), StringIO()
+        call_command('generate_thumbnails', stdout=out, stderr=err)
+        self.assertIn('Generated thumbnails for 1 videos (1 failed).', out.getvalue())
+        self.assertIn(f'Video {broken.pk}:', err.getvalue())
+        self.assertTrue(thumbnails.is_current(self.refresh()))
+
+        out = StringIO()
+        call_command('generate_thumbnails', str(done.pk), '--force', stdout=out)
+        self.assertIn('Generated thumbnails for 1 videos (0 failed).', out.getvalue())
+
+    def test_webp_source_only_with_variants(self):
+        other = self.make('thumbnails/other.png')
+        url = reverse('video_detail', args=[other.pk])
+        response = self.client.get(url, secure=True)
+        self.assertNotContains(response, 'image/webp')
+        thumbnails.generate_variants(self.video.pk)
+        response = self.client.get(url, secure=True)
+        self.assertContains(response, 'type="image/webp"', count=1)
+        self.assertContains(response, '.webp')
+
+
+@override_settings(**TEST_SETTINGS)
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.creator = User.objects.create_user('stadiumfilms', 'creator@example.com', 'pw', role=User.CREATOR)
+        cls.football = make_video(cls.creator, title='Football highlights', description='Every goal of the season')
+        cls.cooking = make_video(cls.creator, title='Cooking pasta', description='Fresh tomato sauce',
+                                 genre='comedy', age_rating='PG')
+        cls.final = make_video(cls.creator, title='Cup final', description='Football at its best',
+                               producer='Goalpost Studio', age_rating='PG')
+        search.update_search_vectors(Video.objects.all())
+
+    def found(self, text, queryset=None):
+        return [video.pk for video in search.search(queryset or Video.objects.all(), text)]
+
+    def api(self, **params):
+        response = self.client.get(reverse('video_search_api'), params, secure=True)
+        return response.status_code, response.json()
+
+    def test_terms(self):
+        self.assertEqual(search.terms("Cup-final: it's  on!"), ['Cup', 'final', 'it', 's', 'on'])
+        self.assertEqual(len(search.terms(' '.join(['word'] * 20))), 10)
+        self.assertEqual(search.terms(None), [])
+
+    def test_every_word_must_match(self):
+        self.assertCountEqual(self.found('football'), [self.football.pk, self.final.pk])
+        self.assertEqual(self.found('football final'), [self.final.pk])
+        self.assertEqual(self.found('football pasta'), [])
+        self.assertEqual(self.found('  '), [])
+
+    def test_fields_and_prefix(self):
+        # Description, producer and the creator's username count too
+        self.assertEqual(self.found('tomato'), [self.cooking.pk])
+        self.assertEqual(self.found('goalpost'), [self.final.pk])
+        self.assertCountEqual(self.found('stadiumfilms'), [self.football.pk, self.cooking.pk, self.final.pk])
+        # The last word is matched as a prefix, the way a user types
+        self.assertEqual(self.found('cooking pas'), [self.cooking.pk])
+        self.assertCountEqual(self.found('footb'), [self.football.pk, self.final.pk])
+
+    def test_api_filters(self):
+        status, data = self.api(q='football', age_rating='PG')
+        self.assertEqual(status, 200)
+        self.assertEqual([video['id'] for video in data['videos']], [self.final.pk])
+        self.assertEqual((data['page'], data['next']), (1, None))
+        status, data = self.api(q='stadium', genre='comedy')
+        self.assertEqual([video['id'] for video in data['videos']], [self.cooking.pk])
+        self.assertEqual(self.api(q='football', genre='western')[0], 400)
+        self.assertEqual(self.api(q='football', age_rating='XXX')[0], 400)
+
+    def test_api_pages(self):
+        for i in range(20):
+            make_video(self.creator, title=f'Football replay {i}')
+        search.update_search_vectors(Video.objects.all())
+        status, data = self.api(q='football')
+        self.assertEqual((len(data['videos']), data['next']), (20, 2))
+        status, data = self.api(q='football', page=2)
+        self.assertEqual((len(data['videos']), data['next']), (2, None))
+        for page in (0, 51, 'x'):
+            self.assertEqual(self.api(q='football', page=page)[0], 400, page)
+
+    def test_renamed_creator_is_found(self):
+        self.creator.username = 'riverside'
+        self.creator.save()
+        self.assertCountEqual(self.found('riverside'), [self.football.pk, self.cooking.pk, self.final.pk])
+        self.assertEqual(self.found('stadiumfilms'), [])
+
+    @skipUnless(connection.vendor == 'postgresql', 'ranking needs PostgreSQL full-text search')
+    def test_ranked_by_weight(self):
+        # A title match (weight A) outranks a description match (weight B)
+        self.assertEqual(self.found('football'), [self.football.pk, self.final.pk])
+        results = list(search.search(Video.objects.all(), 'football'))
+        self.assertGreater(results[0].rank, results[1].rank)
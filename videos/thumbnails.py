@@ -0,0 +1,109 @@
+"""
+Thumbnail derivatives.
+
+After a video's thumbnail is saved, a background job renders it at each
+width in ``THUMBNAIL_WIDTHS`` as WebP and JPEG, stores the files next to the
+original and records them on ``Video.thumbnail_variants``:
+
+    {"source": "thumbnails/x.png",
+     "sizes": {"320": {"width": 320, "height": 180,
+                       "webp": "thumbnails/derived/7/1a2b3c4d_320.webp",
+                       "jpeg": "thumbnails/derived/7/1a2b3c4d_320.jpg"}, ...}}
+
+Jobs are idempotent: a video whose variants were already built from its
+current thumbnail is skipped, and derived file names are derived from the
+source name so a re-run overwrites rather than duplicates.
+"""
+import hashlib
+import io
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db.models.fields.files import FieldFile
+from PIL import Image, ImageOps
+
+from . import response_cache
+from .models import Video
+
+FORMATS = {
+    # key: (Pillow format, extension, save options)
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+def is_current(video):
+    variants = video.thumbnail_variants or {}
+    return bool(video.thumbnail) and variants.get('source') == video.thumbnail.name and bool(variants.get('sizes'))
+
+
+def _render(image, width, image_format, options):
+    height = max(1, round(image.height * width / image.width))
+    resized = image.resize((width, height), resample=Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    resized.save(buffer, format=image_format, **options)
+    return height, buffer.getvalue()
+
+
+def generate_variants(video_id, force=False):
+    """Build and record every derivative of a video's thumbnail. Returns True if work was done."""
+    video = Video.objects.only('id', 'thumbnail', 'thumbnail_variants').get(pk=video_id)
+    if not video.thumbnail or (is_current(video) and not force):
+        return False
+
+    source = video.thumbnail.name
+    storage = video.thumbnail.storage
+    with storage.open(source, 'rb') as original:
+        image = ImageOps.exif_transpose(Image.open(original))
+        image.load()
+    image = image.convert('RGB')
+
+    stem = hashlib.md5(source.encode()).hexdigest()[:8]
+    # Never upscale; a small source still gets (only) its own width
+    widths = sorted({min(width, image.width) for width in settings.THUMBNAIL_WIDTHS})
+    sizes = {}
+    for width in widths:
+        entry = {'width': width}
+        for key, (image_format, extension, options) in FORMATS.items():
+            height, data = _render(image, width, image_format, options)
+            name = f'thumbnails/derived/{video.pk}/{stem}_{width}.{extension}'
+            if storage.exists(name):
+                storage.delete(name)
+            entry['height'] = height
+            entry[key] = storage.save(name, ContentFile(data))
+        sizes[str(width)] = entry
+
+    # Only record the result if the thumbnail was not replaced meanwhile
+    updated = Video.objects.filter(pk=video.pk, thumbnail=source).update(
+        thumbnail_variants={'source': source, 'sizes': sizes}
+    )
+    if updated:
+        response_cache.bump_video_version(video.pk)
+        response_cache.bump_list_version()
+    return bool(updated)
+
+
+def schedule(video_id):
+    """Queue generation of a video's thumbnail variants for the job worker."""
+    from .tasks import generate_thumbnails
+
+    return generate_thumbnails.enqueue({'video_id': video_id}, unique_key=f'thumbnails:{video_id}')
+
+
+def variant_files(video):
+    """Every stored variant as a FieldFile, for bulk URL resolution."""
+    return [file for _, _, files in variants(video) for file in files.values()]
+
+
+def _sizes(video):
+    if not is_current(video):
+        return []
+    return sorted(video.thumbnail_variants['sizes'].values(), key=lambda entry: entry['width'])
+
+
+def variants(video):
+    """[(width, height, {format: FieldFile})] for the video's current variants."""
+    field = Video._meta.get_field('thumbnail')
+    return [
+        (entry['width'], entry['height'], {key: FieldFile(video, field, entry[key]) for key in FORMATS})
+        for entry in _sizes(video)
+    ]
@@ -0,0 +1,126 @@
+"""
+Blob-scoped upload tokens for direct browser uploads to Azure.
+
+The server picks the blob path for every upload and signs a SAS that can
+only create/write that one blob.  Tokens are cached per user and blob for
+most of their lifetime, so retries and refreshes reuse the same signature,
+and the path is remembered as a claim (an ``UploadClaim`` row) that
+``upload_video`` checks instead of trusting a client-supplied URL.
+"""
+import hashlib
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.core.cache import caches
+
+from azure.storage.blob import BlobSasPermissions, generate_blob_sas
+
+from .models import UploadClaim
+
+UPLOAD_KINDS = {
+    # kind: (blob prefix, allowed extensions)
+    'video': ('videos', {'.mp4', '.webm', '.mov', '.avi', '.wmv'}),
+    'thumbnail': ('thumbnails', {'.jpg', '.jpeg', '.png', '.webp', '.gif'}),
+}
+
+
+class UploadTokenError(ValueError):
+    pass
+
+
+def _cache():
+    return caches[settings.UPLOAD_TOKEN_CACHE_ALIAS]
+
+
+def _key(kind, user, blob_name):
+    digest = hashlib.md5(blob_name.encode()).hexdigest()
+    return f'upload:{kind}:{user.pk}:{digest}'
+
+
+def new_blob_name(user, kind, filename):
+    """Server-chosen, collision-free blob path for a new upload."""
+    if kind not in UPLOAD_KINDS:
+        raise UploadTokenError(f'Unknown upload kind: {kind}')
+    prefix, extensions = UPLOAD_KINDS[kind]
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension not in extensions:
+        raise UploadTokenError(f'Unsupported {kind} file type: {extension or "none"}')
+    return f'{prefix}/{user.pk}/{uuid.uuid4().hex}{extension}'
+
+
+def blob_url(blob_name):
+    return f'https://{settings.AZURE_CUSTOM_DOMAIN}/{settings.AZURE_CONTAINER}/{blob_name}'
+
+
+def issue_token(user, kind, blob_name):
+    """
+    Return a write-only SAS for ``blob_name``, reusing the cached one until
+    it is within ``UPLOAD_TOKEN_REUSE_MARGIN_SECS`` of expiring.
+    """
+    cache = _cache()
+    now = time.time()
+    token_key = _key('token', user, blob_name)
+    cached = cache.get(token_key)
+    if cached and cached['expires_at'] - settings.UPLOAD_TOKEN_REUSE_MARGIN_SECS > now:
+        return cached
+
+    lifetime = settings.UPLOAD_TOKEN_LIFETIME_SECS
+    expiry = datetime.now(timezone.utc) + timedelta(seconds=lifetime)
+    sas_token = generate_blob_sas(
+        account_name=settings.AZURE_ACCOUNT_NAME,
+        container_name=settings.AZURE_CONTAINER,
+        blob_name=blob_name,
+        account_key=settings.AZURE_ACCOUNT_KEY,
+        permission=BlobSasPermissions(create=True, write=True),
+        expiry=expiry,
+    )
+    token = {
+        'kind': kind,
+        'blob_name': blob_name,
+        'sas_token': sas_token,
+        'upload_url': f'{blob_url(blob_name)}?{sas_token}',
+        'expires_at': now + lifetime,
+    }
+    cache.set(token_key, token, timeout=lifetime - settings.UPLOAD_TOKEN_REUSE_MARGIN_SECS)
+    add_claim(user, kind, blob_name)
+    return token
+
+
+def add_claim(user, kind, blob_name):
+    """Record that ``blob_name`` was handed out to ``user`` for a ``kind`` upload."""
+    # The claim outlives the token so a slow form submit still validates
+    UploadClaim.objects.bulk_create(
+        [UploadClaim(blob_name=blob_name, user=user, kind=kind, claimed_at=datetime.now(timezone.utc))],
+        update_conflicts=True, unique_fields=['blob_name'], update_fields=['claimed_at'],
+    )
+
+
+def refresh_token(user, kind, blob_name):
+    """Token for a blob previously issued to ``user``, e.g. to resume an upload."""
+    if not is_claimed(user, kind, blob_name):
+        raise UploadTokenError('Unknown upload path')
+    return issue_token(user, kind, blob_name)
+
+
+def _claim_cutoff():
+    return datetime.now(timezone.utc) - timedelta(seconds=settings.UPLOAD_CLAIM_TIMEOUT)
+
+
+def is_claimed(user, kind, blob_name):
+    return bool(blob_name) and UploadClaim.objects.filter(
+        blob_name=blob_name, user=user, kind=kind, claimed_at__gt=_claim_cutoff(),
+    ).exists()
+
+
+def release_claim(user, blob_name):
+    UploadClaim.objects.filter(blob_name=blob_name, user=user).delete()
+    _cache().delete(_key('token', user, blob_name))
+
+
+def expire_claims():
+    """Delete the claims older than ``UPLOAD_CLAIM_TIMEOUT``. Returns how many."""
+    deleted, _ = UploadClaim.objects.filter(claimed_at__lte=_claim_cutoff()).delete()
+    return deleted
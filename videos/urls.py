@@ -7,7 +7,17 @@ urlpatterns = [
     path('video/<int:video_id>/', views.video_detail, name='video_detail'),
     path('video/<int:video_id>/like/', views.like_video, name='like_video'),
     path('api/videos/', views.video_list_api, name='video_list_api'),
+    path('api/videos/search/', views.video_search_api, name='video_search_api'),
+    path('api/videos/state/', views.video_state_api, name='video_state_api'),
     path('api/videos/<int:video_id>/', views.video_detail_api, name='video_detail_api'),
-    path('get-azure-sas-token/', views.get_azure_sas_token, name='get_azure_sas_token'),
+    path('api/videos/<int:video_id>/related/', views.video_related_api, name='video_related_api'),
+    # Async versions of the read API, for ASGI deployments
+    path('api/async/videos/', views.video_list_api_async, name='video_list_api_async'),
+    path('api/async/videos/<int:video_id>/', views.video_detail_api_async, name='video_detail_api_async'),
+    path('api/uploads/tokens/', views.upload_tokens, name='upload_tokens'),
+    path('api/uploads/', views.upload_session_create, name='upload_session_create'),
+    path('api/uploads/<uuid:session_id>/', views.upload_session_status, name='upload_session_status'),
+    path('api/uploads/<uuid:session_id>/chunks/<int:index>/', views.upload_chunk, name='upload_chunk'),
+    path('api/uploads/<uuid:session_id>/commit/', views.upload_session_commit, name='upload_session_commit'),
 
 ]
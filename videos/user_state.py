@@ -0,0 +1,49 @@
+"""
+The signed-in user's state on a set of videos: whether they liked each one
+and the stars they gave it.
+
+Loaded for any number of videos with one query for likes (served by the
+(customuser_id, video_id) index on the likes table) and one for ratings,
+instead of a query per video.  Pages that are cached for everyone carry no
+per-user state; clients fetch it for the videos on screen from
+``/api/videos/state/``.
+"""
+from .models import Rating, Video
+
+MAX_IDS = 100
+
+
+def liked_ids(user, video_ids):
+    """The ids among ``video_ids`` that ``user`` has liked."""
+    if not user.is_authenticated or not video_ids:
+        return set()
+    return set(
+        Video.likes.through.objects.filter(customuser_id=user.pk, video_id__in=video_ids)
+        .values_list('video_id', flat=True)
+    )
+
+
+def ratings(user, video_ids):
+    """{video id: stars} for the videos among ``video_ids`` that ``user`` has rated."""
+    if not user.is_authenticated or not video_ids:
+        return {}
+    return dict(Rating.objects.filter(user_id=user.pk, video_id__in=video_ids).values_list('video_id', 'rating'))
+
+
+def for_videos(user, video_ids):
+    """{video id: {"liked": bool, "rating": stars or None}} for every id in ``video_ids``."""
+    liked = liked_ids(user, video_ids)
+    stars = ratings(user, video_ids)
+    return {video_id: {'liked': video_id in liked, 'rating': stars.get(video_id)} for video_id in video_ids}
+
+
+def attach(videos, user, rating=True):
+    """Set ``is_liked`` (and with ``rating``, ``user_rating``) on each of ``videos``."""
+    video_ids = [video.pk for video in videos]
+    liked = liked_ids(user, video_ids)
+    stars = ratings(user, video_ids) if rating else {}
+    for video in videos:
+        video.is_liked = video.pk in liked
+        if rating:
+            video.user_rating = stars.get(video.pk)
+    return videos
@@ -0,0 +1,199 @@
+"""
+Write-behind view counting.
+
+Page views are buffered in the cache (per-video pending counters) and
+applied to ``Video.views`` in a single batched UPDATE by the ``flush_views``
+job, instead of saving the whole row on every hit.  The job runs every
+``VIEW_COUNT_FLUSH_INTERVAL`` seconds, and is queued right away once
+``VIEW_COUNT_MAX_PENDING`` views have piled up, which bounds what can be
+lost if the cache goes away.  Requests never flush themselves.
+
+Buffering needs a cache that every process shares, the job worker's
+included, and whose ``incr()`` is atomic: Redis or memcached.  With any
+other ``VIEW_COUNT_CACHE_ALIAS`` backend (local memory, where the job would
+never see the requests' buffers, or files, where ``incr()`` is a get and a
+set and entries are culled) each view is written straight to the database.
+Cached pages then show the new counts after their next version bump.
+"""
+import logging
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Case, F, Value, When
+
+from . import response_cache
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'viewcount'
+INDEX_KEY = f'{KEY_PREFIX}:index'
+LOCK_KEY = f'{KEY_PREFIX}:lock'
+TOTAL_KEY = f'{KEY_PREFIX}:total'
+
+LOCK_TIMEOUT = 10  # seconds a crashed flusher can hold the lock
+BATCH_SIZE = 500
+# Shared by every process, with an atomic incr()
+ATOMIC_BACKENDS = (
+    'django.core.cache.backends.redis.RedisCache',
+    'django.core.cache.backends.memcached.PyMemcacheCache',
+    'django.core.cache.backends.memcached.PyLibMCCache',
+)
+
+
+def _alias():
+    return getattr(settings, 'VIEW_COUNT_CACHE_ALIAS', 'default')
+
+
+def _cache():
+    return caches[_alias()]
+
+
+def buffered():
+    """Whether views are buffered, i.e. ``VIEW_COUNT_CACHE_ALIAS`` is shared and counts atomically."""
+    return settings.CACHES[_alias()]['BACKEND'] in ATOMIC_BACKENDS
+
+
+def _pending_key(video_id):
+    return f'{KEY_PREFIX}:pending:{video_id}'
+
+
+def _incr(cache, key, delta=1):
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        # Key expired or was never created; another process may win the add.
+        cache.add(key, 0, timeout=None)
+        return cache.incr(key, delta)
+
+
+class _IndexLock:
+    """Best-effort mutex around the index of dirty video ids."""
+
+    def __init__(self, cache, blocking=True):
+        self.cache = cache
+        self.blocking = blocking
+        self.token = uuid.uuid4().hex
+        self.acquired = False
+
+    def __enter__(self):
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while not self.cache.add(LOCK_KEY, self.token, timeout=LOCK_TIMEOUT):
+            if not self.blocking or time.monotonic() > deadline:
+                return self
+            time.sleep(0.005)
+        self.acquired = True
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.acquired and self.cache.get(LOCK_KEY) == self.token:
+            self.cache.delete(LOCK_KEY)
+
+
+def _register(cache, video_id):
+    """Add ``video_id`` to the index of videos with pending views."""
+    while True:
+        with _IndexLock(cache) as lock:
+            if lock.acquired:
+                index = cache.get(INDEX_KEY) or set()
+                index.add(video_id)
+                cache.set(INDEX_KEY, index, timeout=None)
+                return
+        # Only a holder that died keeps the lock this long, and it has expired now
+        logger.warning('Waited %d s for the view index lock; trying again', LOCK_TIMEOUT)
+
+
+def _add_pending(cache, video_id, count=1):
+    # The increment that takes a counter up from 0 registers the video in the
+    # index; flush() never drops an id whose counter is still non-zero.
+    if _incr(cache, _pending_key(video_id), count) == count:
+        _register(cache, video_id)
+    return _incr(cache, TOTAL_KEY, count)
+
+
+def record_view(video_id):
+    """Buffer one view of ``video_id``, or write it right away if views are not buffered."""
+    if not buffered():
+        from .models import Video, VideoActivity
+
+        Video.objects.filter(pk=video_id).update(views=F('views') + 1)
+        VideoActivity.objects.record('views', {video_id: 1})
+        return
+    total = _add_pending(_cache(), video_id)
+    if total == settings.VIEW_COUNT_MAX_PENDING:
+        # Write them out now rather than wait for the next periodic run
+        from .tasks import flush_views
+
+        flush_views.enqueue(unique_key='viewcounts:flush')
+
+
+def pending_views(video_id):
+    """Return the number of buffered, not yet flushed views for a video."""
+    return _cache().get(_pending_key(video_id)) or 0
+
+
+def flush(blocking=True):
+    """
+    Apply all buffered views to the database.
+
+    Returns the number of views written.  With ``blocking=False`` the call
+    returns 0 immediately if another process is already flushing.
+    """
+    from .models import Video, VideoActivity
+
+    cache = _cache()
+    with _IndexLock(cache, blocking=blocking) as lock:
+        if not lock.acquired:
+            return 0
+        index = cache.get(INDEX_KEY) or set()
+        if not index:
+            cache.set(TOTAL_KEY, 0, timeout=None)
+            return 0
+
+        keys = {_pending_key(video_id): video_id for video_id in index}
+        counts = {
+            keys[key]: count
+            for key, count in cache.get_many(list(keys)).items()
+            if count
+        }
+
+        # incr() is atomic on the buffering backends, so views recorded while
+        # we were reading are kept and their video stays in the index for the
+        # next flush.
+        remaining = set()
+        for video_id, count in counts.items():
+            if _incr(cache, _pending_key(video_id), -count) > 0:
+                remaining.add(video_id)
+        cache.set(INDEX_KEY, remaining, timeout=None)
+        flushed = sum(counts.values())
+        _incr(cache, TOTAL_KEY, -min(flushed, cache.get(TOTAL_KEY) or 0))
+
+    items = list(counts.items())
+    for start in range(0, len(items), BATCH_SIZE):
+        batch = items[start:start + BATCH_SIZE]
+        try:
+            Video.objects.filter(id__in=[video_id for video_id, _ in batch]).update(
+                views=F('views') + Case(
+                    *[When(id=video_id, then=Value(count)) for video_id, count in batch],
+                    default=Value(0),
+                )
+            )
+        except Exception:
+            # Put the unwritten views back so the next flush retries them.
+            logger.exception('Failed to flush buffered views')
+            for video_id, count in items[start:]:
+                _add_pending(cache, video_id, count)
+            return sum(count for _, count in items[:start])
+    try:
+        VideoActivity.objects.record('views', counts)
+    except Exception:
+        # The totals are written; only the rankings miss these views
+        logger.exception('Failed to record flushed views for the rankings')
+    if flushed:
+        # The new totals show up on cached pages, so retire those entries
+        for video_id, _ in items:
+            response_cache.bump_video_version(video_id)
+        response_cache.bump_list_version()
+        logger.info('Flushed %d buffered views for %d videos', flushed, len(items))
+    return flushed
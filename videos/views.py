@@ -1,59 +1,144 @@
-from datetime import datetime, timedelta
+import json
 import os
+from functools import partial
+from urllib.parse import urlencode
 
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
-from django.db.models import Avg
-from django.http import JsonResponse, HttpResponse
+from django.http import HttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
-from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_POST, require_GET
+from django.views.decorators.http import require_POST, require_GET, require_http_methods
 
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticatedOrReadOnly
-
-from azure.storage.blob import generate_container_sas, ContainerSasPermissions
+from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
 
 from .forms import VideoUploadForm, CommentForm, RatingForm
-from .models import Video, Comment, Rating
+from .models import Video, Comment, UploadSession
+from . import chunked_upload
+from .response_cache import cache_response
+from .pagination import CursorPaginator, InvalidCursor, estimate_count
+from .serializers import CommentSerializer, VideoDetailSerializer, VideoListSerializer, VideoSearchSerializer
+from snapshare import async_db
+from snapshare.cloud_storage import resolve_media_urls
+from snapshare.fastjson import JsonResponse, StreamingJsonResponse
+from snapshare.serialization import InvalidFields
+from . import upload_tokens as upload_tokens_service
+from . import ranking, recommendations, search, thumbnails, user_state, viewcounts
 from users.models import CustomUser
 
 
+HOME_HEADINGS = {'latest': 'Latest Videos', 'trending': 'Trending', 'top': 'Top This Week'}
+
+
+@cache_response('home', anonymous_only=True)
 def home(request):
-    latest_videos = Video.objects.select_related('creator').order_by('-upload_date')[:10]
-    return render(request, 'videos/home.html', {'latest_videos': latest_videos})
-@require_GET
+    # ?sort=trending|top shows a ranked feed instead of the latest uploads
+    sort = request.GET.get('sort', 'latest')
+    if sort not in ranking.SORTS:
+        sort = 'latest'
+    videos, ordering = ranking.feed(Video.objects.select_related('creator'), sort)
+    latest_videos = list(videos.order_by(*ordering)[:10])
+    resolve_media_urls([
+        file for video in latest_videos
+        for file in [video.thumbnail] + thumbnails.variant_files(video)
+    ])
+    # One query for the like buttons instead of one per video
+    user_state.attach(latest_videos, request.user, rating=False)
+    return render(request, 'videos/home.html', {
+        'latest_videos': latest_videos,
+        'sort': sort,
+        'heading': HOME_HEADINGS[sort],
+        'headings': HOME_HEADINGS,
+    })
+@require_POST
 @login_required
-@csrf_exempt
-def get_azure_sas_token(request):
+def upload_tokens(request):
     """
-    Generate a SAS token for Azure Blob Storage uploads
+    Issue blob-scoped upload tokens for several files in one round trip.
+
+    Expects {"files": [{"kind": "video", "filename": "clip.mp4"}, ...]}; an
+    entry with a "blob_name" instead refreshes the token of an upload that
+    was already started.
     """
+    if not request.user.is_creator():
+        return JsonResponse({'error': 'Only creators can upload videos.'}, status=403)
+    try:
+        tokens = []
+        for item in json.loads(request.body)['files']:
+            kind = item.get('kind')
+            if item.get('blob_name'):
+                token = upload_tokens_service.refresh_token(request.user, kind, item['blob_name'])
+            else:
+                blob_name = upload_tokens_service.new_blob_name(request.user, kind, item.get('filename'))
+                token = upload_tokens_service.issue_token(request.user, kind, blob_name)
+            tokens.append(token)
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        return JsonResponse({'error': f'Invalid upload token request: {e}'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': f'Failed to generate upload token: {str(e)}'}, status=500)
+
+    return JsonResponse({'tokens': tokens})
+
+def _upload_session_for(request, session_id):
+    return get_object_or_404(UploadSession, pk=session_id, user=request.user)
+
+
+@require_POST
+@login_required
+def upload_session_create(request):
+    """Start a resumable chunked upload: {"kind", "filename", "size", "chunk_size"?}."""
+    if not request.user.is_creator():
+        return JsonResponse({'error': 'Only creators can upload videos.'}, status=403)
     try:
-        # Create a SAS token that allows writing to the container
-        sas_permissions = ContainerSasPermissions(
-            read=True, write=True, delete=False, list=True, add=True, create=True
+        payload = json.loads(request.body)
+        session = chunked_upload.start_session(
+            request.user,
+            payload.get('kind', 'video'),
+            payload.get('filename'),
+            payload.get('size'),
+            payload.get('chunk_size'),
         )
-        
-        # Set expiry time (1 hour from now)
-        expiry_time = datetime.utcnow() + timedelta(hours=1)
-        
-        # Generate SAS token
-        sas_token = generate_container_sas(
-            account_name=settings.AZURE_ACCOUNT_NAME,
-            container_name=settings.AZURE_CONTAINER,
-            account_key=settings.AZURE_ACCOUNT_KEY,
-            permission=sas_permissions,
-            expiry=expiry_time
+    except (ValueError, TypeError, AttributeError) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(chunked_upload.session_status(session), status=201)
+
+
+@require_GET
+@login_required
+def upload_session_status(request, session_id):
+    session = _upload_session_for(request, session_id)
+    return JsonResponse(chunked_upload.session_status(session))
+
+
+@require_http_methods(['PUT'])
+@login_required
+def upload_chunk(request, session_id, index):
+    """Stream one chunk from the raw request body; X-Chunk-Checksum is its hex SHA-256."""
+    session = _upload_session_for(request, session_id)
+    try:
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        chunk = chunked_upload.put_chunk(
+            session, index, request, content_length,
+            checksum=request.headers.get('X-Chunk-Checksum'),
         )
-        
-        return JsonResponse({'sasToken': sas_token})
-    
-    except Exception as e:
-        return JsonResponse({'error': f'Failed to generate SAS token: {str(e)}'}, status=500)
-        
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'index': chunk.index, 'offset': chunk.offset, 'size': chunk.size, 'checksum': chunk.checksum})
+
+
+@require_POST
+@login_required
+def upload_session_commit(request, session_id):
+    session = _upload_session_for(request, session_id)
+    try:
+        blob_name = chunked_upload.commit_session(session)
+    except chunked_upload.ChunkError as e:
+        return JsonResponse({'error': str(e)}, status=409)
+    return JsonResponse({'blob_name': blob_name, 'kind': session.kind})
+
+
 @login_required
 def upload_video(request):
     if not request.user.is_creator():
@@ -61,22 +146,24 @@ def upload_video(request):
         return redirect('home')
    
     if request.method == 'POST':
-        form = VideoUploadForm(request.POST)
+        # Blob paths of files the browser already uploaded directly to Azure;
+        # only paths this server issued to this user are accepted
+        uploaded = {
+            field: blob_name
+            for field, kind in (('video_file', 'video'), ('thumbnail', 'thumbnail'))
+            for blob_name in [request.POST.get(f'{kind}_blob')]
+            if upload_tokens_service.is_claimed(request.user, kind, blob_name)
+        }
+        form = VideoUploadForm(request.POST, request.FILES, uploaded=uploaded)
         if form.is_valid():
             video = form.save(commit=False)
             video.creator = request.user
-            
-            # Get Azure URLs from hidden fields
-            azure_video_url = request.POST.get('azure_video_url')
-            azure_thumbnail_url = request.POST.get('azure_thumbnail_url')
-            
-            if azure_video_url:
-                video.video_file.name = azure_video_url.replace(f'https://{settings.AZURE_ACCOUNT_NAME}.blob.core.windows.net/{settings.AZURE_CONTAINER}/', '')
-            
-            if azure_thumbnail_url:
-                video.thumbnail.name = azure_thumbnail_url.replace(f'https://{settings.AZURE_ACCOUNT_NAME}.blob.core.windows.net/{settings.AZURE_CONTAINER}/', '')
+            for field, blob_name in uploaded.items():
+                getattr(video, field).name = blob_name
             
             video.save()
+            for blob_name in uploaded.values():
+                upload_tokens_service.release_claim(request.user, blob_name)
             messages.success(request, 'Video uploaded successfully!')
             return redirect('video_detail', video_id=video.id)
     else:
@@ -85,40 +172,55 @@ def upload_video(request):
 def video_detail(request, video_id):
     video = get_object_or_404(Video.objects.select_related('creator'), id=video_id)
     
-    # Fetch comments with pagination
-    comments = video.comments.select_related('user').order_by('-created_at')
-    paginator = Paginator(comments, 10)  # 10 comments per page
-    page_number = request.GET.get('page', 1)
-    comments_page = paginator.get_page(page_number)
+    # Fetch comments with pagination; ?page= keeps the old numbered pages,
+    # otherwise comments are paged by cursor on (created_at, id)
+    comments = video.comments.select_related('user')
+    comments_prev_url = comments_next_url = None
+    if 'page' in request.GET:
+        paginator = Paginator(comments.order_by('-created_at', '-id'), 10)  # 10 comments per page
+        comments_page = paginator.get_page(request.GET.get('page'))
+        if comments_page.has_previous():
+            comments_prev_url = f'?page={comments_page.previous_page_number()}'
+        if comments_page.has_next():
+            comments_next_url = f'?page={comments_page.next_page_number()}'
+    else:
+        paginator = CursorPaginator(comments, ('-created_at', '-id'), per_page=10)
+        try:
+            comments_page = paginator.get_page(request.GET.get('cursor'))
+        except InvalidCursor:
+            comments_page = paginator.get_page()
+        if comments_page.has_previous():
+            comments_prev_url = f'?{urlencode({"cursor": comments_page.prev_cursor})}'
+        if comments_page.has_next():
+            comments_next_url = f'?{urlencode({"cursor": comments_page.next_cursor})}'
     
-    # Calculate average rating
-    average_rating = video.ratings.aggregate(Avg('rating'))['rating__avg']
+    # Average rating comes from the stored rating totals
+    average_rating = video.average_rating
     
     # Fetch other videos by the creator (excluding the current video)
-    creator_videos = video.creator.videos.select_related('creator').exclude(id=video.id).order_by('-upload_date')[:3]
+    creator_videos = list(video.creator.videos.select_related('creator').exclude(id=video.id).order_by('-upload_date')[:3])
+    # Precomputed by videos.recommendations
+    related_videos = list(recommendations.related(Video.objects.select_related('creator'), video.id)[:5])
+    resolve_media_urls([
+        file for shown in [video] + creator_videos + related_videos
+        for file in [shown.thumbnail] + thumbnails.variant_files(shown)
+    ] + [video.video_file])
     
-    # Increment view count
-    video.views += 1
-    video.save()
+    # Buffer the view; it is written to the database in a later batch
+    viewcounts.record_view(video.id)
+    video.views += viewcounts.pending_views(video.id) if viewcounts.buffered() else 1
    
     if request.method == 'POST' and request.user.is_authenticated:
         comment_form = CommentForm(request.POST)
         rating_form = RatingForm(request.POST)
        
         if 'comment_submit' in request.POST and comment_form.is_valid():
-            comment = comment_form.save(commit=False)
-            comment.video = video
-            comment.user = request.user
-            comment.save()
+            video.add_comment(request.user, comment_form.cleaned_data['text'])
             messages.success(request, 'Comment posted successfully!')
             return redirect('video_detail', video_id=video.id)
        
         if 'rating_submit' in request.POST and rating_form.is_valid():
-            rating, created = Rating.objects.update_or_create(
-                video=video,
-                user=request.user,
-                defaults={'rating': rating_form.cleaned_data['rating']}
-            )
+            video.rate(request.user, rating_form.cleaned_data['rating'])
             messages.success(request, 'Rating submitted successfully!')
             return redirect('video_detail', video_id=video.id)
     else:
@@ -126,116 +228,252 @@ def video_detail(request, video_id):
         rating_form = RatingForm()
    
     # Check if user has already rated and liked
-    user_rating = None
-    is_liked = False
-    if request.user.is_authenticated:
-        try:
-            user_rating = Rating.objects.get(video=video, user=request.user).rating
-        except Rating.DoesNotExist:
-            pass
-       
-        is_liked = video.likes.filter(id=request.user.id).exists()
-   
+    user_state.attach([video], request.user)
+
     return render(request, 'videos/detail.html', {
         'video': video,
         'comments': comments_page,
+        'comments_prev_url': comments_prev_url,
+        'comments_next_url': comments_next_url,
         'comment_form': comment_form,
         'rating_form': rating_form,
         'average_rating': average_rating,
-        'user_rating': user_rating,
-        'is_liked': is_liked,
+        'user_rating': video.user_rating,
+        'is_liked': video.is_liked,
         'total_likes': video.total_likes(),
         'creator_videos': creator_videos,
+        'related_videos': related_videos,
     })
 
 @require_POST
 @login_required
 def like_video(request, video_id):
     video = get_object_or_404(Video, id=video_id)
-    if video.likes.filter(id=request.user.id).exists():
-        video.likes.remove(request.user)
-        liked = False
-    else:
-        video.likes.add(request.user)
-        liked = True
+    liked = video.toggle_like(request.user)
    
     return JsonResponse({
         'liked': liked,
         'total_likes': video.total_likes()
     })
 
-def get_azure_media_url(file_field):
-    """Helper function to get Azure Blob Storage URL for media files"""
-    if not file_field:
-        return None
-    
-    # If using Azure Storage, the file_field.url will already be the Azure URL
-    # due to our DEFAULT_FILE_STORAGE setting
-    return file_field.url
-
 @api_view(['GET'])
 @permission_classes([IsAuthenticatedOrReadOnly])
+@cache_response('video_list_api')
 def video_list_api(request):
-    videos = Video.objects.select_related('creator').order_by('-upload_date')
-    paginator = Paginator(videos, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-   
+    try:
+        serializer = VideoListSerializer.from_request(request)
+    except InvalidFields as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    # upload_date and id are always loaded because the cursor is built from them
+    videos = serializer.prepare(Video.objects.all(), extra_only=('upload_date',))
+    # ?sort=latest|trending|top; the ranked feeds are ordered by a precomputed score
+    try:
+        videos, ordering = ranking.feed(videos, request.GET.get('sort', 'latest'))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    # Numbered pages, with the exact count and num_pages existing clients
+    # expect, unless the client opts in to cursor pages with ?cursor= (empty
+    # for the first page)
+    if 'cursor' not in request.GET:
+        paginator = Paginator(videos.order_by(*ordering), 10)
+        page_obj = paginator.get_page(request.GET.get('page'))
+        pagination = {
+            'count': paginator.count,
+            'num_pages': paginator.num_pages,
+        }
+    else:
+        paginator = CursorPaginator(videos, ordering, per_page=10)
+        try:
+            page_obj = paginator.get_page(request.GET.get('cursor'))
+        except InvalidCursor as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        pagination = {
+            'next': page_obj.next_cursor,
+            'prev': page_obj.prev_cursor,
+        }
+        # ?count=exact|estimate|none; the estimate avoids a full COUNT(*)
+        count_mode = request.GET.get('count', 'estimate')
+        if count_mode == 'exact':
+            pagination['count'] = videos.count()
+        elif count_mode == 'estimate':
+            pagination['count'] = estimate_count(videos)
+
     data = {
-        'videos': [
-            {
-                'id': video.id,
-                'title': video.title,
-                'description': video.description,
-                'thumbnail_url': get_azure_media_url(video.thumbnail),
-                'creator': video.creator.username,
-                'views': video.views,
-                'likes': video.total_likes(),
-                'upload_date': video.upload_date,
-            }
-            for video in page_obj
-        ],
-        'count': paginator.count,
-        'num_pages': paginator.num_pages,
+        'videos': serializer.many(page_obj),
+        **pagination,
     }
     return JsonResponse(data)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticatedOrReadOnly])
-def video_detail_api(request, video_id):
-    video = get_object_or_404(Video.objects.select_related('creator'), id=video_id)
-    comments = video.comments.select_related('user').order_by('-created_at')
-    ratings = video.ratings.all()
-   
+@cache_response('video_search_api')
+def video_search_api(request):
+    """Full-text search: ?q= (last word matches as a prefix), ?genre=, ?age_rating=, ?page=."""
+    try:
+        serializer = VideoSearchSerializer.from_request(request)
+    except InvalidFields as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    videos = serializer.prepare(Video.objects.all(), extra_only=('upload_date',))
+
+    for param, choices in (('genre', Video.GENRE_CHOICES), ('age_rating', Video.AGE_RATING_CHOICES)):
+        value = request.GET.get(param)
+        if value:
+            if value not in dict(choices):
+                return JsonResponse({'error': f'Invalid {param}: {value}'}, status=400)
+            videos = videos.filter(**{param: value})
+
+    try:
+        page = int(request.GET.get('page', 1))
+    except ValueError:
+        page = 0
+    if not 1 <= page <= 50:
+        return JsonResponse({'error': 'page must be between 1 and 50'}, status=400)
+
+    # One extra row tells whether there is a next page without a COUNT(*)
+    per_page = 20
+    rows = list(search.search(videos, request.GET.get('q'))[(page - 1) * per_page:page * per_page + 1])
     data = {
-        'video': {
-            'id': video.id,
-            'title': video.title,
-            'description': video.description,
-            'video_url': get_azure_media_url(video.video_file),
-            'thumbnail_url': get_azure_media_url(video.thumbnail),
-            'creator': {
-                'id': video.creator.id,
-                'username': video.creator.username,
-            },
-            'publisher': video.publisher,
-            'producer': video.producer,
-            'genre': video.get_genre_display(),
-            'age_rating': video.get_age_rating_display(),
-            'views': video.views,
-            'likes': video.total_likes(),
-            'upload_date': video.upload_date,
-        },
-        'comments': [
-            {
-                'id': comment.id,
-                'user': comment.user.username,
-                'text': comment.text,
-                'created_at': comment.created_at,
-            }
-            for comment in comments
-        ],
-        'average_rating': ratings.aggregate(Avg('rating'))['rating__avg'],
-        'rating_count': ratings.count(),
+        'videos': serializer.many(rows[:per_page]),
+        'page': page,
+        'next': page + 1 if len(rows) > per_page else None,
     }
     return JsonResponse(data)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticatedOrReadOnly])
+@cache_response('video_detail_api', per_video=True)
+def video_detail_api(request, video_id):
+    try:
+        serializer = VideoDetailSerializer.from_request(request)
+    except InvalidFields as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    videos = serializer.prepare(Video.objects.all(), extra_only=('rating_sum', 'rating_count', 'comment_count'))
+    video = get_object_or_404(videos, id=video_id)
+    comment_serializer = CommentSerializer()
+    comments = comment_serializer.prepare(Comment.objects.filter(video_id=video.id)).order_by('-created_at')
+
+    # Heavily commented videos are streamed from a chunked cursor instead
+    # of being built in memory (and are therefore not cached)
+    stream = video.comment_count > settings.API_STREAM_COMMENTS_OVER
+    if stream:
+        # Pinned now: the rows are read after the view has returned
+        comments = comments.using(comments.db).iterator(chunk_size=1000)
+        comments = map(comment_serializer.to_dict, comments)
+    else:
+        comments = comment_serializer.many(comments)
+
+    data = {
+        'video': serializer.to_dict(video),
+        'comments': comments,
+        'average_rating': video.average_rating,
+        'rating_count': video.rating_count,
+    }
+    return StreamingJsonResponse(data) if stream else JsonResponse(data)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def video_state_api(request):
+    """
+    The current user's like and rating of each video in ?ids=1,2,3 (at most
+    100), for list pages whose cached cards carry no per-user state.
+    """
+    try:
+        video_ids = list(dict.fromkeys(int(value) for value in request.GET.get('ids', '').split(',') if value.strip()))
+    except ValueError:
+        return JsonResponse({'error': 'ids must be a comma-separated list of video ids'}, status=400)
+    if not 1 <= len(video_ids) <= user_state.MAX_IDS:
+        return JsonResponse({'error': f'Pass between 1 and {user_state.MAX_IDS} ids'}, status=400)
+    states = user_state.for_videos(request.user, video_ids)
+    return JsonResponse({'videos': {str(video_id): state for video_id, state in states.items()}})
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticatedOrReadOnly])
+@cache_response('video_related_api', per_video=True)
+def video_related_api(request, video_id):
+    """Videos like this one (?limit=, at most 20); empty for unknown videos and ones without likes."""
+    try:
+        serializer = VideoListSerializer.from_request(request)
+    except InvalidFields as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    try:
+        limit = int(request.GET.get('limit', 10))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= 20:
+        return JsonResponse({'error': 'limit must be between 1 and 20'}, status=400)
+    videos = recommendations.related(serializer.prepare(Video.objects.all()), video_id)[:limit]
+    return JsonResponse({'videos': serializer.many(videos)})
+
+
+# ASGI read path: async versions of the list and detail API. Their queries
+# run on snapshare.async_db's pool, the independent ones concurrently. The
+# DRF decorators above do not support async views; these only need
+# session authentication, which Django's middleware already provides.
+
+@require_GET
+@cache_response('video_list_api')
+async def video_list_api_async(request):
+    """video_list_api for ASGI; the page and the count are fetched at the same time."""
+    try:
+        serializer = VideoListSerializer.from_request(request)
+    except InvalidFields as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    videos = serializer.prepare(Video.objects.all(), extra_only=('upload_date',))
+    try:
+        videos, ordering = ranking.feed(videos, request.GET.get('sort', 'latest'))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    if 'cursor' not in request.GET:
+        def load_numbered_page():
+            paginator = Paginator(videos.order_by(*ordering), 10)
+            page_obj = paginator.get_page(request.GET.get('page'))
+            return serializer.many(page_obj), {'count': paginator.count, 'num_pages': paginator.num_pages}
+
+        serialized, pagination = await async_db.run(load_numbered_page)
+        return JsonResponse({'videos': serialized, **pagination})
+
+    paginator = CursorPaginator(videos, ordering, per_page=10)
+
+    def load_page():
+        page_obj = paginator.get_page(request.GET.get('cursor'))
+        return page_obj, serializer.many(page_obj)
+
+    count_mode = request.GET.get('count', 'estimate')
+    count = {'exact': videos.count, 'estimate': partial(estimate_count, videos)}.get(count_mode)
+    try:
+        (page_obj, serialized), total = await async_db.gather(load_page, count)
+    except InvalidCursor as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    pagination = {'next': page_obj.next_cursor, 'prev': page_obj.prev_cursor}
+    if count is not None:
+        pagination['count'] = total
+    return JsonResponse({'videos': serialized, **pagination})
+
+
+@require_GET
+@cache_response('video_detail_api', per_video=True)
+async def video_detail_api_async(request, video_id):
+    """video_detail_api for ASGI; the video and its comments are fetched at the same time."""
+    try:
+        serializer = VideoDetailSerializer.from_request(request)
+    except InvalidFields as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    videos = serializer.prepare(Video.objects.all(), extra_only=('rating_sum', 'rating_count'))
+    comment_serializer = CommentSerializer()
+    comments = comment_serializer.prepare(Comment.objects.filter(video_id=video_id)).order_by('-created_at')
+
+    def load_video():
+        video = get_object_or_404(videos, id=video_id)
+        return serializer.to_dict(video), video.average_rating, video.rating_count
+
+    (video, average_rating, rating_count), comments = await async_db.gather(
+        load_video, partial(comment_serializer.many, comments),
+    )
+    return JsonResponse({
+        'video': video,
+        'comments': comments,
+        'average_rating': average_rating,
+        'rating_count': rating_count,
+    })